@@ -0,0 +1,17 @@
+import sys
+import time
+from tx.parallex import run_python
+from tx.parallex.backend import BACKENDS
+
+
+# runs spec.py with each executor, an executor that is not available is skipped
+number_of_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+
+for executor in BACKENDS:
+    start_time = time.time()
+    try:
+        run_python(number_of_workers, "profile/spec.py", "profile/data.yaml", validate_spec=False, executor=executor)
+    except RuntimeError as e:
+        print(f"{executor}: skipped, {e}")
+        continue
+    print(f"{executor}: {time.time() - start_time:.3f}s")
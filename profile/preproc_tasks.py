@@ -0,0 +1,33 @@
+import sys
+import time
+from copy import deepcopy
+from tx.parallex.spec import dict_to_spec, dependency_graph, remove_unreachable_tasks, preproc_tasks
+
+
+# a top spec with n python tasks, every task depends on the previous two, every tenth task is returned, and a quarter of the tasks are not used
+def generate_spec(n):
+    live = n - n // 4
+    sub = []
+    for i in range(n):
+        params = {k: {"name": f"a{j}"} for k, j in enumerate(range(max(0, i - 2), i)) if (i < live) == (j < live)}
+        sub.append({"type": "python", "name": f"a{i}", "mod": "operator", "func": "add", "params": params})
+        if i < live and i % 10 == 0:
+            sub.append({"type": "ret", "obj": {"name": f"a{i}"}})
+    return dict_to_spec({"type": "top", "sub": sub})
+
+
+sizes = [int(x) for x in sys.argv[1:]] or [500, 1000, 2000, 5000]
+
+for n in sizes:
+    spec = generate_spec(n)
+    spec_graph = deepcopy(spec)
+    start_time = time.time()
+    dg, ret_ids = dependency_graph(set(), spec_graph)
+    graph_time = time.time() - start_time
+    start_time = time.time()
+    remove_unreachable_tasks(dg, ret_ids, spec_graph)
+    remove_time = time.time() - start_time
+    start_time = time.time()
+    preproc_tasks(set(), spec)
+    preproc_time = time.time() - start_time
+    print(f"{n} tasks: dependency_graph {graph_time:.3f}s, remove_unreachable_tasks {remove_time:.3f}s, preproc_tasks {preproc_time:.3f}s")
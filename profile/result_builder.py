@@ -0,0 +1,24 @@
+import sys
+import time
+from tempfile import mkstemp
+import os
+from tx.functional.either import Right
+from tx.parallex.io import FileRecordWriter, read_from_disk
+
+serializer = sys.argv[1] if len(sys.argv) > 1 else "pickle"
+
+for n in [10000, 100000, 1000000, 4000000]:
+    fd, path = mkstemp()
+    os.close(fd)
+    try:
+        with open(path, "wb") as output:
+            writer = FileRecordWriter(output, serializer)
+            for i in range(n):
+                writer.write_record({f"{i}.0": Right(i)})
+        start_time = time.time()
+        result = read_from_disk(path, serializer)
+        duration = time.time() - start_time
+        assert len(result) == n
+        print(f"{n} records: {duration:.3f}s, {duration / n * 1e6:.3f}us per record")
+    finally:
+        os.remove(path)
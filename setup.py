@@ -33,6 +33,12 @@ with open("README.md", "r") as fh:
         extras_require={
             "arrow": [
                 "pyarrow==1.0.0"
+            ],
+            "numpy": [
+                "numpy"
+            ],
+            "msgpack": [
+                "msgpack"
             ]
         },
         classifiers=[
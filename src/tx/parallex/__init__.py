@@ -1,5 +1,9 @@
 import sys
-from multiprocessing import Manager, Process
+from multiprocessing import Process, Queue
+from queue import Empty
+from threading import Lock
+from uuid import uuid1
+from contextlib import contextmanager
 import yaml
 import json
 from jsonschema import validate
@@ -9,12 +13,15 @@ from tempfile import mkstemp, mkdtemp
 import os
 import shutil
 from .dependentqueue import DependentQueue
-from .task import enqueue, EndOfQueue, either_data
-from .process import work_on
-from .io import read_from_disk, merge_files
+from .task import enqueue, EndOfQueue, either_data, vectorized
+from .process import work_on, serve
+from .io import read_from_disk, merge_files, read_queue, POLL_INTERVAL
 from .python import python_to_spec
-from .spec import dict_to_spec
-from .objectstore import PlasmaStore, SimpleStore
+from .spec import dict_to_spec, set_default_chunk_size
+from .objectstore import SpillStore
+from .scheduler import SchedulerManager
+from .backend import Backend, ProcessBackend, ThreadBackend, SubinterpreterBackend, DistributedBackend, get_backend, extend_sys_path, auto_store_size
+from .cluster import work_as_daemon
 from tx.readable_log import getLogger
 
 logger = getLogger(__name__, logging.INFO)
@@ -22,38 +29,79 @@ logger = getLogger(__name__, logging.INFO)
 with open(os.path.join(os.path.dirname(__file__), "schema.json")) as f:
     schema = json.load(f)
 
-def run_python(number_of_workers, pyf, dataf, system_paths=[], validate_spec=True, output_path=None, level=0, object_store=None):
+def run_python(number_of_workers, pyf, dataf, system_paths=[], validate_spec=True, output_path=None, level=0, object_store=None, scheduler=True, batch_size=1, serializer="pickle", chunk_size=1, concurrency=1, executor="processes", store_size=None):
     with open(pyf) as s:
         py = s.read()
     with open(dataf) as d:
         data = yaml.safe_load(d)
-    return start_python(number_of_workers, py, data, system_paths, validate_spec, output_path, level, object_store)
+    return start_python(number_of_workers, py, data, system_paths, validate_spec, output_path, level, object_store, scheduler, batch_size, serializer, chunk_size, concurrency, executor, store_size)
 
 
-def run(number_of_workers, specf, dataf, system_paths=[], validate_spec=True, output_path=None, level=0, object_store=None):
+def run(number_of_workers, specf, dataf, system_paths=[], validate_spec=True, output_path=None, level=0, object_store=None, scheduler=True, batch_size=1, serializer="pickle", chunk_size=1, concurrency=1, executor="processes", store_size=None):
     with open(specf) as s:
         spec = yaml.safe_load(s)
     with open(dataf) as d:
         data = yaml.safe_load(d)
-    return start(number_of_workers, spec, data, system_paths, validate_spec, output_path, level, object_store)
+    return start(number_of_workers, spec, data, system_paths, validate_spec, output_path, level, object_store, scheduler, batch_size, serializer, chunk_size, concurrency, executor, store_size)
 
 
-def start_python(number_of_workers, py, data, system_paths, validate_spec, output_path, level, object_store):
-    add_paths = list(set(system_paths) - set(sys.path))
-    sys.path.extend(add_paths)
-    logger.debug(f"add_paths = {add_paths}")
-    try:
-        spec = python_to_spec(py)
-    finally:
-        for _ in range(len(add_paths)):
-            sys.path.pop()
-    return start(number_of_workers, spec, data, system_paths, validate_spec, output_path, level, object_store)
+def python_to_spec_with_paths(py, system_paths):
+    with extend_sys_path(system_paths):
+        return python_to_spec(py)
+
+
+def start_python(number_of_workers, py, data, system_paths, validate_spec, output_path, level, object_store, scheduler=True, batch_size=1, serializer="pickle", chunk_size=1, concurrency=1, executor="processes", store_size=None):
+    spec = python_to_spec_with_paths(py, system_paths)
+    return start(number_of_workers, spec, data, system_paths, validate_spec, output_path, level, object_store, scheduler, batch_size, serializer, chunk_size, concurrency, executor, store_size)
+
+
+DEFAULT_BUFFER_SIZE = 1024
+
+
+def run_iter(number_of_workers, specf, dataf, system_paths=[], validate_spec=True, level=0, object_store=None, scheduler=True, batch_size=1, serializer="pickle", buffer_size=DEFAULT_BUFFER_SIZE, chunk_size=1, concurrency=1, executor="processes", store_size=None):
+    with open(specf) as s:
+        spec = yaml.safe_load(s)
+    with open(dataf) as d:
+        data = yaml.safe_load(d)
+    return start_iter(number_of_workers, spec, data, system_paths, validate_spec, level, object_store, scheduler, batch_size, serializer, buffer_size, chunk_size, concurrency, executor, store_size)
+
+
+def run_python_iter(number_of_workers, pyf, dataf, system_paths=[], validate_spec=True, level=0, object_store=None, scheduler=True, batch_size=1, serializer="pickle", buffer_size=DEFAULT_BUFFER_SIZE, chunk_size=1, concurrency=1, executor="processes", store_size=None):
+    with open(pyf) as s:
+        py = s.read()
+    with open(dataf) as d:
+        data = yaml.safe_load(d)
+    return start_python_iter(number_of_workers, py, data, system_paths, validate_spec, level, object_store, scheduler, batch_size, serializer, buffer_size, chunk_size, concurrency, executor, store_size)
+
+
+def start_python_iter(number_of_workers, py, data, system_paths, validate_spec, level, object_store, scheduler=True, batch_size=1, serializer="pickle", buffer_size=DEFAULT_BUFFER_SIZE, chunk_size=1, concurrency=1, executor="processes", store_size=None):
+    return start_iter(number_of_workers, python_to_spec_with_paths(py, system_paths), data, system_paths, validate_spec, level, object_store, scheduler, batch_size, serializer, buffer_size, chunk_size, concurrency, executor, store_size)
+
+
+@contextmanager
+def start_workers(spec, data, system_paths, level, object_store, scheduler, batch_size, serializer, chunk_size, concurrency, backend, outputs, store_size=None):
+    with backend:
+        if object_store is None:
+            object_store = backend.object_store(serializer, store_size)
+
+        workers = []
+        try:
+            job_queue = backend.dependent_queue(object_store, scheduler)
+            enqueue(dict_to_spec(set_default_chunk_size(spec, chunk_size)), either_data(data), job_queue, level=level)
+            for output in outputs:
+                workers.append(backend.start_worker(job_queue, output, system_paths, batch_size, serializer, concurrency))
 
+            yield workers
 
-DEFAULT_PLASMA_STORE_SIZE = 50000000
+            for worker in workers:
+                worker.join()
 
+        finally:
+            # workers are still running if the caller stopped early
+            backend.stop(workers, outputs)
 
-def start(number_of_workers, spec, data, system_paths, validate_spec, output_path, level, object_store):
+
+def start(number_of_workers, spec, data, system_paths, validate_spec, output_path, level, object_store, scheduler=True, batch_size=1, serializer="pickle", chunk_size=1, concurrency=1, executor="processes", store_size=None):
     if validate_spec:
         validate(instance=spec, schema=schema)
     if output_path is None:
@@ -64,51 +112,207 @@ def start(number_of_workers, spec, data, system_paths, validate_spec, output_pat
         output_dir = os.path.dirname(output_path)
         temp_dir = mkdtemp(dir=output_dir)
         
-    shutdown_object_store = False
     temp_path = None
     
     try:
 
-        with Manager() as manager:
-            if object_store is None:
-                try:
-                    logger.info("using PlasmaStore")
-                    object_store = PlasmaStore(manager, DEFAULT_PLASMA_STORE_SIZE)
-                except:
-                    logger.info("using SimpleStore")
-                    object_store = SimpleStore(manager)
-                object_store.init()
-                shutdown_object_store = True
+        output_paths = []
+        for _ in range(number_of_workers):
+            fd, path = mkstemp(dir=temp_dir)
+            os.close(fd)
+            output_paths.append(path)
+
+        with start_workers(spec, data, system_paths, level, object_store, scheduler, batch_size, serializer, chunk_size, concurrency, get_backend(executor), output_paths, store_size):
+            pass
+
+        if output_path is None:
+            fd, temp_path = mkstemp(dir=temp_dir)
+            os.close(fd)
+        else:
+            temp_path = output_path
+
+        merge_files(output_paths, temp_path)
             
-            job_queue = DependentQueue(manager, EndOfQueue(), object_store)
-            enqueue(dict_to_spec(spec), either_data(data), job_queue, level=level)
-            processes = []
-            output_paths = []
-            for _ in range(number_of_workers):
-                fd, path = mkstemp(dir=temp_dir)
-                os.close(fd)
-                output_paths.append(path)
-                p = Process(target=work_on, args=(job_queue, path, system_paths))
-                p.start()
-                processes.append(p)
-                
-            for p in processes:
+        if output_path is None:
+            return read_from_disk(temp_path, serializer)
+        else:
+            return None
+
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+# :param buffer_size: the maximum number of records buffered between the workers and the caller, workers wait when the buffer is full
+# :return: a generator of ret_prefix and value pairs yielded as ret tasks complete, a ret_prefix may be yielded more than once and the values can be combined with mappend
+def start_iter(number_of_workers, spec, data, system_paths, validate_spec, level, object_store, scheduler=True, batch_size=1, serializer="pickle", buffer_size=DEFAULT_BUFFER_SIZE, chunk_size=1, concurrency=1, executor="processes", store_size=None):
+    if validate_spec:
+        validate(instance=spec, schema=schema)
+
+    backend = get_backend(executor)
+    output = backend.output_queue(buffer_size)
+    with start_workers(spec, data, system_paths, level, object_store, scheduler, batch_size, serializer, chunk_size, concurrency, backend, [output] * number_of_workers, store_size) as processes:
+        yield from read_queue(output, len(processes), lambda: not any(p.is_alive() for p in processes), serializer)
+
+
+class Session:
+    """
+    A SchedulerManager, an object store, and a pool of workers that are kept alive across runs. Workers extend sys.path and import modules once. Each run has its own scheduler, oid namespace, and outputs. Runs are executed one at a time.
+    :attr object_store: the object store shared by all runs, a SpillStore is created if it is None
+    :attr buffer_size: the maximum number of records buffered between the workers and the caller in start_iter
+    :attr concurrency: the maximum number of coroutine functions that a worker runs at a time
+    :attr store_size: the capacity in memory of the SpillStore that is created if object_store is None, or None to size it from available memory
+    """
+    def __init__(self, number_of_workers, system_paths=[], object_store=None, batch_size=1, serializer="pickle", buffer_size=DEFAULT_BUFFER_SIZE, concurrency=1, store_size=None):
+        self.number_of_workers = number_of_workers
+        self.system_paths = system_paths
+        self.object_store = object_store
+        self.batch_size = batch_size
+        self.serializer = serializer
+        self.buffer_size = buffer_size
+        self.concurrency = concurrency
+        self.store_size = store_size
+        self.lock = Lock()
+        self.manager = None
+        self.processes = []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        self.manager = SchedulerManager()
+        self.manager.start()
+        self.shutdown_object_store = self.object_store is None
+        if self.shutdown_object_store:
+            store_size = auto_store_size() if self.store_size is None else self.store_size
+            logger.info(f"using SpillStore, store_size = {store_size}")
+            self.object_store = SpillStore(self.manager, store_size, serializer=self.serializer)
+            self.object_store.init()
+        self.controls = [Queue() for _ in range(self.number_of_workers)]
+        self.done = Queue()
+        self.stream = Queue(self.buffer_size)
+        for control in self.controls:
+            p = Process(target=serve, args=(control, self.done, self.stream, self.object_store, self.system_paths, self.batch_size, self.serializer, self.concurrency))
+            p.start()
+            self.processes.append(p)
+
+    def close(self):
+        try:
+            for control, p in zip(self.controls, self.processes):
+                if p.is_alive():
+                    control.put(None)
+            for p in self.processes:
                 p.join()
+            self.processes = []
+        finally:
+            try:
+                if self.shutdown_object_store:
+                    self.object_store.shutdown()
+                    self.object_store = None
+            finally:
+                self.manager.shutdown()
 
-            if output_path is None:
-                fd, temp_path = mkstemp(dir=temp_dir)
-                os.close(fd)
-            else:
-                temp_path = output_path
+    def exited(self):
+        return not all(p.is_alive() for p in self.processes)
 
-            merge_files(output_paths, temp_path)
-                
+    # sends a run to every worker
+    def submit(self, spec, data, validate_spec, level, chunk_size, outputs):
+        if validate_spec:
+            validate(instance=spec, schema=schema)
+        namespace = f"{uuid1().hex}:"
+        scheduler = self.manager.Scheduler(EndOfQueue(), namespace)
+        job_queue = DependentQueue(self.manager, EndOfQueue(), self.object_store, scheduler, namespace)
+        enqueue(dict_to_spec(set_default_chunk_size(spec, chunk_size)), either_data(data), job_queue, level=level)
+        for control, output in zip(self.controls, outputs):
+            control.put((scheduler, namespace, output))
+        return scheduler
+
+    # waits for every worker to finish the run
+    def wait(self, scheduler):
+        errors = []
+        for _ in self.processes:
+            while True:
+                try:
+                    error = self.done.get(timeout=POLL_INTERVAL)
+                    break
+                except Empty:
+                    if self.exited():
+                        raise RuntimeError("workers exited without finishing")
+            if error is not None:
+                errors.append(error)
+        # objects left by nodes that did not run
+        for oid in scheduler.clear():
+            self.object_store.delete(oid)
+        if len(errors) > 0:
+            raise RuntimeError(errors[0])
+
+    def start(self, spec, data, validate_spec=True, output_path=None, level=0, chunk_size=1):
+        with self.lock:
             if output_path is None:
-                return read_from_disk(temp_path)
+                temp_dir = mkdtemp()
             else:
-                return None
+                with open(output_path, "w"):
+                    pass
+                temp_dir = mkdtemp(dir=os.path.dirname(output_path))
 
-    finally:
-        if shutdown_object_store:
-            object_store.shutdown()
-        shutil.rmtree(temp_dir)
+            try:
+                output_paths = []
+                for _ in range(self.number_of_workers):
+                    fd, path = mkstemp(dir=temp_dir)
+                    os.close(fd)
+                    output_paths.append(path)
+
+                self.wait(self.submit(spec, data, validate_spec, level, chunk_size, output_paths))
+
+                if output_path is None:
+                    fd, temp_path = mkstemp(dir=temp_dir)
+                    os.close(fd)
+                else:
+                    temp_path = output_path
+
+                merge_files(output_paths, temp_path)
+
+                if output_path is None:
+                    return read_from_disk(temp_path, self.serializer)
+                else:
+                    return None
+            finally:
+                shutil.rmtree(temp_dir)
+
+    def start_python(self, py, data, validate_spec=True, output_path=None, level=0, chunk_size=1):
+        return self.start(python_to_spec_with_paths(py, self.system_paths), data, validate_spec, output_path, level, chunk_size)
+
+    # :return: a generator of ret_prefix and value pairs, see start_iter
+    def start_iter(self, spec, data, validate_spec=True, level=0, chunk_size=1):
+        with self.lock:
+            scheduler = self.submit(spec, data, validate_spec, level, chunk_size, [None] * self.number_of_workers)
+            records = read_queue(self.stream, self.number_of_workers, self.exited, self.serializer)
+            try:
+                for record in records:
+                    yield record
+            finally:
+                # if the caller stopped early, stop the run and drop records that are still coming
+                scheduler.cancel()
+                for _ in records:
+                    pass
+                self.wait(scheduler)
+
+    def start_python_iter(self, py, data, validate_spec=True, level=0, chunk_size=1):
+        return self.start_iter(python_to_spec_with_paths(py, self.system_paths), data, validate_spec, level, chunk_size)
+
+    def run(self, specf, dataf, validate_spec=True, output_path=None, level=0, chunk_size=1):
+        with open(specf) as s:
+            spec = yaml.safe_load(s)
+        with open(dataf) as d:
+            data = yaml.safe_load(d)
+        return self.start(spec, data, validate_spec, output_path, level, chunk_size)
+
+    def run_python(self, pyf, dataf, validate_spec=True, output_path=None, level=0, chunk_size=1):
+        with open(pyf) as s:
+            py = s.read()
+        with open(dataf) as d:
+            data = yaml.safe_load(d)
+        return self.start_python(py, data, validate_spec, output_path, level, chunk_size)
@@ -0,0 +1,355 @@
+import os
+import sys
+import shutil
+import pickle
+import logging
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, ExitStack
+from multiprocessing import Process, Queue, current_process
+from queue import Empty, Queue as ThreadQueue
+from threading import Thread, Event
+from typing import List, Any, Optional, Union, Iterator, Tuple
+from tx.readable_log import getLogger
+from .dependentqueue import DependentQueue
+from .objectstore import ObjectStore, SpillStore, LocalStore, NetworkStore
+from .scheduler import Scheduler, SchedulerManager
+from .serialization import Serializer
+from .process import work_on
+from .task import EndOfQueue
+from .io import POLL_INTERVAL, write_queue
+from .cluster import ClusterManager, HEARTBEAT_INTERVAL, DEFAULT_HEARTBEAT_TIMEOUT
+try:
+    import concurrent.interpreters as interpreters
+except ModuleNotFoundError as e:
+    interpreters = None
+
+logger = getLogger(__name__, logging.INFO)
+
+
+DEFAULT_STORE_SIZE = 50000000
+AUTO_STORE_FRACTION = 0.5
+
+
+# :return: the size of memory that is available, from MemAvailable on Linux, otherwise free pages, or None if it is not known
+def available_memory() -> Optional[int]:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+# arenas are created when they are needed, so the store size is a bound rather than a reservation
+# :return: a fraction of the memory available for shared memory, which is also bounded by the free space of /dev/shm, but at least DEFAULT_STORE_SIZE
+def auto_store_size() -> int:
+    available = available_memory()
+    if os.path.isdir("/dev/shm"):
+        shm = shutil.disk_usage("/dev/shm").free
+        available = shm if available is None else min(available, shm)
+    if available is None:
+        return DEFAULT_STORE_SIZE
+    return max(DEFAULT_STORE_SIZE, int(available * AUTO_STORE_FRACTION))
+
+
+@contextmanager
+def extend_sys_path(system_paths: List[str]) -> Iterator[None]:
+    add_paths = list(set(system_paths) - set(sys.path))
+    sys.path.extend(add_paths)
+    logger.debug(f"add_paths = {add_paths}")
+    try:
+        yield
+    finally:
+        for _ in range(len(add_paths)):
+            sys.path.pop()
+
+
+def drain(output: Any) -> None:
+    try:
+        while True:
+            output.get_nowait()
+    except Empty:
+        pass
+
+
+# threads cannot be terminated, stop returning tasks and drop records that are still coming until they exit
+def cancel_threads(scheduler: Any, workers: List[Any], outputs: List[Any]) -> None:
+    if any(t.is_alive() for t in workers) and scheduler is not None:
+        scheduler.cancel()
+    for t in workers:
+        while t.is_alive():
+            for output in outputs:
+                if not isinstance(output, str):
+                    drain(output)
+            t.join(POLL_INTERVAL)
+
+
+class Backend(ABC):
+    """
+    Launches the workers of a run, and provides the dependent queue, object store, and output queue that suit how the workers share memory. A backend is used as a context manager for one run.
+    """
+    def __enter__(self) -> "Backend":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.shutdown()
+
+    # :param store_size: the capacity of the store in memory, or None to size it from available memory. Backends whose store is not bounded ignore it
+    # :return: the object store used when the caller does not provide one, it is shut down with the backend
+    @abstractmethod
+    def object_store(self, serializer: Union[None, str, Serializer], store_size: Optional[int] = None) -> ObjectStore:
+        pass
+
+    # :param scheduler: whether the dependency graph is kept by a Scheduler, otherwise by a NodeMap
+    @abstractmethod
+    def dependent_queue(self, object_store: ObjectStore, scheduler: bool) -> DependentQueue:
+        pass
+
+    # :return: a bounded queue that workers can stream records to
+    @abstractmethod
+    def output_queue(self, size: int) -> Any:
+        pass
+
+    # :return: a handle of the worker that has is_alive and join
+    @abstractmethod
+    def start_worker(self, queue: DependentQueue, output: Any, system_paths: List[str], batch_size: Optional[int], serializer: Union[None, str, Serializer], concurrency: int) -> Any:
+        pass
+
+    # stop workers that are still running because the caller stopped early
+    @abstractmethod
+    def stop(self, workers: List[Any], outputs: List[Any]) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+
+class ProcessBackend(Backend):
+    """
+    Workers are processes. The dependency graph is served by a SchedulerManager and values are serialized into a SpillStore, which moves values to files when shared memory is full.
+    """
+    def __init__(self):
+        self.manager = SchedulerManager()
+        self.manager.start()
+        self.store : Optional[ObjectStore] = None
+        self.scheduler : Any = None
+
+    def object_store(self, serializer: Union[None, str, Serializer], store_size: Optional[int] = None) -> ObjectStore:
+        if store_size is None:
+            store_size = auto_store_size()
+        logger.info(f"using SpillStore, store_size = {store_size}")
+        self.store = SpillStore(self.manager, store_size, serializer=serializer)
+        self.store.init()
+        return self.store
+
+    def dependent_queue(self, object_store: ObjectStore, scheduler: bool) -> DependentQueue:
+        self.scheduler = self.manager.Scheduler(EndOfQueue()) if scheduler else None
+        return DependentQueue(self.manager, EndOfQueue(), object_store, self.scheduler)
+
+    def output_queue(self, size: int) -> Any:
+        return Queue(size)
+
+    def start_worker(self, queue: DependentQueue, output: Any, system_paths: List[str], batch_size: Optional[int], serializer: Union[None, str, Serializer], concurrency: int) -> Any:
+        p = Process(target=work_on, args=(queue, output, system_paths, batch_size, serializer, concurrency))
+        p.start()
+        return p
+
+    def stop(self, workers: List[Any], outputs: List[Any]) -> None:
+        for p in workers:
+            if p.is_alive():
+                p.terminate()
+                p.join()
+
+    def shutdown(self) -> None:
+        try:
+            # the object store may use the manager
+            if self.store is not None:
+                self.store.shutdown()
+        finally:
+            self.manager.shutdown()
+
+
+class ThreadBackend(Backend):
+    """
+    Workers are threads of this process. They share a Scheduler, and values are kept by reference in a LocalStore. Threads run Python code in parallel only on a free-threaded build, otherwise they suit tasks that release the GIL.
+    A LocalStore has no size limit, store_size is ignored. A NodeMap needs a manager, so threads cannot run without a Scheduler.
+    """
+    def __init__(self):
+        self.stack = ExitStack()
+        self.paths_added = False
+        self.scheduler : Optional[Scheduler] = None
+
+    def object_store(self, serializer: Union[None, str, Serializer], store_size: Optional[int] = None) -> ObjectStore:
+        if store_size is not None:
+            logger.warning(f"LocalStore has no size limit, store_size = {store_size} is ignored")
+        logger.info("using LocalStore")
+        return LocalStore()
+
+    def dependent_queue(self, object_store: ObjectStore, scheduler: bool) -> DependentQueue:
+        if not scheduler:
+            raise ValueError("threads require a scheduler")
+        self.scheduler = Scheduler(EndOfQueue())
+        return DependentQueue(None, EndOfQueue(), object_store, self.scheduler)
+
+    def output_queue(self, size: int) -> Any:
+        return ThreadQueue(size)
+
+    # threads share sys.path, it is extended once for the run
+    def start_worker(self, queue: DependentQueue, output: Any, system_paths: List[str], batch_size: Optional[int], serializer: Union[None, str, Serializer], concurrency: int) -> Any:
+        if not self.paths_added:
+            self.stack.enter_context(extend_sys_path(system_paths))
+            self.paths_added = True
+        t = Thread(target=work_on, args=(queue.copy(), output, [], batch_size, serializer, concurrency), daemon=True)
+        t.start()
+        return t
+
+    def stop(self, workers: List[Any], outputs: List[Any]) -> None:
+        cancel_threads(self.scheduler, workers, outputs)
+
+    def shutdown(self) -> None:
+        self.stack.close()
+
+
+# runs in a subinterpreter, which has its own authkey, the manager's authkey is needed before the proxies in the queue are unpickled
+def work_in_interpreter(authkey: bytes, payload: bytes) -> None:
+    current_process().authkey = authkey
+    work_on(*pickle.loads(payload))
+
+
+def run_interpreter(authkey: bytes, payload: bytes) -> None:
+    interp = interpreters.create()
+    try:
+        interp.call(work_in_interpreter, authkey, payload)
+    finally:
+        interp.close()
+
+
+class SubinterpreterBackend(ProcessBackend):
+    """
+    Experimental. Workers are subinterpreters of this process, each run by a thread, which have their own GIL. They do not share Python objects, so the dependency graph is served by a SchedulerManager and values are serialized into a SpillStore as with processes, but workers start without a new process. Requires Python 3.14, and extension modules imported by tasks must support subinterpreters.
+    """
+    def __init__(self):
+        if interpreters is None:
+            raise RuntimeError("subinterpreters require concurrent.interpreters, which is available from Python 3.14")
+        super().__init__()
+
+    # a multiprocessing queue cannot be pickled
+    def output_queue(self, size: int) -> Any:
+        return self.manager.Queue(size)
+
+    def start_worker(self, queue: DependentQueue, output: Any, system_paths: List[str], batch_size: Optional[int], serializer: Union[None, str, Serializer], concurrency: int) -> Any:
+        payload = pickle.dumps((queue, output, system_paths, batch_size, serializer, concurrency))
+        t = Thread(target=run_interpreter, args=(bytes(current_process().authkey), payload), daemon=True)
+        t.start()
+        return t
+
+    def stop(self, workers: List[Any], outputs: List[Any]) -> None:
+        cancel_threads(self.scheduler, workers, outputs)
+
+
+class RemoteWorker:
+    """
+    A handle of a worker run by a worker daemon. If the output is a path, records that the daemon streams are written to the file by a thread of this process.
+    """
+    def __init__(self, coordinator: Any, slot_id: str, output: Any, stream: Any, serializer: Union[None, str, Serializer]):
+        self.coordinator = coordinator
+        self.slot_id = slot_id
+        self.writer : Optional[Thread] = None
+        if isinstance(output, str):
+            self.writer = Thread(target=write_queue, args=(stream, output, self.finished, serializer), daemon=True)
+            self.writer.start()
+
+    def finished(self) -> bool:
+        return self.coordinator.wait(self.slot_id, 0)
+
+    def is_alive(self) -> bool:
+        return not self.finished() or (self.writer is not None and self.writer.is_alive())
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        if self.coordinator.wait(self.slot_id, timeout):
+            error = self.coordinator.error(self.slot_id)
+            if error is not None:
+                logger.error(f"worker {self.slot_id} failed: {error}")
+            if self.writer is not None:
+                self.writer.join(timeout)
+
+
+class DistributedBackend(Backend):
+    """
+    Workers are run by worker daemons, see tx.parallex.cluster.work_as_daemon, which connect to a ClusterManager listening on address. The dependency graph is served by a Scheduler and values are kept by a NetworkStore. Nodes are returned preferably to the daemon that produced or read their inputs, which reads them from its cache. Every result is put in the store, so that when a daemon stops sending heartbeats, the nodes it is running are run by other daemons and its worker is offered again. The run waits until daemons have taken every worker. A backend is used for one run.
+    :attr address: the host and port that daemons connect to. Proxies sent to daemons connect to the same address, so the host must be reachable from them
+    :attr heartbeat_timeout: a daemon that has not sent a heartbeat for this many seconds is considered lost
+    """
+    def __init__(self, address: Tuple[str, int], authkey: bytes, heartbeat_timeout: float = DEFAULT_HEARTBEAT_TIMEOUT):
+        self.manager = ClusterManager(address=address, authkey=authkey)
+        self.manager.start()
+        self.coordinator = self.manager.Coordinator()
+        self.heartbeat_timeout = heartbeat_timeout
+        self.store : Optional[ObjectStore] = None
+        self.scheduler : Any = None
+        self.stopped = Event()
+        self.monitor : Optional[Thread] = None
+
+    def object_store(self, serializer: Union[None, str, Serializer], store_size: Optional[int] = None) -> ObjectStore:
+        logger.info("using NetworkStore")
+        self.store = NetworkStore(self.manager.LocalStore(), serializer=serializer)
+        return self.store
+
+    # a NodeMap needs a manager in every worker, daemons always use a Scheduler
+    def dependent_queue(self, object_store: ObjectStore, scheduler: bool) -> DependentQueue:
+        self.scheduler = self.manager.Scheduler(EndOfQueue(), keep_local=False)
+        return DependentQueue(None, EndOfQueue(), object_store, self.scheduler)
+
+    def output_queue(self, size: int) -> Any:
+        return self.manager.Queue(size)
+
+    # daemons cannot write to files of this host, records are streamed back
+    def start_worker(self, queue: DependentQueue, output: Any, system_paths: List[str], batch_size: Optional[int], serializer: Union[None, str, Serializer], concurrency: int) -> Any:
+        if self.monitor is None:
+            self.monitor = Thread(target=self.requeue_lost, daemon=True)
+            self.monitor.start()
+        stream = self.manager.Queue() if isinstance(output, str) else output
+        slot_id = self.coordinator.offer(pickle.dumps((queue, stream, system_paths, batch_size, serializer, concurrency)))
+        return RemoteWorker(self.coordinator, slot_id, output, stream, serializer)
+
+    def requeue_lost(self) -> None:
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            workers = self.coordinator.expire(self.heartbeat_timeout)
+            if len(workers) > 0 and self.scheduler is not None:
+                self.scheduler.requeue(workers)
+
+    def stop(self, workers: List[Any], outputs: List[Any]) -> None:
+        self.coordinator.withdraw()
+        cancel_threads(self.scheduler, workers, outputs)
+
+    def shutdown(self) -> None:
+        self.stopped.set()
+        if self.monitor is not None:
+            self.monitor.join()
+        try:
+            if self.store is not None:
+                self.store.shutdown()
+        finally:
+            self.manager.shutdown()
+
+
+BACKENDS = {
+    "processes": ProcessBackend,
+    "threads": ThreadBackend,
+    "subinterpreters": SubinterpreterBackend
+}
+
+
+# :param executor: the name of a backend in BACKENDS, or a backend
+def get_backend(executor: Union[str, Backend]) -> Backend:
+    if isinstance(executor, Backend):
+        return executor
+    backend = BACKENDS.get(executor)
+    if backend is None:
+        raise RuntimeError(f"unsupported executor {executor}")
+    return backend()
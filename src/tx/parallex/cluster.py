@@ -0,0 +1,217 @@
+import os
+import sys
+import time
+import pickle
+import logging
+import threading
+import traceback
+from argparse import ArgumentParser
+from collections import deque
+from dataclasses import dataclass, field
+from multiprocessing import current_process
+from uuid import uuid1
+from typing import List, Any, Dict, Tuple, Set, Optional, Deque
+from tx.readable_log import getLogger
+from .scheduler import SchedulerManager
+from .objectstore import LocalStore
+from .process import work_on
+from .task import clear_function_cache
+
+logger = getLogger(__name__, logging.INFO)
+
+
+HEARTBEAT_INTERVAL = 1
+DEFAULT_HEARTBEAT_TIMEOUT = 10
+RETRY_INTERVAL = 1
+
+
+@dataclass
+class Slot:
+    """
+    A worker of a run that is offered to worker daemons.
+    :attr payload: the pickled arguments of work_on
+    :attr daemon: the daemon that is running the worker, None if no daemon is running it
+    :attr workers: ids that the daemon uses in the scheduler
+    :attr last_seen: the time of the last heartbeat of the daemon
+    :attr finished: whether the worker is finished
+    :attr error: the traceback if the worker failed
+    """
+    payload: bytes
+    daemon: Optional[str] = None
+    workers: Set[str] = field(default_factory=set)
+    last_seen: float = 0
+    finished: bool = False
+    error: Optional[str] = None
+
+
+class Coordinator:
+    """
+    Hands out the workers of a run to worker daemons and keeps track of whether the daemons are alive. It is served to the daemons by the ClusterManager of the coordinator process.
+    :attr slots: a map from slot id to slot
+    :type slots: dict[str, Slot]
+    :attr pending: ids of slots that no daemon is running, in the order they are offered
+    :type pending: deque[str]
+    """
+    def __init__(self):
+        self.slots : Dict[str, Slot] = {}
+        self.pending : Deque[str] = deque()
+        self.cond = threading.Condition()
+
+    # :return: the slot id
+    def offer(self, payload: bytes) -> str:
+        with self.cond:
+            slot_id = str(uuid1())
+            self.slots[slot_id] = Slot(payload)
+            self.pending.append(slot_id)
+            self.cond.notify()
+            return slot_id
+
+    # :return: the slot id and payload of a worker, or None if no worker is offered before the timeout
+    def take(self, daemon: str, timeout: Optional[float] = None) -> Optional[Tuple[str, bytes]]:
+        with self.cond:
+            if not self.cond.wait_for(lambda: len(self.pending) > 0, timeout):
+                return None
+            slot_id = self.pending.popleft()
+            slot = self.slots[slot_id]
+            slot.daemon = daemon
+            slot.last_seen = time.time()
+            logger.info(f"{daemon} takes {slot_id}")
+            return slot_id, slot.payload
+
+    # heartbeats and results of a daemon that has been replaced are ignored
+    # :param worker: the id that the daemon uses in the scheduler
+    def heartbeat(self, slot_id: str, daemon: str, worker: Optional[str]) -> None:
+        with self.cond:
+            slot = self.slots[slot_id]
+            if slot.daemon == daemon:
+                slot.last_seen = time.time()
+                if worker is not None:
+                    slot.workers.add(worker)
+
+    def finish(self, slot_id: str, daemon: str, error: Optional[str] = None) -> None:
+        with self.cond:
+            slot = self.slots[slot_id]
+            if slot.daemon == daemon:
+                slot.finished = True
+                slot.error = error
+                self.cond.notify_all()
+
+    # :return: whether the slot is finished
+    def wait(self, slot_id: str, timeout: Optional[float] = None) -> bool:
+        with self.cond:
+            return self.cond.wait_for(lambda: self.slots[slot_id].finished, timeout)
+
+    def error(self, slot_id: str) -> Optional[str]:
+        with self.cond:
+            return self.slots[slot_id].error
+
+    # slots whose daemons have not sent a heartbeat within timeout are offered again
+    # :return: scheduler ids of those daemons, nodes that they are running should be requeued
+    def expire(self, timeout: float) -> List[str]:
+        with self.cond:
+            now = time.time()
+            workers : List[str] = []
+            for slot_id, slot in self.slots.items():
+                if slot.daemon is not None and not slot.finished and now - slot.last_seen > timeout:
+                    logger.warning(f"lost daemon {slot.daemon}, offering {slot_id} again")
+                    workers.extend(slot.workers)
+                    slot.daemon = None
+                    slot.workers = set()
+                    self.pending.append(slot_id)
+                    self.cond.notify()
+            return workers
+
+    # slots that no daemon is running are finished without being run
+    def withdraw(self) -> None:
+        with self.cond:
+            while len(self.pending) > 0:
+                self.slots[self.pending.popleft()].finished = True
+            self.cond.notify_all()
+
+
+coordinator_lock = threading.Lock()
+coordinator : Optional[Coordinator] = None
+
+
+# every connection to the manager gets the same coordinator
+def get_coordinator() -> Coordinator:
+    global coordinator
+    with coordinator_lock:
+        if coordinator is None:
+            coordinator = Coordinator()
+        return coordinator
+
+
+class ClusterManager(SchedulerManager):
+    """A SchedulerManager that listens on a TCP address and also serves the coordinator and the object store to worker daemons.
+    """
+    pass
+
+
+ClusterManager.register("Coordinator", get_coordinator)
+ClusterManager.register("LocalStore", LocalStore)
+
+
+def send_heartbeats(coordinator: Any, slot_id: str, daemon: str, worker: Optional[str], interval: float, stop: threading.Event) -> None:
+    try:
+        while not stop.wait(interval):
+            coordinator.heartbeat(slot_id, daemon, worker)
+    except (OSError, EOFError) as e:
+        logger.info(f"heartbeat stopped: {e}")
+
+
+def run_slot(coordinator: Any, daemon: str, slot_id: str, payload: bytes, heartbeat_interval: float) -> None:
+    queue, output, system_paths, batch_size, serializer, concurrency = pickle.loads(payload)
+    sys.path.extend(path for path in system_paths if path not in sys.path)
+    clear_function_cache()
+    # the worker id is reported before the worker takes any node, so that its nodes are requeued if the daemon is lost
+    coordinator.heartbeat(slot_id, daemon, queue.worker)
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=send_heartbeats, args=(coordinator, slot_id, daemon, queue.worker, heartbeat_interval, stop), daemon=True)
+    heartbeat.start()
+    error = None
+    try:
+        work_on(queue, output, [], batch_size, serializer, concurrency)
+    except Exception:
+        error = traceback.format_exc()
+        logger.error(error)
+    finally:
+        stop.set()
+        heartbeat.join()
+    coordinator.finish(slot_id, daemon, error)
+
+
+# runs workers for the coordinator listening on address until the process is terminated. A daemon waits for a coordinator that is not started yet, and connects again when a coordinator shuts down, so it can serve one run after another
+# :param authkey: the authkey of the coordinator's manager
+# :param system_paths: paths added to sys.path of the daemon
+def work_as_daemon(address: Tuple[str, int], authkey: bytes, system_paths: List[str] = [], heartbeat_interval: float = HEARTBEAT_INTERVAL, retry_interval: float = RETRY_INTERVAL) -> None:
+    # proxies sent by the coordinator connect with the authkey of the current process
+    current_process().authkey = authkey
+    sys.path.extend(path for path in system_paths if path not in sys.path)
+    daemon = str(uuid1())
+    while True:
+        try:
+            manager = ClusterManager(address=address, authkey=authkey)
+            manager.connect()
+            coordinator = manager.Coordinator()
+            logger.info(f"{daemon} connected to {address}")
+            while True:
+                slot = coordinator.take(daemon, retry_interval)
+                if slot is not None:
+                    run_slot(coordinator, daemon, *slot, heartbeat_interval)
+        except (OSError, EOFError) as e:
+            logger.debug(f"cannot reach coordinator at {address}: {e}")
+            time.sleep(retry_interval)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Runs workers for tx-parallex coordinators. The authkey is read from the TX_PARALLEX_AUTHKEY environment variable.")
+    parser.add_argument("address", help="host:port of the coordinator")
+    parser.add_argument("--system-path", action="append", default=[], help="a path added to sys.path")
+    args = parser.parse_args()
+    host, port = args.address.rsplit(":", 1)
+    work_as_daemon((host, int(port)), os.environ["TX_PARALLEX_AUTHKEY"].encode(), args.system_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
+import os
 from uuid import uuid1
+from copy import copy
 import logging
 from multiprocessing import Manager
 from contextlib import contextmanager
+from queue import Empty
 from dataclasses import dataclass, field
 from typing import List, Any, Dict, Tuple, Callable, Set, Optional
 import time
@@ -28,6 +31,8 @@ class Node:
     :param node_id: The node_id, if None, one will be generated
     :param depends_on: a dict from node_ids that it depends to variable names
     :param subnode_depends_on: a dict from node_ids that it depends to variable names
+    :param priority: ready nodes with higher priorities are returned first by the scheduler
+    :param local: set by the scheduler when the node is returned, if True every node that depends on it is run by the same worker, and its results are not put in the object store
     """
     o: Any
     node_id: str
@@ -36,6 +41,8 @@ class Node:
     subnode_depends_on: Dict[str, Set[str]] = field(default_factory=dict)
     start_time: float = -1
     ready_time: float = -1
+    priority: float = 0
+    local: bool = False
 
     def get(self) -> Any:
         return self.o
@@ -51,15 +58,20 @@ class NodeMetadata:
     :attr subnode_refs: a set of node_ids whose subnode depends on it
     :attr depends: a map from node_id to a dict where the key is node_id that it depends on and the value is an iterable that returns a list of keys
     :attr subnode_depends: a map from node_id to a dict where the key is node_id that its subnodes depends on and the value is an iterable that returns a list of keys
+    :attr workers: workers that produced the results that the node depends on
+    :attr pinned: whether some results that the node depends on are only kept by the worker that produced them
     """
     refs: Set[str] = field(default_factory=set)
     subnode_refs: Set[str] = field(default_factory=set)
     depends: int = 0
     subnode_depends: int = 0
+    workers: Set[Optional[str]] = field(default_factory=set)
+    pinned: bool = False
 
 
-def gen_oid(node_id: str, name: str) -> str:
-    return f"{node_id}/{name}"
+# :param namespace: a prefix that separates the oids of different runs that share an object store
+def gen_oid(node_id: str, name: str, namespace: str = "") -> str:
+    return f"{namespace}{node_id}/{name}"
 
 class NodeMap:
     """
@@ -86,6 +98,7 @@ class NodeMap:
         self.node_ready_time = manager.dict()
         self.node_start_time = manager.dict()
         self.object_store = object_store
+        self.retrieved : Dict[str, Dict[str, int]] = {}
 
     def init_thread(self) -> None:
         self.object_store.init_thread()        
@@ -130,7 +143,7 @@ class NodeMap:
                 meta.subnode_refs.add(node.node_id)
                 logger.debug(format_message("add_node", lambda: f"add {node.node_id} to subnode refs of {node_id}", lambda: vars(meta)))
 
-        if not is_hold and len(node.depends_on) == 0:
+        if not is_hold and len(node.depends_on) == 0 and len(node.subnode_depends_on) == 0:
             self.put_ready_queue(node)
 
     def put_ready_queue(self, task: TaskType) -> None:
@@ -199,6 +212,11 @@ class NodeMap:
         for oid in oids:
             self.object_store.decrement_ref(oid)
 
+        # release objects retrieved by this node only after it is complete, since they may be read in place
+        retrieved = self.retrieved.pop(node_id, None)
+        if retrieved is not None:
+            self.object_store.update_refs({oid: -count for oid, count in retrieved.items()})
+
         with self.lock:
             logger.debug("complete_node: deleting %s from self.meta", node_id)
             del self.meta[node_id]
@@ -243,6 +261,38 @@ class NodeMap:
         self.node_start_time[node.node_id] = time.time()
         return node
 
+    # :return: at most n nodes, blocks only for the first node. If end_of_queue is reached it is the last node in the list
+    def get_next_ready_nodes(self, n: int, block: bool = True, timeout: Optional[float] = None) -> List[TaskType]:
+        nodes = [self.get_next_ready_node(block, timeout)]
+        while len(nodes) < n and nodes[-1].o != self.end_of_queue:
+            try:
+                nodes.append(self.get_next_ready_node(False))
+            except Empty:
+                break
+        return nodes
+
+    def complete_nodes(self, completions: List[Tuple[str, ResultType]]) -> None:
+        for node_id, result in completions:
+            self.complete_node(node_id, result)
+
+    def retrieve_objects(self, node: Node) -> Tuple[ReturnType, ReturnType]:
+        retrieved : Dict[str, int] = {}
+        def retrieve_object(oid: str) -> Any:
+            obj = self.object_store.get(oid)
+            retrieved[oid] = retrieved.get(oid, 0) + 1
+            return obj
+        
+        def retrieve_objects(result_oid_dict : Dict[str, Set[str]]) -> Dict[str, Any]:
+            return {k: retrieve_object(gen_oid(v, k)) for v,ks in result_oid_dict.items() for k in ks}
+
+        results = retrieve_objects(node.depends_on), retrieve_objects(node.subnode_depends_on)
+        if len(retrieved) > 0:
+            self.retrieved[node.node_id] = retrieved
+        return results
+
+    def flush(self) -> None:
+        pass
+
     def close(self) -> None:
         self.ready_queue.put(Node(self.end_of_queue, f"end_of_queue@{uuid1()}", set()))
 
@@ -252,41 +302,239 @@ class NodeMap:
     #         return len(self.nodes) == 0
 
         
+@dataclass
+class Hold:
+    """
+    Objects retrieved by a local node, which its local results may reference, for example as views of NumPy arrays read in place from the object store. They are released when no local result that may reference them is left.
+    :attr oids: oids in the object store retrieved by the node
+    :attr holds: holds of local results retrieved by the node
+    :attr count: the number of local results and holds that refer to this hold
+    """
+    oids: List[str]
+    holds: List["Hold"]
+    count: int = 0
+
+
+class SchedulerNodeMap:
+    """
+    A NodeMap that delegates the dependency graph to a Scheduler, either a proxy to a Scheduler served from the coordinator process or a Scheduler in the same process. Nodes put on the map are buffered and sent in one batch, and objects retrieved by a node are released in the same call that completes the node, except that objects retrieved by a local node are held until its local results are deleted. Reference counts are kept by the scheduler, the object store is only used to put, get, and delete objects.
+    :attr scheduler:
+    :type scheduler: Scheduler
+    :attr pending_nodes: nodes that have not been sent to the scheduler
+    :type pending_nodes: list[tuple[Node, bool]]
+    :attr node_names: a map from node_id to the names of nodes retrieved in this process
+    :type node_names: dict[str, set[str]]
+    :attr retrieved: a map from node_id to oids retrieved for that node
+    :type retrieved: dict[str, list[str]]
+    :attr namespace: the oid namespace of the scheduler
+    :type namespace: str
+    :attr worker: identifies this copy of the node map to the scheduler
+    :type worker: str
+    :attr local_nodes: nodes returned as local, whose results are kept in local_objects
+    :type local_nodes: set[str]
+    :attr local_objects: a map from oid to results that are not put in the object store because only this worker uses them
+    :type local_objects: dict[str, any]
+    :attr local_holds: a map from oid of a local result to the hold of the node that produced it
+    :type local_holds: dict[str, Hold]
+    """
+    
+    def __init__(self, scheduler: Any, object_store: ObjectStore, namespace: str = ""):
+        self.scheduler = scheduler
+        self.object_store = object_store
+        self.namespace = namespace
+        self.init_buffers()
+
+    def init_buffers(self) -> None:
+        self.pending_nodes : List[Tuple[Node, bool]] = []
+        self.node_names : Dict[str, Set[str]] = {}
+        self.retrieved : Dict[str, List[str]] = {}
+        self.worker = str(uuid1())
+        self.pid = os.getpid()
+        self.local_nodes : Set[str] = set()
+        self.local_objects : Dict[str, Any] = {}
+        self.local_holds : Dict[str, Hold] = {}
+
+    # buffers are local to a process
+    def __getstate__(self) -> Dict[str, Any]:
+        return {"scheduler": self.scheduler, "object_store": self.object_store, "namespace": self.namespace}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.init_buffers()
+        
+    # forked workers inherit the node map without pickling, each of them needs its own worker id
+    def init_thread(self) -> None:
+        if self.pid != os.getpid():
+            self.worker = str(uuid1())
+            self.pid = os.getpid()
+        self.object_store.init_thread()
+
+    def add_node(self, node: Node, is_hold: bool =False) -> None:
+        self.pending_nodes.append((node, is_hold))
+
+    def flush(self) -> None:
+        if len(self.pending_nodes) > 0:
+            pending_nodes = self.pending_nodes
+            self.pending_nodes = []
+            self.scheduler.add_nodes(pending_nodes)
+
+    def complete_node(self, node_id: str, result: ResultType) -> None:
+        self.complete_nodes([(node_id, result)])
+
+    # complete nodes in one call to the scheduler
+    def complete_nodes(self, completions: List[Tuple[str, ResultType]]) -> None:
+        node_ids = []
+        released : List[str] = []
+        for node_id, result in completions:
+            logger.debug(format_message("complete_node", node_id, {"result": result}))
+            names = self.node_names.pop(node_id, set())
+            oids = [gen_oid(node_id, name, self.namespace) for name in names]
+            retrieved = self.retrieved.pop(node_id, [])
+            if node_id in self.local_nodes:
+                self.local_nodes.remove(node_id)
+                put = self.local_objects.__setitem__
+                self.hold(oids, retrieved, released)
+            else:
+                put = self.object_store.put
+                released.extend(retrieved)
+            if isinstance(result, Left):
+                for oid in oids:
+                    put(oid, result)
+            else:
+                result_dict = result.value
+                for oid, name in zip(oids, names):
+                    put(oid, result_dict[name])
+            node_ids.append(node_id)
+
+        self.flush()
+        unreferenced = self.scheduler.complete_nodes(node_ids, released, self.worker)
+        while len(unreferenced) > 0:
+            released = []
+            for oid in unreferenced:
+                if oid in self.local_objects:
+                    del self.local_objects[oid]
+                    self.unhold(self.local_holds.pop(oid), released)
+                else:
+                    self.object_store.delete(oid)
+            # objects whose holds are released may be deleted in turn
+            unreferenced = self.scheduler.complete_nodes([], released, self.worker) if len(released) > 0 else []
+
+    # hold the objects in the object store retrieved by a local node until its local results are deleted, local results retrieved by the node are released
+    def hold(self, oids: List[str], retrieved: List[str], released: List[str]) -> None:
+        stored = []
+        holds = []
+        for oid in retrieved:
+            if oid in self.local_objects:
+                holds.append(self.local_holds[oid])
+                released.append(oid)
+            else:
+                stored.append(oid)
+        hold = Hold(stored, holds, len(oids))
+        for parent in holds:
+            parent.count += 1
+        for oid in oids:
+            self.local_holds[oid] = hold
+        if hold.count == 0:
+            hold.count = 1
+            self.unhold(hold, released)
+
+    def unhold(self, hold: Hold, released: List[str]) -> None:
+        hold.count -= 1
+        if hold.count == 0:
+            released.extend(hold.oids)
+            for parent in hold.holds:
+                self.unhold(parent, released)
+
+    def get_next_ready_node(self, block: bool = True, timeout: Optional[float] = None) -> TaskType:
+        [node] = self.get_next_ready_nodes(1, block, timeout)
+        return node
+
+    def get_next_ready_nodes(self, n: int, block: bool = True, timeout: Optional[float] = None) -> List[TaskType]:
+        self.flush()
+        nodes = self.scheduler.get_ready_nodes(n, block, timeout, self.worker, self.object_store.pressure())
+        for node in nodes:
+            self.node_names[node.node_id] = node.names
+            if node.local:
+                self.local_nodes.add(node.node_id)
+        return nodes
+
+    def retrieve_objects(self, node: Node) -> Tuple[ReturnType, ReturnType]:
+        oids = self.retrieved.setdefault(node.node_id, [])
+        def retrieve_objects(result_oid_dict : Dict[str, Set[str]]) -> Dict[str, Any]:
+            results = {}
+            for v, ks in result_oid_dict.items():
+                for k in ks:
+                    oid = gen_oid(v, k, self.namespace)
+                    results[k] = self.local_objects[oid] if oid in self.local_objects else self.object_store.get(oid)
+                    oids.append(oid)
+            return results
+
+        return retrieve_objects(node.depends_on), retrieve_objects(node.subnode_depends_on)
+
+    def close(self) -> None:
+        self.flush()
+        self.scheduler.close()
+
+        
 class DependentQueue:
     """The queue maintain a list of tasks. Before any task is added to the list, the queue is in the ready state, when the last task is compleete the queue is in the closed state. In the closed state the queue will always return end_of_queue.
     """
-    def __init__(self, manager: Manager, end_of_queue: Any, object_store: ObjectStore):
-        self.node_map = NodeMap(manager, end_of_queue, object_store)
+    def __init__(self, manager: Manager, end_of_queue: Any, object_store: ObjectStore, scheduler: Any = None, namespace: str = ""):
+        """
+        :param scheduler: if not None, the dependency graph is kept by this Scheduler instead of in the manager
+        :param namespace: the oid namespace of the scheduler
+        """
+        if scheduler is None:
+            self.node_map = NodeMap(manager, end_of_queue, object_store)
+        else:
+            self.node_map = SchedulerNodeMap(scheduler, object_store, namespace)
 
     def init_thread(self) -> None:
         self.node_map.init_thread()
+
+    # :return: the id that identifies this queue to the scheduler, or None without a scheduler
+    @property
+    def worker(self) -> Optional[str]:
+        return getattr(self.node_map, "worker", None)
+
+    # :return: a queue for another worker thread, which shares the dependency graph and the object store, but not the buffers of the node map
+    def copy(self) -> "DependentQueue":
+        queue = copy(self)
+        queue.node_map = copy(self.node_map)
+        return queue
         
-    def put(self, o : Any, job_id:Optional[str]=None, depends_on:Dict[str, Set[str]]={}, subnode_depends_on:Dict[str, Set[str]]={}, names:Set[str]=set(), is_hold: bool=False) -> str:
+    def put(self, o : Any, job_id:Optional[str]=None, depends_on:Dict[str, Set[str]]={}, subnode_depends_on:Dict[str, Set[str]]={}, names:Set[str]=set(), is_hold: bool=False, priority: float=0) -> str:
         if job_id is None:
             job_id =  str(uuid1())
-        logger.info(format_message("DependentQueue.put", "putting a task on the queue", {"task_id": job_id, "depends_on": depends_on, "subnode_depends_on": subnode_depends_on, "names": names, "is_hold": is_hold}))
-        node = Node(o, node_id=job_id, depends_on=depends_on, subnode_depends_on=subnode_depends_on, names=names)
+        logger.info(format_message("DependentQueue.put", "putting a task on the queue", {"task_id": job_id, "depends_on": depends_on, "subnode_depends_on": subnode_depends_on, "names": names, "is_hold": is_hold, "priority": priority}))
+        node = Node(o, node_id=job_id, depends_on=depends_on, subnode_depends_on=subnode_depends_on, names=names, priority=priority)
         self.node_map.add_node(node, is_hold=is_hold)
         return node.node_id
 
     def get(self, *args, **kwargs) -> DTask:
-        def retrieve_object(oid: str) -> Any:
-            obj = self.node_map.object_store.get(oid)
-            self.node_map.object_store.decrement_ref(oid)
-            return obj
-        
-        def retrieve_objects(result_oid_dict : Dict[str, Set[str]]) -> Dict[str, Any]:
-            return {k: retrieve_object(gen_oid(v, k)) for v,ks in result_oid_dict.items() for k in ks}
-            
         node = self.node_map.get_next_ready_node(*args, **kwargs)
-        results = retrieve_objects(node.depends_on)
-        subnode_results = retrieve_objects(node.subnode_depends_on)
+        return self.retrieve_task(node)
+
+    # :return: at most n tasks, blocks only for the first task. If end_of_queue is returned it is the last task in the list
+    def get_batch(self, n: int, block: bool = True, timeout: Optional[float] = None) -> List[DTask]:
+        nodes = self.node_map.get_next_ready_nodes(n, block, timeout)
+        return [self.retrieve_task(node) for node in nodes]
+
+    def retrieve_task(self, node: Node) -> DTask:
+        results, subnode_results = self.node_map.retrieve_objects(node)
         logger.debug(f"DependentQueue.get: node = %s, results = %s, subnode_results = %s", node, results, subnode_results)
         return node.get(), results, subnode_results, node.node_id
         
     def complete(self, node_id: str, x: ResultType) -> None:
         self.node_map.complete_node(node_id, x)
 
+    def complete_batch(self, completions: List[Tuple[str, ResultType]]) -> None:
+        self.node_map.complete_nodes(completions)
+
+    # send nodes that are put on the queue but buffered by the node map
+    def flush(self) -> None:
+        self.node_map.flush()
+
     def close(self) -> None:
         self.node_map.close()
         
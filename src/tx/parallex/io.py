@@ -1,21 +1,144 @@
 import logging
-import json
+from abc import ABC, abstractmethod
+from queue import Empty
 from .utils import mappend
+from .serialization import Serializer, get_serializer
 from tx.functional.maybe import Nothing
 from tx.readable_log import format_message, getLogger
-from typing import List, Any, Dict, Tuple, Set, Callable, TypeVar
-import jsonpickle
+from typing import List, Any, Dict, Tuple, Set, Callable, TypeVar, BinaryIO, Iterator, Optional
 
 logger = getLogger(__name__, logging.INFO)
 
-def write_to_disk(dqueue, path):
-    with open(path, "w") as db:
+RECORD_LENGTH_SIZE = 8
+
+
+class RecordWriter(ABC):
+    """
+    Writes the records produced by ret tasks.
+    """
+    @abstractmethod
+    def write_record(self, obj: Any) -> None:
+        pass
+
+    def write_records(self, objs: List[Any]) -> None:
+        for obj in objs:
+            self.write_record(obj)
+
+    # called when the worker is done
+    def close(self) -> None:
+        pass
+
+
+class FileRecordWriter(RecordWriter):
+    """
+    Writes serialized records to a binary file, each record is prefixed by its length. Files of records can be concatenated.
+    """
+    def __init__(self, output: BinaryIO, serializer: Optional[Serializer] = None):
+        self.output = output
+        self.serializer = get_serializer(serializer)
+
+    def write_record(self, obj: Any) -> None:
+        data = self.serializer.dumps(obj)
+        self.output.write(len(data).to_bytes(RECORD_LENGTH_SIZE, "little"))
+        self.output.write(data)
+
+
+class QueueRecordWriter(RecordWriter):
+    """
+    Puts serialized records on a bounded multiprocessing queue. A worker blocks when the queue is full. None is put on the queue when the worker is done.
+    """
+    def __init__(self, output: Any, serializer: Optional[Serializer] = None):
+        self.output = output
+        self.serializer = get_serializer(serializer)
+
+    def write_record(self, obj: Any) -> None:
+        self.output.put(self.serializer.dumps(obj))
+
+    # records are put on the queue as one list
+    def write_records(self, objs: List[Any]) -> None:
+        if len(objs) > 0:
+            self.output.put(self.serializer.dumps(objs))
+
+    def close(self) -> None:
+        self.output.put(None)
+
+
+class RecordBuffer(RecordWriter):
+    """
+    Keeps records in memory so that they can be written in one batch.
+    """
+    def __init__(self):
+        self.records : List[Any] = []
+
+    def write_record(self, obj: Any) -> None:
+        self.records.append(obj)
+
+
+POLL_INTERVAL = 0.1
+
+
+# :param exited: returns True if workers have exited without finishing
+# :return: a generator of ret_prefix and value pairs in the order they are put on the queue by the workers
+def read_queue(output: Any, number_of_workers: int, exited: Callable[[], bool], serializer: Optional[Serializer] = None) -> Iterator[Tuple[str, Any]]:
+    serializer = get_serializer(serializer)
+    running = number_of_workers
+    failed = False
+    while running > 0:
+        try:
+            data = output.get(timeout=POLL_INTERVAL)
+        except Empty:
+            if failed:
+                raise RuntimeError("workers exited without finishing")
+            # a record may still be in transit after a worker exited, check one more time
+            failed = exited()
+            continue
+        if data is None:
+            running -= 1
+        else:
+            records = serializer.loads(data)
+            for record in (records if isinstance(records, list) else [records]):
+                yield from record.items()
+
+
+# writes records streamed by a worker to a file
+# :param finished: returns True when the worker will put no more records on the queue
+def write_queue(output: Any, path: str, finished: Callable[[], bool], serializer: Optional[Serializer] = None) -> None:
+    serializer = get_serializer(serializer)
+    with open(path, "wb") as db:
+        writer = FileRecordWriter(db, serializer)
+        while True:
+            done = finished()
+            try:
+                data = output.get(timeout=POLL_INTERVAL)
+            except Empty:
+                if done:
+                    break
+                continue
+            # a worker that replaces a lost worker puts None again, the queue is read until the worker is finished
+            if data is not None:
+                records = serializer.loads(data)
+                writer.write_records(records if isinstance(records, list) else [records])
+
+
+def read_records(path: str, serializer: Optional[Serializer] = None) -> Iterator[Any]:
+    serializer = get_serializer(serializer)
+    with open(path, "rb") as db:
+        while True:
+            header = db.read(RECORD_LENGTH_SIZE)
+            if len(header) == 0:
+                break
+            yield serializer.loads(db.read(int.from_bytes(header, "little")))
+
+
+def write_to_disk(dqueue, path, serializer=None):
+    with open(path, "wb") as db:
+        writer = FileRecordWriter(db, serializer)
         while True:
             output = dqueue.get_next_output()
             if output == Nothing:
                 break
             else:
-                db.write(jsonpickle.encode(output.value) + "\n")
+                writer.write_record(output.value)
 
 
 def merge_files(inputs, path):
@@ -24,7 +147,7 @@ def merge_files(inputs, path):
         for inp in inputs:
             logger.info(format_message("merge_files", "merge a file", {"from": inp}))
             with open(inp, "rb") as inp_file:
-                
+
                 while True:
                     buf = inp_file.read(1024 * 1024)
                     if len(buf) == 0:
@@ -32,11 +155,28 @@ def merge_files(inputs, path):
                     db.write(buf)
 
 
-def read_from_disk(path):
-    obj = {}
-    with open(path) as db:
-        for line in db:
-            obj = mappend(obj, jsonpickle.decode(line))
-    return obj
+class ResultBuilder:
+    """
+    Assembles records into a result in one pass. Values are indexed by ret_prefix, a value is merged with mappend only when its ret_prefix has been seen before.
+    :attr result: a map from ret_prefix to value
+    """
+    def __init__(self):
+        self.result : Dict[str, Any] = {}
+
+    def add(self, record: Dict[str, Any]) -> None:
+        result = self.result
+        for ret_prefix, value in record.items():
+            if ret_prefix in result:
+                result[ret_prefix] = mappend(result[ret_prefix], value)
+            else:
+                result[ret_prefix] = value
+
+    def build(self) -> Dict[str, Any]:
+        return self.result
+
 
-        
+def read_from_disk(path, serializer=None):
+    builder = ResultBuilder()
+    for record in read_records(path, serializer):
+        builder.add(record)
+    return builder.build()
@@ -1,10 +1,19 @@
 import logging
+import threading
+from collections import OrderedDict
 from tx.readable_log import getLogger, format_message
 from abc import ABC, abstractmethod
-from multiprocessing import Manager
+from multiprocessing import Manager, Lock, Value
+from multiprocessing.shared_memory import SharedMemory
 from uuid import uuid1
-from typing import Any, Dict
-import jsonpickle
+from typing import Any, Dict, List, Tuple, Optional, Union
+import os
+import mmap
+import time
+import shutil
+from tempfile import mkdtemp
+from .serialization import Serializer, get_serializer
+from .sharedmemory import Arena, HEADER_SIZE, BLOCK_FREE, align, free_block, close_shared_memory
 try:
     import pyarrow.plasma as plasma
     from .plasma import start_plasma, stop_plasma
@@ -52,12 +61,204 @@ class ObjectStore(ABC):
     def get(self, oid: str) -> Any:
         pass
 
+    # delete an object regardless of its ref count
+    @abstractmethod
+    def delete(self, oid: str) -> None:
+        pass
+
+    # :return: the fraction of the capacity of the store that is used, the scheduler holds back nodes that add values when it is high
+    def pressure(self) -> float:
+        return 0
+
+
+DEFAULT_REF_CAPACITY = 1 << 16
+DEFAULT_REF_LOCK_STRIPES = 64
+LOCAL_SLOTS_SIZE = 1 << 16
+
+
+class SharedRefCounts:
+    """
+    Reference counts kept in shared memory segments. An oid is assigned a slot when it is added, a segment of capacity slots is added when every slot is used. A slot is updated under one of a fixed number of striped locks.
+    The map from oid to slot is shared through the manager and cached in each process. The slot of a removed oid is reused, so a cached slot is only valid if an oid is never looked up after its count drops to zero or it is deleted. This holds because oids are not reused and no node retrieves an object after it is deleted. The cache of a process is bounded, and an oid is dropped from it when the process removes or forgets the oid.
+    A segment is laid out as the next unused slot and the size of the free slot stack, which are only used in the first segment, the counts, the free slot stack, and the access times of its slots.
+    :attr segment_names: names of all segments in the order they are added
+    """
+    def __init__(self, manager: Manager, capacity: int = DEFAULT_REF_CAPACITY, stripes: int = DEFAULT_REF_LOCK_STRIPES):
+        self.capacity = capacity
+        self.slots = manager.dict()
+        self.segment_names = manager.list()
+        self.alloc_lock = Lock()
+        self.locks = [Lock() for _ in range(stripes)]
+        self.init_local()
+
+    def init_local(self) -> None:
+        self.segments : List[Tuple[SharedMemory, memoryview]] = []
+        self.local_slots : Dict[str, int] = {}
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {k: v for k, v in self.__dict__.items() if k not in ("segments", "local_slots")}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.init_local()
+
+    # :return: the segment of a slot and the index of the slot in the segment, segments added by other processes are attached
+    def segment(self, slot: int) -> Tuple[memoryview, int]:
+        i = slot // self.capacity
+        while len(self.segments) <= i:
+            shm = SharedMemory(name=self.segment_names[len(self.segments)])
+            self.segments.append((shm, shm.buf.cast("q")))
+        return self.segments[i][1], slot % self.capacity
+
+    @property
+    def header(self) -> memoryview:
+        return self.segment(0)[0]
+
+    def new_segment(self) -> None:
+        shm = SharedMemory(create=True, size=(2 + 3 * self.capacity) * 8)
+        self.segments.append((shm, shm.buf.cast("q")))
+        self.segment_names.append(shm.name)
+        logger.debug(format_message("SharedRefCounts.new_segment", "new segment", {"name": shm.name, "segments": len(self.segments)}))
+
+    def init(self) -> None:
+        self.new_segment()
+        self.header[0] = 0
+        self.header[1] = 0
+
+    def shutdown(self) -> None:
+        for shm, array in self.segments:
+            array.release()
+            close_shared_memory(shm, False)
+        for name in self.segment_names[:]:
+            try:
+                close_shared_memory(SharedMemory(name=name), True)
+            except FileNotFoundError:
+                pass
+        self.init_local()
+
+    def add(self, oid: str) -> None:
+        header = self.header
+        with self.alloc_lock:
+            free = header[1]
+            if free > 0:
+                header[1] = free - 1
+                array, i = self.segment(free - 1)
+                slot = array[2 + self.capacity + i]
+            else:
+                slot = header[0]
+                if slot % self.capacity == 0 and slot // self.capacity >= len(self.segment_names):
+                    # attach all segments before adding one
+                    self.segment(slot - 1)
+                    self.new_segment()
+                header[0] = slot + 1
+            array, i = self.segment(slot)
+            array[2 + i] = 0
+        self.slots[oid] = slot
+        self.cache_slot(oid, slot)
+
+    def cache_slot(self, oid: str, slot: int) -> None:
+        if len(self.local_slots) >= LOCAL_SLOTS_SIZE:
+            del self.local_slots[next(iter(self.local_slots))]
+        self.local_slots[oid] = slot
+
+    def slot(self, oid: str) -> int:
+        slot = self.local_slots.get(oid)
+        if slot is None:
+            slot = self.slots[oid]
+            self.cache_slot(oid, slot)
+        return slot
+
+    # drop an oid that has been deleted by another process from the cache of this process
+    def forget(self, oid: str) -> None:
+        self.local_slots.pop(oid, None)
+
+    # :return: oids whose counts dropped to zero, they are removed
+    def update(self, oid_update: Dict[str, int]) -> List[str]:
+        stripes : Dict[int, List[Tuple[str, int, int]]] = {}
+        for oid, update in oid_update.items():
+            slot = self.slot(oid)
+            stripes.setdefault(slot % len(self.locks), []).append((oid, slot, update))
+
+        zeros = []
+        for stripe, updates in stripes.items():
+            with self.locks[stripe]:
+                for oid, slot, update in updates:
+                    array, i = self.segment(slot)
+                    val = array[2 + i] + update
+                    array[2 + i] = val
+                    logger.debug(format_message("SharedRefCounts.update", "update object ref count", {"oid": oid, "val": val}))
+                    if val == 0:
+                        zeros.append(oid)
+
+        for oid in zeros:
+            self.remove(oid)
+        return zeros
+
+    def remove(self, oid: str) -> None:
+        slot = self.local_slots.pop(oid, None)
+        if slot is None:
+            slot = self.slots.get(oid)
+            if slot is None:
+                return
+        del self.slots[oid]
+        header = self.header
+        with self.alloc_lock:
+            free = header[1]
+            array, i = self.segment(free)
+            array[2 + self.capacity + i] = slot
+            header[1] = free + 1
+
+    def touch(self, slot: int) -> None:
+        array, i = self.segment(slot)
+        array[2 + 2 * self.capacity + i] = time.monotonic_ns()
+
+    # :return: the time that a slot was last touched
+    def accessed(self, slot: int) -> int:
+        array, i = self.segment(slot)
+        return array[2 + 2 * self.capacity + i]
+
+
+class RefCountedStore(ObjectStore):
+    """
+    An object store that keeps reference counts in SharedRefCounts and deletes an object when its count drops to zero.
+    :attr serializer: serializes objects put in the store
+    """
+    def __init__(self, manager: Manager, ref_capacity: int = DEFAULT_REF_CAPACITY, serializer: Union[None, str, Serializer] = None):
+        self.ref_counts = SharedRefCounts(manager, ref_capacity)
+        self.serializer = get_serializer(serializer)
+
+    def init(self) -> None:
+        self.ref_counts.init()
+
+    def shutdown(self) -> None:
+        self.ref_counts.shutdown()
+
+    def increment_ref(self, oid: str) -> None:
+        self.update_refs({oid: 1})
+        
+    def decrement_ref(self, oid: str) -> None:
+        self.update_refs({oid: -1})
+
+    def update_ref(self, oid: str, update: int) -> None:
+        self.update_refs({oid: update})
+
+    def update_refs(self, oid_update: Dict[str, int]) -> None:
+        for oid in self.ref_counts.update(oid_update):
+            self.delete_object(oid)
+
+    def delete(self, oid: str) -> None:
+        self.delete_object(oid)
+        self.ref_counts.remove(oid)
+
+    # delete an object from the underlying store
+    @abstractmethod
+    def delete_object(self, oid: str) -> None:
+        pass
 
-class PlasmaStore(ObjectStore):
-    def __init__(self, manager: Manager, mem_size: int):
-        self.manager = manager
-        self.shared_ref_dict = manager.dict()
-        self.shared_ref_lock_dict = manager.dict()
+
+class PlasmaStore(RefCountedStore):
+    def __init__(self, manager: Manager, mem_size: int, serializer: Union[None, str, Serializer] = None):
+        super().__init__(manager, serializer=serializer)
         self.vdict = manager.dict()
         self.mem_size = mem_size
 
@@ -66,122 +267,593 @@ class PlasmaStore(ObjectStore):
         
     def init(self) -> None:
         self.plasma_store = start_plasma(self.mem_size)
+        super().init()
 
     def shutdown(self) -> None:
         stop_plasma(self.plasma_store)
+        super().shutdown()
         
     def put(self, oid: str, o: Any) -> str :    
-        vid = self.client.put(jsonpickle.encode(o))
+        vid = self.client.put(self.serializer.dumps(o))
         self.vdict[oid] = vid
         logger.debug(format_message("PlasmaStore.put", "putting object into shared memory store", {"o": o, "oid": oid}))
-        self.shared_ref_lock_dict[oid] = self.manager.Lock()
-        self.shared_ref_dict[oid] = 0
-
-    def increment_ref(self, oid: str) -> None:
-        with self.shared_ref_lock_dict[oid]:
-            val = self.shared_ref_dict[oid]
-            val += 1
-            self.shared_ref_dict[oid] = val
-            logger.debug(format_message("PlasmaStore.increment_ref", "incrementing object ref count", {"oid": oid, "val": val}))
-        
-    def update_refs(self, oid_update: Dict[str, int]) -> None:
-        for oid, update in oid_update.items():
-            self.update_ref(oid, update)
+        self.ref_counts.add(oid)
+        return oid
 
-    def update_ref(self, oid: str, update: int) -> None:
-        with self.shared_ref_lock_dict[oid]:
-            val = self.shared_ref_dict[oid]
-            val += update
-            if val == 0:
-                logger.debug(format_message("PlasmaStore.decrement_ref", "deleting object", {"oid": oid}))
-                self.client.delete([self.vdict[oid]])
-                del self.shared_ref_dict[oid]
-                del self.shared_ref_lock_dict[oid]
-                del self.vdict[oid]
-            else:
-                self.shared_ref_dict[oid] = val
-                
-    def decrement_ref(self, oid: str) -> None:
-        with self.shared_ref_lock_dict[oid]:
-            val = self.shared_ref_dict[oid]
-            val -= 1
-            logger.debug(format_message("PlamsaStore.decrement_ref", "decrement object ref count", {"oid": oid, "val": val}))
-            
-            if val == 0:
-                logger.debug(format_message("PlasmaStore.decrement_ref", "deleting object", {"oid": oid}))
-                self.client.delete([self.vdict[oid]])
-                del self.shared_ref_dict[oid]
-                del self.shared_ref_lock_dict[oid]
-            else:
-                self.shared_ref_dict[oid] = val
-                
     def get(self, oid: str) -> Any:
         logger.debug(format_message("PlasmaStore.get", "getting object from shared memory store", {"oid": oid}))
-        return jsonpickle.decode(self.client.get(self.vdict[oid]))
+        return self.serializer.loads(self.client.get(self.vdict[oid]))
+
+    def delete_object(self, oid: str) -> None:
+        logger.debug(format_message("PlasmaStore.delete_object", "deleting object", {"oid": oid}))
+        self.client.delete([self.vdict.pop(oid)])
 
     
-class SimpleStore(ObjectStore):
-    def __init__(self, manager: Manager):
-        self.manager = manager
-        self.shared_ref_dict = manager.dict()
-        self.shared_ref_lock_dict = manager.dict()
+class SimpleStore(RefCountedStore):
+    def __init__(self, manager: Manager, serializer: Union[None, str, Serializer] = None):
+        super().__init__(manager, serializer=serializer)
         self.store = manager.dict()
 
     def init_thread(self):
         pass
 
-    def init(self):
+    def put(self, oid: str, o: Any) -> str :    
+        self.store[oid] = self.serializer.dumps(o)
+        logger.debug(format_message("SimpleStore.put", "putting object into shared memory store", {"o": o, "oid": oid}))
+        self.ref_counts.add(oid)
+        return oid
+
+    def get(self, oid: str) -> Any:
+        logger.debug(format_message("SimpleStore.get", "getting object from shared memory store", {"oid": oid}))
+        return self.serializer.loads(self.store[oid])
+
+    def delete_object(self, oid: str) -> None:
+        logger.debug(format_message("SimpleStore.delete_object", "deleting object", {"oid": oid}))
+        del self.store[oid]
+
+
+class LocalStore(ObjectStore):
+    """
+    An object store for workers that are threads of the same process. Objects are kept by reference and are not serialized, they must not be modified once they are put in the store.
+    """
+    def __init__(self):
+        self.store : Dict[str, Any] = {}
+        self.ref_counts : Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def init_thread(self) -> None:
         pass
 
-    def shutdown(self):
+    def init(self) -> None:
         pass
-        
-    def put(self, oid: str, o: Any) -> str :    
-        self.store[oid] = o
-        logger.debug(format_message("SimpleStore.put", "putting object into shared memory store", {"o": o, "oid": oid}))
-        self.shared_ref_lock_dict[oid] = self.manager.Lock()
-        self.shared_ref_dict[oid] = 0
+
+    def shutdown(self) -> None:
+        with self.lock:
+            self.store.clear()
+            self.ref_counts.clear()
+
+    def put(self, oid: str, o: Any) -> str :
+        with self.lock:
+            self.store[oid] = o
+            self.ref_counts[oid] = 0
         return oid
 
     def increment_ref(self, oid: str) -> None:
-        with self.shared_ref_lock_dict[oid]:
-            val = self.shared_ref_dict[oid]
-            val += 1
-            self.shared_ref_dict[oid] = val
-            logger.debug(format_message("SimpleStore.increment_ref", "incrementing object ref count", {"oid": oid, "val": val}))
-        
-    def update_refs(self, oid_update: Dict[str, int]) -> None:
-        for oid, update in oid_update.items():
-            self.update_ref(oid, update)
+        self.update_refs({oid: 1})
+
+    def decrement_ref(self, oid: str) -> None:
+        self.update_refs({oid: -1})
 
     def update_ref(self, oid: str, update: int) -> None:
-        with self.shared_ref_lock_dict[oid]:
-            val = self.shared_ref_dict[oid]
-            val += update
-            if val == 0:
-                logger.debug(format_message("SimpleStore.decrement_ref", "deleting object", {"oid": oid}))
-                del self.store[oid]
-                del self.shared_ref_dict[oid]
-                del self.shared_ref_lock_dict[oid]
-            else:
-                self.shared_ref_dict[oid] = val
-                
+        self.update_refs({oid: update})
+
+    def update_refs(self, oid_update: Dict[str, int]) -> None:
+        with self.lock:
+            for oid, update in oid_update.items():
+                count = self.ref_counts[oid] + update
+                if count == 0:
+                    del self.ref_counts[oid]
+                    del self.store[oid]
+                else:
+                    self.ref_counts[oid] = count
+
+    def get(self, oid: str) -> Any:
+        return self.store[oid]
+
+    def delete(self, oid: str) -> None:
+        with self.lock:
+            del self.store[oid]
+            self.ref_counts.pop(oid, None)
+
+
+DEFAULT_CACHE_SIZE = 1 << 26
+
+
+class NetworkStore(ObjectStore):
+    """
+    An object store for workers that connect to the coordinator over the network. Objects are serialized by the worker and kept by a LocalStore served by the coordinator's manager. A worker also keeps the serialized objects that it puts or gets in a cache, so that nodes run by the worker that produced or read their inputs do not fetch them again. Oids are not reused, so cached objects are never stale.
+    :attr store: a proxy to a LocalStore
+    :attr cache_size: the maximum total size of the cache of a worker
+    """
+    def __init__(self, store: Any, serializer: Union[None, str, Serializer] = None, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.store = store
+        self.serializer = get_serializer(serializer)
+        self.cache_size = cache_size
+        self.init_local()
+
+    def init_local(self) -> None:
+        self.cache : Dict[str, bytes] = OrderedDict()
+        self.cached = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {k: v for k, v in self.__dict__.items() if k not in ("cache", "cached")}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.init_local()
+
+    def init_thread(self) -> None:
+        pass
+
+    def init(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        self.store.shutdown()
+        self.init_local()
+
+    def cache_put(self, oid: str, data: bytes) -> None:
+        self.cache[oid] = data
+        self.cached += len(data)
+        while self.cached > self.cache_size:
+            _, evicted = self.cache.popitem(last=False)
+            self.cached -= len(evicted)
+
+    def put(self, oid: str, o: Any) -> str :
+        data = self.serializer.dumps(o)
+        self.store.put(oid, data)
+        self.cache_put(oid, data)
+        return oid
+
+    def increment_ref(self, oid: str) -> None:
+        self.update_refs({oid: 1})
+
     def decrement_ref(self, oid: str) -> None:
-        with self.shared_ref_lock_dict[oid]:
-            val = self.shared_ref_dict[oid]
-            val -= 1
-            logger.debug(format_message("SimpleStore.decrement_ref", "decrement object ref count", {"oid": oid, "val": val}))
-            
-            if val == 0:
-                logger.debug(format_message("SimpleStore.decrement_ref", "deleting object", {"oid": oid}))
-                del self.store[oid]
-                del self.shared_ref_dict[oid]
-                del self.shared_ref_lock_dict[oid]
+        self.update_refs({oid: -1})
+
+    def update_ref(self, oid: str, update: int) -> None:
+        self.update_refs({oid: update})
+
+    # an object may be deleted by the store when its count drops to zero, it is not read from the cache afterwards
+    def update_refs(self, oid_update: Dict[str, int]) -> None:
+        for oid in oid_update.keys():
+            self.cache_pop(oid)
+        self.store.update_refs(oid_update)
+
+    def get(self, oid: str) -> Any:
+        data = self.cache.get(oid)
+        if data is None:
+            logger.debug(format_message("NetworkStore.get", "getting object from coordinator", {"oid": oid}))
+            data = self.store.get(oid)
+            self.cache_put(oid, data)
+        else:
+            self.cache.move_to_end(oid)
+        return self.serializer.loads(data)
+
+    def cache_pop(self, oid: str) -> None:
+        data = self.cache.pop(oid, None)
+        if data is not None:
+            self.cached -= len(data)
+
+    def delete(self, oid: str) -> None:
+        self.cache_pop(oid)
+        self.store.delete(oid)
+
+
+DEFAULT_ARENA_SIZE = 1 << 22
+MIN_ARENA_SIZE = 1 << 16
+DEFAULT_FULL_TIMEOUT = 60
+FULL_POLL_INTERVAL = 0.01
+
+
+# a serialized object is laid out as the payload followed by the out-of-band buffers, each of them aligned
+def object_size(payload_size: int, buffer_sizes: Tuple[int, ...]) -> int:
+    return align(payload_size) + sum(align(buffer_size) for buffer_size in buffer_sizes)
+
+
+def write_object(mem: memoryview, pos: int, payload: bytes, buffers: List[memoryview]) -> None:
+    mem[pos:pos + len(payload)] = payload
+    pos += align(len(payload))
+    for buf in buffers:
+        mem[pos:pos + buf.nbytes] = buf.cast("B")
+        pos += align(buf.nbytes)
+
+
+# :return: the payload and read only out-of-band buffers, which are read in place
+def read_object(mem: memoryview, pos: int, payload_size: int, buffer_sizes: Tuple[int, ...]) -> Tuple[memoryview, List[memoryview]]:
+    payload = mem[pos:pos + payload_size]
+    pos += align(payload_size)
+    buffers = []
+    for buffer_size in buffer_sizes:
+        buffers.append(mem[pos:pos + buffer_size].toreadonly())
+        pos += align(buffer_size)
+    return payload, buffers
+
+
+class SharedMemoryStore(RefCountedStore):
+    """
+    An object store on multiprocessing.shared_memory. An object is serialized by the serializer, pickle protocol 5 by default, and written once, by the process that puts it, into an Arena owned by that process. Out-of-band buffers, such as the data of NumPy arrays, are read in place by other processes as read only buffers. Only the location of an object is shared through the manager.
+    An object read from the store is valid until the task that retrieved it is complete.
+    The store is full when the live objects would exceed mem_size, regardless of which process owns them. The arenas of a process start at MIN_ARENA_SIZE and double up to arena_size, so that processes that put few objects do not reserve much of the store. The total size of all arenas is bounded by mem_size, except that each process may have a first arena of at most MIN_ARENA_SIZE beyond it. When the bound is reached, a process unlinks its arenas whose blocks are all free before it creates another, and other processes unmap them when they next attach an arena.
+    :attr index: a map from oid to the name of the arena, offset, payload size, and buffer sizes of the object
+    :attr arena_names: names of all arenas that have not been released, used to unlink them on shutdown
+    :attr allocated: the total size of all arenas that have not been released
+    :attr used: the total size of live objects and blocks being written
+    :attr full_timeout: how long a put waits for other processes to delete objects when the store is full before it fails
+    """
+    def __init__(self, manager: Manager, mem_size: int, arena_size: int = DEFAULT_ARENA_SIZE, serializer: Union[None, str, Serializer] = None, full_timeout: float = DEFAULT_FULL_TIMEOUT):
+        super().__init__(manager, serializer=serializer)
+        self.mem_size = mem_size
+        self.arena_size = align(arena_size)
+        self.full_timeout = full_timeout
+        self.index = manager.dict()
+        self.arena_names = manager.list()
+        self.allocated = Value("q", 0)
+        self.used = Value("q", 0)
+        self.prefix = f"px{uuid1().hex[:8]}"
+        self.init_local()
+
+    def init_local(self) -> None:
+        self.arenas : List[Arena] = []
+        self.arena_count = 0
+        self.attached : Dict[str, Tuple[SharedMemory, memoryview]] = {}
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {k: v for k, v in self.__dict__.items() if k not in ("arenas", "arena_count", "attached")}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.init_local()
+
+    def init_thread(self) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        for arena in self.arenas:
+            arena.states.release()
+            close_shared_memory(arena.shm, True)
+        for shm, states in self.attached.values():
+            states.release()
+            close_shared_memory(shm, False)
+        for name in self.arena_names[:]:
+            try:
+                close_shared_memory(SharedMemory(name=name), True)
+            except FileNotFoundError:
+                pass
+        self.init_local()
+        super().shutdown()
+
+    # the size of the block is added to used
+    # :return: a block in an arena of this process, or None if the block would exceed mem_size or there is no space for another arena
+    def try_allocate(self, size: int) -> Optional[Tuple[Arena, int]]:
+        with self.used.get_lock():
+            if self.used.value + size > self.mem_size:
+                return None
+            self.used.value += size
+        try:
+            block = self.allocate_block(size)
+        except Exception:
+            self.add_used(-size)
+            raise
+        if block is None:
+            self.add_used(-size)
+        return block
+
+    def allocate_block(self, size: int) -> Optional[Tuple[Arena, int]]:
+        for arena in reversed(self.arenas):
+            offset = arena.allocate(size)
+            if offset is not None:
+                return arena, offset
+
+        arena_size = self.reserve(size)
+        if arena_size is None:
+            self.release_empty_arenas()
+            arena_size = self.reserve(size)
+            if arena_size is None:
+                return None
+        arena = Arena(f"{self.prefix}_{os.getpid()}_{self.arena_count}", arena_size)
+        self.arena_count += 1
+        self.arena_names.append(arena.name)
+        self.arenas.append(arena)
+        logger.debug(format_message("SharedMemoryStore.allocate", "new arena", {"name": arena.name, "size": arena_size}))
+        return arena, arena.allocate(size)
+
+    # adds the size of a new arena for a block of size bytes to allocated, an arena of only the block is reserved if the full size does not fit
+    # :return: the size of the arena, or None if it would exceed the bound
+    def reserve(self, size: int) -> Optional[int]:
+        arena_size = max(min(self.arena_size, MIN_ARENA_SIZE << len(self.arenas)), align(size))
+        with self.allocated.get_lock():
+            first = len(self.arenas) == 0 and arena_size <= MIN_ARENA_SIZE
+            if not first and self.allocated.value + arena_size > self.mem_size:
+                arena_size = align(size)
+                if self.allocated.value + arena_size > self.mem_size:
+                    return None
+            self.allocated.value += arena_size
+        return arena_size
+
+    # unlinks arenas of this process whose blocks are all free
+    def release_empty_arenas(self) -> None:
+        for arena in list(self.arenas):
+            arena.reclaim()
+            if len(arena.blocks) == 0:
+                self.release_arena(arena)
+
+    def release_arena(self, arena: Arena) -> None:
+        logger.debug(format_message("SharedMemoryStore.release_arena", "release arena", {"name": arena.name, "size": arena.size}))
+        self.arenas.remove(arena)
+        self.arena_names.remove(arena.name)
+        arena.states.release()
+        close_shared_memory(arena.shm, True)
+        with self.allocated.get_lock():
+            self.allocated.value -= arena.size
+
+    # waits until objects are deleted if the store is full
+    def allocate(self, size: int) -> Tuple[Arena, int]:
+        deadline = time.time() + self.full_timeout
+        while True:
+            block = self.try_allocate(size)
+            if block is not None:
+                return block
+            if align(size) > self.mem_size or time.time() >= deadline:
+                raise RuntimeError(f"object store is full, used = {self.used.value}, requested = {size}, mem_size = {self.mem_size}")
+            time.sleep(FULL_POLL_INTERVAL)
+
+    def add_used(self, size: int) -> None:
+        with self.used.get_lock():
+            self.used.value += size
+
+    # puts wait when used would exceed mem_size, so the scheduler throttles before they do
+    def pressure(self) -> float:
+        return self.used.value / self.mem_size
+
+    def attach(self, name: str) -> Tuple[SharedMemory, memoryview]:
+        attached = self.attached.get(name)
+        if attached is None:
+            for arena in self.arenas:
+                if arena.name == name:
+                    return arena.shm, arena.states
+            self.detach_released()
+            shm = SharedMemory(name=name)
+            attached = self.attached[name] = (shm, shm.buf.cast("q"))
+        return attached
+
+    # unmaps arenas that have been released by other processes
+    def detach_released(self) -> None:
+        if len(self.attached) == 0:
+            return
+        names = set(self.arena_names[:])
+        for name in [name for name in self.attached if name not in names]:
+            shm, states = self.attached.pop(name)
+            states.release()
+            close_shared_memory(shm, False)
+
+    def put(self, oid: str, o: Any) -> str :
+        buffers : List[memoryview] = []
+        payload = self.serializer.dumps(o, buffers)
+        size = HEADER_SIZE + object_size(len(payload), tuple(buf.nbytes for buf in buffers))
+        arena, offset = self.allocate(size)
+        write_object(arena.shm.buf, offset + HEADER_SIZE, payload, buffers)
+        self.index[oid] = (arena.name, offset, len(payload), tuple(buf.nbytes for buf in buffers))
+        logger.debug(format_message("SharedMemoryStore.put", "putting object into shared memory store", {"oid": oid, "arena": arena.name, "offset": offset, "size": size}))
+        self.ref_counts.add(oid)
+        return oid
+
+    def get(self, oid: str) -> Any:
+        logger.debug(format_message("SharedMemoryStore.get", "getting object from shared memory store", {"oid": oid}))
+        name, offset, payload_size, buffer_sizes = self.index[oid]
+        shm, _ = self.attach(name)
+        return self.serializer.loads(*read_object(shm.buf, offset + HEADER_SIZE, payload_size, buffer_sizes))
+
+    def delete_object(self, oid: str) -> None:
+        logger.debug(format_message("SharedMemoryStore.delete_object", "deleting object", {"oid": oid}))
+        name, offset, payload_size, buffer_sizes = self.index.pop(oid)
+        _, states = self.attach(name)
+        free_block(states, offset)
+        self.add_used(-HEADER_SIZE - object_size(payload_size, buffer_sizes))
+
+
+PRUNE_SIZE = 1024
+
+
+class SpillStore(SharedMemoryStore):
+    """
+    A SharedMemoryStore with a second tier of memory-mapped files. When a process has no space for an object within mem_size, it moves the objects in its own arenas that were least recently put or read to files in spill_dir until the object fits, otherwise the object is written to a file. Objects with out-of-band buffers are not moved, since they may be read in place, but such objects that are written to files are read in place from the files. A process that reads an object from shared memory while it is moved reads it again.
+    :attr spill_dir: the directory of the files, a temporary directory that is removed on shutdown if it is None
+    :attr spill_size: the maximum total size of the files, or None for no limit
+    :attr spilled: the total size of the files
+    :attr moves: the number of objects that have been moved to files
+    :attr owned: a map from oid to the arena, offset, and ref count slot of objects in arenas of this process that can be moved
+    """
+    def __init__(self, manager: Manager, mem_size: int, spill_dir: Optional[str] = None, spill_size: Optional[int] = None, arena_size: int = DEFAULT_ARENA_SIZE, serializer: Union[None, str, Serializer] = None, full_timeout: float = DEFAULT_FULL_TIMEOUT):
+        super().__init__(manager, mem_size, arena_size, serializer, full_timeout)
+        self.spill_dir = spill_dir
+        self.remove_spill_dir = spill_dir is None
+        self.spill_size = spill_size
+        self.spilled = Value("q", 0)
+        self.moves = Value("q", 0)
+
+    def init_local(self) -> None:
+        super().init_local()
+        self.owned : Dict[str, Tuple[Arena, int, int]] = {}
+        self.prune_at = PRUNE_SIZE
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {k: v for k, v in self.__dict__.items() if k not in ("arenas", "arena_count", "attached", "owned", "prune_at")}
+
+    def init(self) -> None:
+        super().init()
+        if self.spill_dir is None:
+            self.spill_dir = mkdtemp(prefix="tx-parallex-")
+
+    def shutdown(self) -> None:
+        for in_file, location, _, payload_size, buffer_sizes, _ in self.index.values():
+            if in_file:
+                self.remove_file(location, object_size(payload_size, buffer_sizes))
+        if self.remove_spill_dir and self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+        super().shutdown()
+
+    # waits until files are removed if spill_size would be exceeded
+    def new_file(self, size: int) -> str:
+        deadline = time.time() + self.full_timeout
+        while True:
+            with self.spilled.get_lock():
+                if self.spill_size is None or self.spilled.value + size <= self.spill_size:
+                    self.spilled.value += size
+                    return os.path.join(self.spill_dir, uuid1().hex)
+            if size > self.spill_size or time.time() >= deadline:
+                raise RuntimeError(f"object store is full, spilled = {self.spilled.value}, requested = {size}, spill_size = {self.spill_size}")
+            time.sleep(FULL_POLL_INTERVAL)
+
+    # objects that do not fit in shared memory are written to files, which only wait when spill_size would be exceeded
+    def pressure(self) -> float:
+        pressure = super().pressure()
+        if self.spill_size is not None:
+            pressure = max(pressure, self.spilled.value / self.spill_size)
+        return pressure
+
+    def remove_file(self, path: str, size: int) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        with self.spilled.get_lock():
+            self.spilled.value -= size
+
+    def write_file(self, payload: bytes, buffers: List[memoryview]) -> str:
+        size = object_size(len(payload), tuple(buf.nbytes for buf in buffers))
+        path = self.new_file(size)
+        with open(path, "w+b") as f:
+            f.truncate(size)
+            with mmap.mmap(f.fileno(), size) as mem:
+                view = memoryview(mem)
+                write_object(view, 0, payload, buffers)
+                view.release()
+        return path
+
+    # the file is unmapped when the object no longer uses its buffers
+    def read_file(self, path: str, payload_size: int, buffer_sizes: Tuple[int, ...]) -> Any:
+        with open(path, "rb") as f:
+            mem = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.serializer.loads(*read_object(memoryview(mem), 0, payload_size, buffer_sizes))
+
+    # :return: the number of bytes freed in shared memory
+    def move_to_file(self, oid: str) -> int:
+        arena, offset, slot = self.owned.pop(oid)
+        entry = self.index.get(oid)
+        # the object has been deleted, the block may have been reused
+        if entry is None or entry[:3] != (False, arena.name, offset):
+            return 0
+        _, _, _, payload_size, buffer_sizes, _ = entry
+        size = object_size(payload_size, buffer_sizes)
+        path = self.new_file(size)
+        with open(path, "wb") as f:
+            f.write(arena.shm.buf[offset + HEADER_SIZE:offset + HEADER_SIZE + size])
+        self.index[oid] = (True, path, 0, payload_size, buffer_sizes, slot)
+        with self.moves.get_lock():
+            self.moves.value += 1
+        logger.debug(format_message("SpillStore.move_to_file", "moving object to file", {"oid": oid, "path": path, "size": size}))
+        if arena.states[offset // 8] == BLOCK_FREE:
+            # the object was deleted while it was moved
+            if self.index.pop(oid, None) is not None:
+                self.remove_file(path, size)
+            return 0
+        free_block(arena.states, offset)
+        self.add_used(-HEADER_SIZE - size)
+        return HEADER_SIZE + size
+
+    # :return: a block of size bytes in shared memory, or None if the object should be written to a file
+    def allocate_or_move(self, size: int) -> Optional[Tuple[Arena, int]]:
+        block = self.try_allocate(size)
+        if block is not None or align(size) > self.mem_size:
+            return block
+        freed = 0
+        for oid in sorted(self.owned.keys(), key=lambda oid: self.ref_counts.accessed(self.owned[oid][2])):
+            freed += self.move_to_file(oid)
+            if freed >= size:
+                block = self.try_allocate(size)
+                if block is not None:
+                    return block
+        return self.try_allocate(size)
+
+    # objects in an arena that is released have all been deleted
+    def release_arena(self, arena: Arena) -> None:
+        for oid in [oid for oid, block in self.owned.items() if block[0] is arena]:
+            del self.owned[oid]
+            self.ref_counts.forget(oid)
+        super().release_arena(arena)
+
+    # drop objects that have been deleted, they are deleted by other processes so their slots are also dropped from the cache of ref count slots
+    def prune_owned(self) -> None:
+        owned = {}
+        for oid, block in self.owned.items():
+            if block[0].states[block[1] // 8] == BLOCK_FREE:
+                self.ref_counts.forget(oid)
             else:
-                self.shared_ref_dict[oid] = val
-                
+                owned[oid] = block
+        self.owned = owned
+        self.prune_at = max(PRUNE_SIZE, 2 * len(self.owned))
+
+    def put(self, oid: str, o: Any) -> str :
+        buffers : List[memoryview] = []
+        payload = self.serializer.dumps(o, buffers)
+        buffer_sizes = tuple(buf.nbytes for buf in buffers)
+        self.ref_counts.add(oid)
+        slot = self.ref_counts.slot(oid)
+        self.ref_counts.touch(slot)
+        block = self.allocate_or_move(HEADER_SIZE + object_size(len(payload), buffer_sizes))
+        if block is None:
+            path = self.write_file(payload, buffers)
+            self.index[oid] = (True, path, 0, len(payload), buffer_sizes, slot)
+            logger.debug(format_message("SpillStore.put", "putting object into file", {"oid": oid, "path": path}))
+        else:
+            arena, offset = block
+            write_object(arena.shm.buf, offset + HEADER_SIZE, payload, buffers)
+            self.index[oid] = (False, arena.name, offset, len(payload), buffer_sizes, slot)
+            logger.debug(format_message("SpillStore.put", "putting object into shared memory store", {"oid": oid, "arena": arena.name, "offset": offset}))
+            if len(buffers) == 0:
+                self.owned[oid] = (arena, offset, slot)
+                if len(self.owned) >= self.prune_at:
+                    self.prune_owned()
+        return oid
+
     def get(self, oid: str) -> Any:
-        logger.debug(format_message("SimpleStore.get", "getting object from shared memory store", {"oid": oid}))
-        return self.store[oid]
+        logger.debug(format_message("SpillStore.get", "getting object from spill store", {"oid": oid}))
+        while True:
+            moves = self.moves.value
+            in_file, location, offset, payload_size, buffer_sizes, slot = self.index[oid]
+            self.ref_counts.touch(slot)
+            if in_file:
+                return self.read_file(location, payload_size, buffer_sizes)
+            shm, _ = self.attach(location)
+            try:
+                o = self.serializer.loads(*read_object(shm.buf, offset + HEADER_SIZE, payload_size, buffer_sizes))
+            except Exception:
+                if self.moves.value == moves:
+                    raise
+                continue
+            # the object was read before it was moved if no object has been moved since, objects with out-of-band buffers are not moved
+            if len(buffer_sizes) > 0 or self.moves.value == moves:
+                return o
 
-    
+    def delete_object(self, oid: str) -> None:
+        logger.debug(format_message("SpillStore.delete_object", "deleting object", {"oid": oid}))
+        in_file, location, offset, payload_size, buffer_sizes, _ = self.index.pop(oid)
+        self.owned.pop(oid, None)
+        if in_file:
+            self.remove_file(location, object_size(payload_size, buffer_sizes))
+        else:
+            _, states = self.attach(location)
+            free_block(states, offset)
+            self.add_used(-HEADER_SIZE - object_size(payload_size, buffer_sizes))
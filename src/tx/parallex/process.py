@@ -1,47 +1,174 @@
 import sys
+import time
+import asyncio
+import traceback
 import logging
 from tx.functional.either import Left, Right, Either
 from tx.functional.maybe import Just, Nothing
+from queue import Empty
+from concurrent.futures import ThreadPoolExecutor
 from tx.readable_log import format_message, getLogger
-from typing import List, Any, Dict, Tuple, Set, Callable, TypeVar, TextIO
+from typing import List, Any, Dict, Tuple, Set, Callable, TypeVar, Optional, Union
 from .dependentqueue import DependentQueue
-from .task import EndOfQueue
+from .io import RecordWriter, FileRecordWriter, QueueRecordWriter
+from .serialization import Serializer
+from .task import EndOfQueue, clear_function_cache, init_async_thread
 
 logger = getLogger(__name__, logging.INFO)
 
-def work_on(queue : DependentQueue, output_path: str, library_paths : List[str]) -> None:
-    with open(output_path, "w") as output:
-        logger.debug("library_paths = %s", library_paths)
-        sys.path.extend(library_paths)
-        queue.init_thread()
-        while True:
-            jri = queue.get()
+
+TARGET_BATCH_DURATION = 0.05
+MAX_BATCH_SIZE = 256
+
+
+class BatchSizer:
+    """
+    Decides how many ready tasks a worker takes from the queue at a time.
+    :attr batch_size: a fixed batch size, or None to adapt the batch size to the measured task duration so that a batch takes about TARGET_BATCH_DURATION seconds
+    :attr task_duration: exponential moving average of task duration in seconds
+    """
+    def __init__(self, batch_size: Optional[int]):
+        self.batch_size = batch_size
+        self.task_duration : Optional[float] = None
+
+    def size(self) -> int:
+        if self.batch_size is not None:
+            return self.batch_size
+        elif self.task_duration is None:
+            return 1
+        else:
+            return max(1, min(MAX_BATCH_SIZE, int(TARGET_BATCH_DURATION / max(self.task_duration, 1e-6))))
+
+    def record(self, duration: float) -> None:
+        if self.task_duration is None:
+            self.task_duration = duration
+        else:
+            self.task_duration = 0.8 * self.task_duration + 0.2 * duration
+
+
+# :param output: the path of the output file, or a queue to stream records to
+# :param batch_size: the number of tasks taken from the queue and completed at a time, or None for adaptive batch size
+# :param serializer: the serializer of the output records
+# :param concurrency: if greater than 1, the maximum number of tasks calling coroutine functions that are run at a time on an event loop
+def work_on(queue : DependentQueue, output: Any, library_paths : List[str], batch_size: Optional[int] = 1, serializer: Union[None, str, Serializer] = None, concurrency: int = 1) -> None:
+    if isinstance(output, str):
+        with open(output, "wb") as output_file:
+            work_on_output(queue, FileRecordWriter(output_file, serializer), library_paths, batch_size, concurrency)
+    else:
+        writer = QueueRecordWriter(output, serializer)
+        try:
+            work_on_output(queue, writer, library_paths, batch_size, concurrency)
+        finally:
+            writer.close()
+
+
+def work_on_output(queue : DependentQueue, output: RecordWriter, library_paths : List[str], batch_size: Optional[int], concurrency: int = 1) -> None:
+    logger.debug("library_paths = %s", library_paths)
+    sys.path.extend(library_paths)
+    queue.init_thread()
+    batch_sizer = BatchSizer(batch_size)
+    if concurrency > 1:
+        work_on_async(queue, output, batch_sizer, concurrency)
+        return
+    end_of_queue = False
+    while not end_of_queue:
+        completions = []
+        for jri in queue.get_batch(batch_sizer.size()):
             job, results, subnode_results, jid = jri
             if isinstance(job, EndOfQueue):
+                end_of_queue = True
                 break
             else:
-                logger.debug(format_message("work_on", "task begin.", {
-                    "job": job,
-                    "jid": jid,
-                    "params": results
-                }))
-                logger.info("task begin %s", jid)
-                resultj = job.run(results, subnode_results, queue, output)
-                logger.debug(format_message("work_on", "task complete.", {
-                    "job": job,
-                    "jid": jid,
-                    "resultj": resultj,
-                    "params": results
-                }))
-                logger.info(f"task finish %s", jid)
-                queue.complete(jid, resultj)
-    
-
-
-    
-
-    
-
-        
-        
-    
+                completions.append((jid, run_task(job, results, subnode_results, jid, queue, output, batch_sizer)))
+        if len(completions) > 0:
+            queue.complete_batch(completions)
+
+
+def run_task(job: Any, results: Dict[str, Any], subnode_results: Dict[str, Any], jid: str, queue: DependentQueue, output: RecordWriter, batch_sizer: BatchSizer) -> Any:
+    logger.debug(format_message("work_on", "task begin.", {
+        "job": job,
+        "jid": jid,
+        "params": results
+    }))
+    logger.info("task begin %s", jid)
+    task_start_time = time.time()
+    resultj = job.run(results, subnode_results, queue, output)
+    batch_sizer.record(time.time() - task_start_time)
+    logger.debug(format_message("work_on", "task complete.", {
+        "job": job,
+        "jid": jid,
+        "resultj": resultj,
+        "params": results
+    }))
+    logger.info(f"task finish %s", jid)
+    return resultj
+
+
+ASYNC_POLL_INTERVAL = 0.01
+
+
+# tasks that call coroutine functions are run concurrently on an event loop, other tasks are run one at a time between steps of the event loop
+def work_on_async(queue : DependentQueue, output: RecordWriter, batch_sizer: BatchSizer, concurrency: int) -> None:
+    loop = asyncio.new_event_loop()
+    # tasks that evaluate specs run in threads
+    executor = ThreadPoolExecutor(concurrency, initializer=init_async_thread, initargs=(loop,))
+    loop.set_default_executor(executor)
+    running : Dict[asyncio.Task, str] = {}
+    try:
+        end_of_queue = False
+        while not end_of_queue or len(running) > 0:
+            completions = []
+            batch = []
+            if not end_of_queue and len(running) < concurrency:
+                try:
+                    # block only when there is nothing to wait for
+                    batch = queue.get_batch(min(batch_sizer.size(), concurrency - len(running)), block=len(running) == 0)
+                except Empty:
+                    pass
+            for job, results, subnode_results, jid in batch:
+                if isinstance(job, EndOfQueue):
+                    end_of_queue = True
+                    break
+                elif job.is_async():
+                    logger.info("task begin %s", jid)
+                    running[loop.create_task(job.arun(results, subnode_results, queue, output))] = jid
+                else:
+                    completions.append((jid, run_task(job, results, subnode_results, jid, queue, output, batch_sizer)))
+            if len(running) > 0:
+                # poll the queue for more tasks unless the worker is running as many tasks as it can
+                timeout = None if len(running) >= concurrency or end_of_queue else 0 if len(batch) > 0 else ASYNC_POLL_INTERVAL
+                done, _ = loop.run_until_complete(asyncio.wait(running.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED))
+                for task in done:
+                    jid = running.pop(task)
+                    logger.info(f"task finish %s", jid)
+                    completions.append((jid, task.result()))
+            if len(completions) > 0:
+                queue.complete_batch(completions)
+    finally:
+        for task in running.keys():
+            task.cancel()
+        if len(running) > 0:
+            loop.run_until_complete(asyncio.gather(*running.keys(), return_exceptions=True))
+        executor.shutdown()
+        loop.close()
+
+
+# :param control: a queue of runs, a run is a scheduler, the oid namespace of the scheduler, and the output of this worker, or None for the session's stream. None on the queue ends the session
+# :param done: this worker puts None, or the traceback if the run failed, on this queue when a run is finished
+# :param stream: a queue that records are streamed to
+def serve(control: Any, done: Any, stream: Any, object_store: Any, library_paths : List[str], batch_size: Optional[int] = 1, serializer: Union[None, str, Serializer] = None, concurrency: int = 1) -> None:
+    logger.debug("library_paths = %s", library_paths)
+    sys.path.extend(library_paths)
+    while True:
+        run = control.get()
+        if run is None:
+            break
+        scheduler, namespace, output = run
+        clear_function_cache()
+        queue = DependentQueue(None, EndOfQueue(), object_store, scheduler, namespace)
+        try:
+            work_on(queue, stream if output is None else output, [], batch_size, serializer, concurrency)
+            done.put(None)
+        except Exception:
+            logger.error(traceback.format_exc())
+            done.put(traceback.format_exc())
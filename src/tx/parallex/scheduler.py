@@ -0,0 +1,333 @@
+import logging
+import threading
+import time
+import datetime
+from heapq import heappush, heappop, heapify
+from itertools import chain, count
+from multiprocessing.managers import SyncManager
+from queue import Empty
+from uuid import uuid1
+from typing import List, Any, Dict, Tuple, Set, Optional
+from tx.readable_log import format_message, getLogger
+from .dependentqueue import Node, NodeMetadata, gen_oid
+
+logger = getLogger(__name__, logging.INFO)
+
+
+PRESSURE_THRESHOLD = 0.9
+
+
+class Scheduler:
+    """
+    The scheduler owns the dependency graph in plain dicts. It is either shared by threads of the same process or served from the coordinator process by a SchedulerManager, in which case every method call is one round trip.
+    :attr nodes:
+    :type nodes: dict[str, Node]
+    :attr meta: a map from node_id to its metadata
+    :type meta: dict[str, NodeMetadata]
+    :attr ref_counts: a map from oid to the number of nodes that have not released it yet
+    :type ref_counts: dict[str, int]
+    :attr ready: a heap of nodes that are ready and can be run by any worker. Nodes with higher priorities come first, nodes with the same priority in the order they became ready
+    :type ready: list[tuple[float, int, Node]]
+    :attr local: a map from worker to a heap of ready nodes whose inputs were all produced by that worker. The worker takes them first, other workers steal them when they have nothing else to do
+    :type local: dict[str, list[tuple[float, int, Node]]]
+    :attr pinned: a map from worker to a heap of ready nodes that depend on local nodes of that worker. Only that worker can run them
+    :type pinned: dict[str, list[tuple[float, int, Node]]]
+    :attr local_nodes: nodes that have been returned as local and are not complete
+    :type local_nodes: set[str]
+    :attr local_oids: referenced oids that are kept by a worker instead of the object store
+    :type local_oids: set[str]
+    :attr keep_local: whether results that only one worker uses are kept by that worker. Workers that may be lost must put every result in the object store
+    :type keep_local: bool
+    :attr running: a map from worker to nodes that have been returned to that worker and are not complete
+    :type running: dict[str, set[str]]
+    :attr lost: workers whose nodes have been requeued, they get no more nodes
+    :type lost: set[str]
+    :attr pressure: the fraction of the object store that is used, as last reported by a worker. When it is at least PRESSURE_THRESHOLD, nodes that free values are returned first, and nodes that add values are held back while other nodes are running
+    :type pressure: float
+    :attr end_of_queue: an end_of_queue object that will be returned when the scheduler is closed and there are no ready nodes
+    :type end_of_queue: any
+    :attr namespace: a prefix of the oids of this scheduler
+    :type namespace: str
+    :attr cancelled: if True, no more nodes are returned
+    :type cancelled: bool
+    """
+
+    def __init__(self, end_of_queue: Any, namespace: str = "", keep_local: bool = True):
+        self.namespace = namespace
+        self.keep_local = keep_local
+        self.cancelled = False
+        self.nodes : Dict[str, Node] = {}
+        self.meta : Dict[str, NodeMetadata] = {}
+        self.ref_counts : Dict[str, int] = {}
+        self.ready : List[Tuple[float, int, Node]] = []
+        self.local : Dict[str, List[Tuple[float, int, Node]]] = {}
+        self.pinned : Dict[str, List[Tuple[float, int, Node]]] = {}
+        self.counter = count()
+        self.local_nodes : Set[str] = set()
+        self.local_oids : Set[str] = set()
+        self.running : Dict[str, Set[str]] = {}
+        self.lost : Set[str] = set()
+        self.pressure = 0.0
+        self.throttled = 0
+        self.end_of_queue = end_of_queue
+        self.closed = False
+        self.cond = threading.Condition()
+
+    # :param nodes: a list of nodes and whether each of them is a hold node
+    def add_nodes(self, nodes: List[Tuple[Node, bool]]) -> None:
+        with self.cond:
+            for node, is_hold in nodes:
+                self._add_node(node, is_hold)
+
+    def _add_node(self, node: Node, is_hold: bool) -> None:
+        if node.node_id in self.nodes:
+            raise RuntimeError(f"{node.node_id} is already in the map")
+        self.nodes[node.node_id] = node
+
+        meta = self.meta.setdefault(node.node_id, NodeMetadata())
+        meta.depends = len(node.depends_on)
+        meta.subnode_depends = len(node.subnode_depends_on)
+
+        logger.info("add_node: %s", node.node_id)
+        logger.debug("add_node: %s depends_on %s subnode_depends_on %s", node.node_id, node.depends_on, node.subnode_depends_on)
+        for node_id in chain(node.depends_on.keys(), node.subnode_depends_on.keys()):
+            if node_id in self.local_nodes:
+                raise RuntimeError(f"{node.node_id} depends on {node_id} whose results are not stored")
+        for node_id in node.depends_on.keys():
+            self.meta.setdefault(node_id, NodeMetadata()).refs.add(node.node_id)
+
+        for node_id in node.subnode_depends_on.keys():
+            self.meta.setdefault(node_id, NodeMetadata()).subnode_refs.add(node.node_id)
+
+        if not is_hold and meta.depends == 0 and meta.subnode_depends == 0:
+            self._put_ready(node, meta)
+
+    def _put_ready(self, node: Node, meta: NodeMetadata) -> None:
+        logger.info(f"task added to ready queue {node.node_id}")
+        node.ready_time = time.time()
+        entry = (-node.priority, next(self.counter), node)
+        if len(meta.workers) == 1 and (worker := next(iter(meta.workers))) is not None:
+            heappush((self.pinned if meta.pinned else self.local).setdefault(worker, []), entry)
+            self.cond.notify_all()
+        else:
+            heappush(self.ready, entry)
+            self.cond.notify()
+
+    def _has_ready(self, worker: Optional[str]) -> bool:
+        return len(self.ready) > 0 or len(self.pinned.get(worker, ())) > 0 or any(len(nodes) > 0 for nodes in self.local.values())
+
+    # a worker takes pinned nodes first, then the node with the highest priority among its local nodes and nodes that any worker can run, then steals the node with the highest priority among local nodes of other workers
+    def _pop_ready(self, worker: Optional[str]) -> Optional[Node]:
+        pinned = self.pinned.get(worker)
+        if pinned:
+            return heappop(pinned)[2]
+        heaps = [heap for heap in (self.local.get(worker), self.ready) if heap]
+        if len(heaps) == 0:
+            heaps = [heap for heap in self.local.values() if heap]
+        if len(heaps) == 0:
+            return None
+        if self.pressure >= PRESSURE_THRESHOLD:
+            return self._pop_freeing(heaps)
+        return heappop(min(heaps, key=lambda heap: heap[0][:2]))[2]
+
+    # a node frees values if it takes at least as many values as it produces
+    def _frees_values(self, node: Node) -> bool:
+        return sum(len(names) for names in chain(node.depends_on.values(), node.subnode_depends_on.values())) >= len(node.names)
+
+    # :param heaps: heaps that the worker takes nodes from
+    # :return: the node with the highest priority among nodes that free values, including local nodes of other workers, or if there is none and no other node is running, the node with the highest priority in heaps
+    def _pop_freeing(self, heaps: List[List[Tuple[float, int, Node]]]) -> Optional[Node]:
+        candidates = [self.ready] + [heap for heap in self.local.values()]
+        entries = [(entry, heap, i) for heap in candidates for i, entry in enumerate(heap) if self._frees_values(entry[2])]
+        if len(entries) > 0:
+            entry, heap, i = min(entries, key=lambda entry: entry[0][:2])
+            heap[i] = heap[-1]
+            heap.pop()
+            heapify(heap)
+            return entry[2]
+        if any(len(nodes) > 0 for nodes in self.running.values()):
+            return None
+        return heappop(min(heaps, key=lambda heap: heap[0][:2]))[2]
+
+    # every node that depends on a local node depends on no other node, so it becomes ready when the local node is complete and is pinned to the same worker
+    def _is_local(self, node: Node) -> bool:
+        meta = self.meta.get(node.node_id, NodeMetadata())
+        for ref in meta.refs | meta.subnode_refs:
+            refnode = self.nodes[ref]
+            if any(node_id != node.node_id for node_id in chain(refnode.depends_on.keys(), refnode.subnode_depends_on.keys())):
+                return False
+        return True
+
+    # :param n: the maximum number of nodes to return
+    # :param worker: identifies the worker, nodes are returned preferably to the worker that produced their inputs
+    # :param pressure: the fraction of the object store that is used, if it is known by the worker
+    # :return: a nonempty list of ready nodes, or a list containing a single end_of_queue node if the scheduler is closed and no node is ready
+    def get_ready_nodes(self, n: int = 1, block: bool = True, timeout: Optional[float] = None, worker: Optional[str] = None, pressure: Optional[float] = None) -> List[Node]:
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            if worker in self.lost:
+                raise RuntimeError(f"worker {worker} was lost")
+            if pressure is not None:
+                if pressure < PRESSURE_THRESHOLD <= self.pressure and self.throttled > 0:
+                    self.cond.notify_all()
+                self.pressure = pressure
+            while True:
+                if block and not self.cond.wait_for(lambda: self._has_ready(worker) or self.closed, None if deadline is None else deadline - time.time()):
+                    raise Empty()
+                if self._has_ready(worker) and not self.cancelled:
+                    start_time = time.time()
+                    nodes = []
+                    while len(nodes) < n and (node := self._pop_ready(worker)) is not None:
+                        node.start_time = start_time
+                        node.local = self.keep_local and worker is not None and self._is_local(node)
+                        if node.local:
+                            self.local_nodes.add(node.node_id)
+                        if worker is not None:
+                            self.running.setdefault(worker, set()).add(node.node_id)
+                        nodes.append(node)
+                    if len(nodes) > 0:
+                        return nodes
+                    # ready nodes are held back, wait until a running node is complete
+                    if not block:
+                        raise Empty()
+                    self.throttled += 1
+                    try:
+                        if not self.cond.wait(None if deadline is None else deadline - time.time()):
+                            raise Empty()
+                    finally:
+                        self.throttled -= 1
+                elif self.closed:
+                    return [Node(self.end_of_queue, f"end_of_queue@{uuid1()}", set())]
+                else:
+                    raise Empty()
+
+    # :param node_ids: nodes that are complete, their results must have been put in the object store unless they are local
+    # :param released: oids retrieved by those nodes
+    # :param worker: the worker that ran the nodes
+    # :return: oids that are no longer referenced, the caller should delete them from the object store
+    def complete_nodes(self, node_ids: List[str], released: List[str], worker: Optional[str] = None) -> List[str]:
+        with self.cond:
+            # the nodes have been requeued
+            if worker in self.lost:
+                raise RuntimeError(f"worker {worker} was lost")
+            unreferenced = self._release(released)
+            for node_id in node_ids:
+                unreferenced.extend(self._complete_node(node_id, worker))
+            if self.throttled > 0:
+                self.cond.notify_all()
+            return unreferenced
+
+    def _release(self, oids: List[str]) -> List[str]:
+        unreferenced = []
+        for oid in oids:
+            count = self.ref_counts[oid] - 1
+            if count == 0:
+                del self.ref_counts[oid]
+                self.local_oids.discard(oid)
+                unreferenced.append(oid)
+            else:
+                self.ref_counts[oid] = count
+        return unreferenced
+
+    def _complete_node(self, node_id: str, worker: Optional[str] = None) -> List[str]:
+        node_complete_time = time.time()
+        node = self.nodes.pop(node_id)
+        meta = self.meta.pop(node_id, NodeMetadata())
+        local = node_id in self.local_nodes
+        self.local_nodes.discard(node_id)
+        if worker is not None:
+            self.running.get(worker, set()).discard(node_id)
+        logger.debug(format_message("complete_node", node_id, {"refs": meta.refs, "subnode_refs": meta.subnode_refs}))
+
+        counts = {gen_oid(node_id, name, self.namespace): 0 for name in node.names}
+        for ref in meta.subnode_refs | meta.refs:
+            refnode = self.nodes[ref]
+            refmeta = self.meta[ref]
+            names = set()
+            if ref in meta.subnode_refs:
+                names |= refnode.subnode_depends_on[node_id]
+                for name in refnode.subnode_depends_on[node_id]:
+                    oid = gen_oid(node_id, name, self.namespace)
+                    counts[oid] = counts.get(oid, 0) + 1
+                refmeta.subnode_depends -= 1
+            if ref in meta.refs:
+                names |= refnode.depends_on[node_id]
+                for name in refnode.depends_on[node_id]:
+                    oid = gen_oid(node_id, name, self.namespace)
+                    counts[oid] = counts.get(oid, 0) + 1
+                refmeta.depends -= 1
+            # hold nodes do not produce inputs
+            if len(names) > 0:
+                refmeta.workers.add(worker)
+                refmeta.pinned = refmeta.pinned or local
+
+            if refmeta.depends == 0 and refmeta.subnode_depends == 0:
+                self._put_ready(refnode, refmeta)
+
+        unreferenced = []
+        for oid, count in counts.items():
+            if count == 0:
+                unreferenced.append(oid)
+            else:
+                self.ref_counts[oid] = count
+                if local:
+                    self.local_oids.add(oid)
+
+        logger.debug("complete_node: len(self.nodes) = %s", len(self.nodes))
+        if len(self.nodes) == 0:
+            self._close()
+
+        logger.info(format_message("Scheduler.complete_node", "time", {
+            "node_id": node_id,
+            "ready_time": lambda: datetime.datetime.fromtimestamp(node.ready_time),
+            "start_time": lambda: datetime.datetime.fromtimestamp(node.start_time),
+            "complete_time": lambda: datetime.datetime.fromtimestamp(node_complete_time),
+            "ready_to_start": node.start_time - node.ready_time,
+            "remaining": len(self.nodes),
+            "ready": len(self.ready)
+        }))
+        return unreferenced
+
+    # :param workers: workers that are lost, nodes that they are running are returned to other workers. Their local results must not be needed, see keep_local
+    def requeue(self, workers: List[str]) -> None:
+        with self.cond:
+            for worker in workers:
+                self.lost.add(worker)
+                for node_id in self.running.pop(worker, set()):
+                    logger.info(f"requeue {node_id} of lost worker {worker}")
+                    self.local_nodes.discard(node_id)
+                    self._put_ready(self.nodes[node_id], NodeMetadata())
+                for entry in chain(self.local.pop(worker, []), self.pinned.pop(worker, [])):
+                    heappush(self.ready, entry)
+            self.cond.notify_all()
+
+    def close(self) -> None:
+        with self.cond:
+            self._close()
+
+    # stop returning nodes, workers get end_of_queue once the nodes they are running are complete
+    def cancel(self) -> None:
+        with self.cond:
+            self.cancelled = True
+            self._close()
+
+    # :return: oids that are still referenced and are in the object store, the caller should delete them from the object store once no worker is using the scheduler
+    def clear(self) -> List[str]:
+        with self.cond:
+            oids = [oid for oid in self.ref_counts.keys() if oid not in self.local_oids]
+            self.ref_counts.clear()
+            self.local_oids.clear()
+            return oids
+
+    def _close(self) -> None:
+        self.closed = True
+        self.cond.notify_all()
+
+
+class SchedulerManager(SyncManager):
+    """A SyncManager that also serves Schedulers, so that the coordinator process that owns the dependency graph is the same process that serves the shared objects.
+    """
+    pass
+
+
+SchedulerManager.register("Scheduler", Scheduler)
@@ -0,0 +1,91 @@
+import pickle
+from abc import ABC, abstractmethod
+from typing import Any, List, Optional, Sequence, Union
+import jsonpickle
+try:
+    import msgpack
+except ModuleNotFoundError as e:
+    pass
+
+
+class Serializer(ABC):
+    """
+    Serializes values put in object stores and written to output files.
+    """
+    # :param buffers: if not None, buffers that can be transferred out of band are appended to it instead of serialized in band
+    @abstractmethod
+    def dumps(self, o: Any, buffers: Optional[List[memoryview]] = None) -> bytes:
+        pass
+
+    # :param buffers: out of band buffers appended by dumps
+    @abstractmethod
+    def loads(self, data: Union[bytes, memoryview], buffers: Sequence[memoryview] = ()) -> Any:
+        pass
+
+
+class PickleSerializer(Serializer):
+    """
+    Pickle protocol 5. Contiguous PickleBuffers, such as the data of NumPy arrays, can be transferred out of band.
+    """
+    def dumps(self, o: Any, buffers: Optional[List[memoryview]] = None) -> bytes:
+        if buffers is None:
+            return pickle.dumps(o, protocol=5)
+
+        def buffer_callback(buf: pickle.PickleBuffer) -> bool:
+            try:
+                buffers.append(buf.raw())
+                return False
+            except BufferError:
+                # not contiguous, serialize in band
+                return True
+
+        return pickle.dumps(o, protocol=5, buffer_callback=buffer_callback)
+
+    def loads(self, data: Union[bytes, memoryview], buffers: Sequence[memoryview] = ()) -> Any:
+        return pickle.loads(data, buffers=buffers)
+
+
+class JsonSerializer(Serializer):
+    """
+    JSON encoded by jsonpickle.
+    """
+    def dumps(self, o: Any, buffers: Optional[List[memoryview]] = None) -> bytes:
+        return jsonpickle.encode(o).encode("utf-8")
+
+    def loads(self, data: Union[bytes, memoryview], buffers: Sequence[memoryview] = ()) -> Any:
+        return jsonpickle.decode(bytes(data).decode("utf-8"))
+
+
+PICKLE_EXT_TYPE = 1
+
+
+class MsgpackSerializer(Serializer):
+    """
+    MessagePack, requires the msgpack package. Values that MessagePack does not support are pickled into an extension type. Tuples are decoded as lists.
+    """
+    def dumps(self, o: Any, buffers: Optional[List[memoryview]] = None) -> bytes:
+        return msgpack.packb(o, default=lambda x: msgpack.ExtType(PICKLE_EXT_TYPE, pickle.dumps(x, protocol=5)), use_bin_type=True)
+
+    def loads(self, data: Union[bytes, memoryview], buffers: Sequence[memoryview] = ()) -> Any:
+        return msgpack.unpackb(data, ext_hook=lambda code, x: pickle.loads(x) if code == PICKLE_EXT_TYPE else msgpack.ExtType(code, x), raw=False, strict_map_key=False)
+
+
+serializers = {
+    "pickle": PickleSerializer,
+    "json": JsonSerializer,
+    "msgpack": MsgpackSerializer
+}
+
+
+DEFAULT_SERIALIZER = "pickle"
+
+
+# :param serializer: a serializer, a serializer name, or None for the default serializer
+def get_serializer(serializer: Union[None, str, Serializer] = None) -> Serializer:
+    if serializer is None:
+        serializer = DEFAULT_SERIALIZER
+    if isinstance(serializer, str):
+        if serializer not in serializers:
+            raise RuntimeError(f"unsupported serializer {serializer}")
+        return serializers[serializer]()
+    return serializer
@@ -0,0 +1,85 @@
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Tuple, Optional
+
+ALIGNMENT = 64
+HEADER_SIZE = ALIGNMENT
+BLOCK_FREE = 0
+BLOCK_LIVE = 1
+
+
+def align(size: int) -> int:
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class Arena:
+    """
+    A shared memory segment owned by the process that created it. Blocks are allocated first fit from a free list or from the top of the segment. Each block starts with a header whose first word is the state of the block. Any process may free a block by setting its state to BLOCK_FREE, the owner reclaims freed blocks when it runs out of space.
+    :attr blocks: a map from offset to size of blocks that have been allocated and not reclaimed
+    :attr free: a list of offsets and sizes of free blocks below top, sorted by offset
+    """
+    def __init__(self, name: str, size: int):
+        self.shm = SharedMemory(name=name, create=True, size=size)
+        self.name = self.shm.name
+        self.size = size
+        self.states = self.shm.buf.cast("q")
+        self.top = 0
+        self.blocks : Dict[int, int] = {}
+        self.free : List[Tuple[int, int]] = []
+
+    def allocate(self, size: int) -> Optional[int]:
+        offset = self._allocate(size)
+        if offset is None:
+            self.reclaim()
+            offset = self._allocate(size)
+        if offset is not None:
+            self.blocks[offset] = size
+            self.states[offset // 8] = BLOCK_LIVE
+        return offset
+
+    def _allocate(self, size: int) -> Optional[int]:
+        for i, (offset, free_size) in enumerate(self.free):
+            if free_size >= size:
+                if free_size == size:
+                    del self.free[i]
+                else:
+                    self.free[i] = (offset + size, free_size - size)
+                return offset
+        if self.top + size <= self.size:
+            offset = self.top
+            self.top += size
+            return offset
+        return None
+
+    def reclaim(self) -> None:
+        freed = [(offset, size) for offset, size in self.blocks.items() if self.states[offset // 8] == BLOCK_FREE]
+        for offset, _ in freed:
+            del self.blocks[offset]
+        coalesced : List[Tuple[int, int]] = []
+        for offset, size in sorted(self.free + freed):
+            if len(coalesced) > 0 and sum(coalesced[-1]) == offset:
+                coalesced[-1] = (coalesced[-1][0], coalesced[-1][1] + size)
+            else:
+                coalesced.append((offset, size))
+        if len(coalesced) > 0 and sum(coalesced[-1]) == self.top:
+            self.top = coalesced.pop()[0]
+        self.free = coalesced
+
+    def used(self) -> int:
+        return sum(self.blocks.values())
+
+
+def free_block(states: memoryview, offset: int) -> None:
+    states[offset // 8] = BLOCK_FREE
+
+
+def close_shared_memory(shm: SharedMemory, unlink: bool) -> None:
+    try:
+        shm.close()
+    except BufferError:
+        # objects read in place still reference the segment, it is unmapped when they are garbage collected
+        pass
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
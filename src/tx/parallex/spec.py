@@ -1,13 +1,24 @@
 import logging
+import os
+import os.path
+import stat
+import hmac
+import pickle
+import hashlib
+from tempfile import mkstemp
+from collections import OrderedDict
 from graph import Graph
 from functools import partial
+from itertools import chain
+from heapq import heapify, heappush, heappop
 from copy import deepcopy
 from tx.functional.either import Left, Right, Either
 from tx.functional.maybe import Just, Nothing, Maybe
 from tx.functional.utils import compose
 from tx.readable_log import format_message, getLogger
+from . import data
 from typing import List, Any, Dict, Tuple, Callable, Set, Optional, TypeVar, Union
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields, is_dataclass
 from abc import ABC
 
 logger = getLogger(__name__, logging.INFO)
@@ -37,12 +48,31 @@ class DataValue(AbsValue):
 class AbsSpec(ABC):
     node_id: Optional[str]
 
+    # bound_names and free_names are memoized in the spec, assigning a field other than node_id clears them
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name != "node_id":
+            forget_names(self)
+
+
+BOUND_NAMES = "_bound_names"
+FREE_NAMES = "_free_names"
+PRIORITY = "_priority"
+
+
+# call when a descendant of spec has been modified
+def forget_names(spec: AbsSpec) -> None:
+    spec.__dict__.pop(BOUND_NAMES, None)
+    spec.__dict__.pop(FREE_NAMES, None)
+
 
 @dataclass
 class MapSpec(AbsSpec):
     coll: AbsValue
     var: str
     sub: AbsSpec
+    # the number of rows evaluated by one task when the map is executed sequentially
+    chunk_size: int = 1
 
 
 @dataclass
@@ -57,6 +87,9 @@ class PythonSpec(AbsSpec):
     mod: str
     func: str
     params: Dict[Union[int, str], AbsValue] = field(default_factory=dict)
+    vectorized: bool = False
+    # the estimated cost of the task relative to other tasks, used to compute priorities
+    weight: float = 1
 
 
 @dataclass
@@ -81,6 +114,14 @@ class SeqSpec(AbsSpec):
     sub: List[AbsSpec] # a sequence of tasks with the last task in the sequence return a value
 
 
+@dataclass
+class FusedSpec(SeqSpec):
+    """
+    A seq of tasks fused by combine_sequential_tasks. Unlike a seq, errors in its inputs are passed to its tasks, so that each task produces the same value as it would if it were not fused.
+    """
+    pass
+
+
 def dict_to_value(x: dict) -> AbsValue:
     if "name" in x:
         return NameValue(x["name"])
@@ -95,7 +136,7 @@ def dict_to_spec(x: dict) -> AbsSpec:
     if ty == "let":
         return LetSpec(name=x["name"], obj=dict_to_value(x["obj"]), node_id=None)
     elif ty == "map":
-        return MapSpec(coll=dict_to_value(x["coll"]), var=x["var"], sub=dict_to_spec(x["sub"]), node_id=None)
+        return MapSpec(coll=dict_to_value(x["coll"]), var=x["var"], sub=dict_to_spec(x["sub"]), chunk_size=x.get("chunk_size", 1), node_id=None)
     elif ty == "cond":
         return CondSpec(on=dict_to_value(x["on"]), then=dict_to_spec(x["then"]), _else=dict_to_spec(x["else"]), node_id=None)
     elif ty == "top":
@@ -105,13 +146,31 @@ def dict_to_spec(x: dict) -> AbsSpec:
     elif ty == "ret":
         return RetSpec(obj=dict_to_value(x["obj"]), node_id=None)
     elif ty == "python":
-        return PythonSpec(name=x["name"], mod=x["mod"], func=x["func"], params={k: dict_to_value(v) for k,v in x.get("params", {}).items()}, node_id=None)
+        return PythonSpec(name=x["name"], mod=x["mod"], func=x["func"], params={k: dict_to_value(v) for k,v in x.get("params", {}).items()}, vectorized=x.get("vectorized", False), weight=x.get("weight", 1), node_id=None)
     else:
         raise RuntimeError(f"unsupported dict {x}")
 
 
-# return a set of names that a spec provides values for
+# :return: a copy of spec dict in which maps that do not set chunk_size have chunk_size
+def set_default_chunk_size(x: dict, chunk_size: int) -> dict:
+    y = dict(x)
+    for k in ("sub", "then", "else"):
+        if k in y:
+            y[k] = [set_default_chunk_size(sub, chunk_size) for sub in y[k]] if isinstance(y[k], list) else set_default_chunk_size(y[k], chunk_size)
+    if y["type"] == "map":
+        y.setdefault("chunk_size", chunk_size)
+    return y
+
+
+# return a set of names that a spec provides values for, the set must not be modified
 def bound_names(spec: AbsSpec) -> Set[str]:
+    names = spec.__dict__.get(BOUND_NAMES)
+    if names is None:
+        names = spec.__dict__[BOUND_NAMES] = compute_bound_names(spec)
+    return names
+
+
+def compute_bound_names(spec: AbsSpec) -> Set[str]:
     if isinstance(spec, PythonSpec):
         return {spec.name}
     elif isinstance(spec, LetSpec):
@@ -134,7 +193,15 @@ def free_names_value(v: AbsValue) -> Maybe[str]:
     return Just(v.name) if isinstance(v, NameValue) else Nothing
 
 
+# return a set of names that a spec depends on, the set must not be modified
 def free_names(spec: AbsSpec) -> Set[str]:
+    names = spec.__dict__.get(FREE_NAMES)
+    if names is None:
+        names = spec.__dict__[FREE_NAMES] = compute_free_names(spec)
+    return names
+
+
+def compute_free_names(spec: AbsSpec) -> Set[str]:
     if isinstance(spec, PythonSpec):
         params = spec.params
         if len(params) == 0:
@@ -171,42 +238,56 @@ def free_names(spec: AbsSpec) -> Set[str]:
 no_op = TopSpec(node_id=None, sub=[])
 
 
+# the module of functions that the Python DSL translates operators to
+DATA_MODULE = "tx.parallex.data"
+
+
 def ret_prefix_to_str(ret_prefix: List[Any], exclude_str=True) -> str:
     return ".".join(map(str, filter(lambda x : not isinstance(x, str), ret_prefix) if exclude_str else ret_prefix))
 
 
+# sort subs so that every sub comes after subs that bind its free names, with Kahn's algorithm. Of subs that are ready, the first in subs comes first
+# :param env: names that are bound outside of subs
 def sort_tasks(env: Set[str], subs: List[AbsSpec]) -> List[AbsSpec]:
-    # logger.debug(f"sort_tasks: before: {subs}, env = {env}")
-    copy = list(subs)
+    # a map from name to indices of subs that are waiting for the name
+    waiting : Dict[str, List[int]] = {}
+    # the number of free names that each sub is waiting for
+    counts = []
+    ready : List[int] = []
+    for i, sub in enumerate(subs):
+        missing = free_names(sub) - env
+        for name in missing:
+            waiting.setdefault(name, []).append(i)
+        counts.append(len(missing))
+        if len(missing) == 0:
+            ready.append(i)
+
     subs_sorted = []
     visited = set(env)
-    while len(copy) > 0:
-        copy2 = []
-        updated = False
-        for sub in copy:
-            bound_names_sub = bound_names(sub)
-            free_names_sub = free_names(sub)
-            if len(free_names_sub - visited) == 0:
-                visited |= bound_names_sub
-                subs_sorted.append(sub)
-                updated = True
-            else:
-                copy2.append(sub)
-        if updated:
-            copy = copy2
-        else:
-            logger.error(format_message("sort_tasks:", "unresolved dependencies or cycle in depedencies graph", {
-                "visited": visited
-            }))
-            for task in copy:
+    heapify(ready)
+    while len(ready) > 0:
+        sub = subs[heappop(ready)]
+        subs_sorted.append(sub)
+        for name in bound_names(sub) - visited:
+            visited.add(name)
+            for j in waiting.pop(name, []):
+                counts[j] -= 1
+                if counts[j] == 0:
+                    heappush(ready, j)
+
+    if len(subs_sorted) < len(subs):
+        logger.error(format_message("sort_tasks:", "unresolved dependencies or cycle in depedencies graph", {
+            "visited": visited
+        }))
+        for i, task in enumerate(subs):
+            if counts[i] > 0:
                 logger.error(format_message("sort_tasks:", "remaining task", {
                     "task": task,
                     "free_names(task)": free_names(task),
                     "free_names(task) - visisted": free_names(task) - visited
                 }))
-            raise RuntimeError("unresolved dependencies or cycle in depedencies graph")
+        raise RuntimeError("unresolved dependencies or cycle in depedencies graph")
 
-    # logger.debug(f"sort_tasks: after: {subs_sorted}")
     return subs_sorted
 
 
@@ -280,25 +361,42 @@ def generate_dependency_graph(graph: Graph, node_map: Dict[str, str], return_ids
         raise RuntimeError(f"generate_dependency_graph: unsupported task {spec}")
     
 
+# :return: nodes that a node in ret_ids depends on directly or indirectly, and ret_ids
+def live_nodes(dg: Graph, ret_ids: Set[str]) -> Set[str]:
+    preds : Dict[str, List[str]] = {}
+    for from_node, to_node, _ in dg.edges():
+        preds.setdefault(to_node, []).append(from_node)
+    live = set(ret_ids)
+    frontier = list(ret_ids)
+    while len(frontier) > 0:
+        for pred in preds.get(frontier.pop(), []):
+            if pred not in live:
+                live.add(pred)
+                frontier.append(pred)
+    return live
+
+
 # remove tasks that do not provide a return value
 def remove_unreachable_tasks(dg: Graph, ret_ids: Set[str], spec: AbsSpec) -> AbsSpec:
-    # logger.debug(f"remote_unreachable_tasks: spec[\"node_id\"] = {spec['node_id']}")
-    if all(spec.node_id != a and not dg.is_connected(spec.node_id, a) for a in ret_ids):
-        # logger.debug(f"remote_unreachable_tasks: {spec['node_id']} is unreachable, replace by noop")
+    return remove_dead_tasks(live_nodes(dg, ret_ids), spec)
+
+
+def remove_dead_tasks(live: Set[str], spec: AbsSpec) -> AbsSpec:
+    if spec.node_id not in live:
         return no_op
     else:
         if isinstance(spec, PythonSpec):
             return spec
         elif isinstance(spec, MapSpec):
-            sub = remove_unreachable_tasks(dg, ret_ids, spec.sub)
+            sub = remove_dead_tasks(live, spec.sub)
             if sub == no_op:
                 return no_op
             else:
                 spec.sub = sub
                 return spec
         elif isinstance(spec, CondSpec):
-            then = remove_unreachable_tasks(dg, ret_ids, spec.then)
-            _else = remove_unreachable_tasks(dg, ret_ids, spec._else)
+            then = remove_dead_tasks(live, spec.then)
+            _else = remove_dead_tasks(live, spec._else)
             if then == no_op and _else == no_op:
                 return no_op
             else:
@@ -308,7 +406,7 @@ def remove_unreachable_tasks(dg: Graph, ret_ids: Set[str], spec: AbsSpec) -> Abs
         elif isinstance(spec, LetSpec):
             return spec
         elif isinstance(spec, TopSpec):
-            subs = list(filter(lambda c: c != no_op, map(partial(remove_unreachable_tasks, dg, ret_ids), spec.sub)))
+            subs = list(filter(lambda c: c != no_op, map(partial(remove_dead_tasks, live), spec.sub)))
             spec.sub = subs
             return spec
         elif isinstance(spec, SeqSpec):
@@ -319,24 +417,408 @@ def remove_unreachable_tasks(dg: Graph, ret_ids: Set[str], spec: AbsSpec) -> Abs
             raise RuntimeError(f"remove_unreachable_tasks: unsupported task {spec}")
 
         
-def propagate_constants(dg: Graph, ret_ids: Set[str], spec: AbsSpec) -> AbsSpec:
-    return spec
+def substitute_value(constants: Dict[str, Any], v: AbsValue) -> AbsValue:
+    return DataValue(data=constants[v.name]) if isinstance(v, NameValue) and v.name in constants else v
+
+
+# the maximum length of a folded str, bytes, or tuple, and the maximum number of bits of a folded int
+FOLD_SIZE = 1 << 10
+FOLD_INT_BITS = 1 << 13
+
+
+# a compiled spec is cached and shared by runs, by reference with the thread executor, so only immutable values of bounded size are folded into it
+def is_foldable(x: Any) -> bool:
+    if x is None or isinstance(x, (bool, float)):
+        return True
+    elif isinstance(x, int):
+        return x.bit_length() <= FOLD_INT_BITS
+    elif isinstance(x, (str, bytes)):
+        return len(x) <= FOLD_SIZE
+    elif type(x) is tuple:
+        return len(x) <= FOLD_SIZE and all(map(is_foldable, x))
+    else:
+        return False
+
+
+# :return: whether the result of an operator that may grow its operands without bound is foldable, before it is computed
+def is_bounded(func: str, args: List[Any]) -> bool:
+    if func in ("_pow", "_l_shift", "_mult") and len(args) != 2:
+        return False
+    if func == "_pow":
+        a, b = args
+        return not isinstance(a, int) or not isinstance(b, int) or abs(a) <= 1 or b * a.bit_length() <= FOLD_INT_BITS
+    elif func == "_l_shift":
+        a, b = args
+        return not isinstance(a, int) or not isinstance(b, int) or a.bit_length() + b <= FOLD_INT_BITS
+    elif func == "_mult":
+        a, b = args
+        if isinstance(a, int) and not isinstance(a, bool):
+            a, b = b, a
+        return not isinstance(a, (str, bytes, tuple, list)) or not isinstance(b, int) or len(a) * b <= FOLD_SIZE
+    else:
+        return True
+
+
+# :return: the value of a python task on tx.parallex.data whose params are all data and whose result is foldable, or Nothing if it is not evaluated at compile time
+def evaluate_constant(spec: PythonSpec) -> Maybe[Any]:
+    if spec.mod != DATA_MODULE or not spec.func.startswith("_") or not all(isinstance(v, DataValue) for v in spec.params.values()):
+        return Nothing
+    func = getattr(data, spec.func, None)
+    if not callable(func):
+        return Nothing
+    args = [v.data for _, v in sorted((k, v) for k, v in spec.params.items() if isinstance(k, int))]
+    kwargs = {k: v.data for k, v in spec.params.items() if isinstance(k, str)}
+    if not is_bounded(spec.func, args):
+        return Nothing
+    try:
+        value = func(*args, **kwargs)
+    except Exception as e:
+        # the error is reported when the task is executed
+        logger.debug(format_message("evaluate_constant", "cannot evaluate", {"spec": spec, "error": str(e)}))
+        return Nothing
+    return Just(value) if is_foldable(value) else Nothing
+
+
+# inline names bound to data by let tasks and by python tasks on tx.parallex.data into the tasks that use them, and remove those tasks
+# :param fixed: names that are never replaced
+# :param constants: values of names in scope
+# :return: spec, or None if it has been removed; constants that spec binds in the enclosing scope; the number of tasks removed
+def fold_constants(fixed: Set[str], constants: Dict[str, Any], spec: AbsSpec) -> Tuple[Optional[AbsSpec], Dict[str, Any], int]:
+    if isinstance(spec, LetSpec):
+        spec.obj = substitute_value(constants, spec.obj)
+        if isinstance(spec.obj, DataValue) and spec.name not in fixed:
+            return None, {spec.name: spec.obj.data}, 1
+        return spec, {}, 0
+    elif isinstance(spec, PythonSpec):
+        spec.params = {k: substitute_value(constants, v) for k, v in spec.params.items()}
+        if spec.name not in fixed and (value := evaluate_constant(spec)) != Nothing:
+            return None, {spec.name: value.value}, 1
+        return spec, {}, 0
+    elif isinstance(spec, RetSpec):
+        spec.obj = substitute_value(constants, spec.obj)
+        return spec, {}, 0
+    elif isinstance(spec, MapSpec):
+        spec.coll = substitute_value(constants, spec.coll)
+        sub, _, removed = fold_constants(fixed, {k: v for k, v in constants.items() if k != spec.var}, spec.sub)
+        if sub is None:
+            spec.sub = TopSpec(node_id=None, sub=[])
+        forget_names(spec)
+        return spec, {}, removed
+    elif isinstance(spec, CondSpec):
+        spec.on = substitute_value(constants, spec.on)
+        then, _, removed_then = fold_constants(fixed, constants, spec.then)
+        _else, _, removed_else = fold_constants(fixed, constants, spec._else)
+        if then is None:
+            spec.then = TopSpec(node_id=None, sub=[])
+        if _else is None:
+            spec._else = TopSpec(node_id=None, sub=[])
+        forget_names(spec)
+        return spec, {}, removed_then + removed_else
+    elif isinstance(spec, (TopSpec, SeqSpec)):
+        # names bound in this block shadow names in the enclosing scope
+        scope = {k: v for k, v in constants.items() if k not in bound_names_list(spec.sub)}
+        bound : Dict[str, Any] = {}
+        removed = 0
+        folded = {}
+        for sub in sort_tasks(free_names(spec), spec.sub):
+            folded_sub, sub_constants, sub_removed = fold_constants(fixed, scope, sub)
+            folded[id(sub)] = folded_sub
+            scope.update(sub_constants)
+            bound.update(sub_constants)
+            removed += sub_removed
+        if removed > 0:
+            spec.sub = [folded[id(sub)] for sub in spec.sub if folded[id(sub)] is not None]
+        forget_names(spec)
+        # only names bound by a seq are visible in the enclosing scope
+        bound = bound if isinstance(spec, SeqSpec) else {}
+        if len(spec.sub) == 0 and removed > 0:
+            return None, bound, removed + 1
+        return spec, bound, removed
+    else:
+        raise RuntimeError(f"fold_constants: unsupported task {spec}")
+
+
+# names of colls of maps and conditions of conds
+def control_names(spec: AbsSpec) -> Set[str]:
+    if isinstance(spec, MapSpec):
+        return maybe_to_set(free_names_value(spec.coll)) | control_names(spec.sub)
+    elif isinstance(spec, CondSpec):
+        return maybe_to_set(free_names_value(spec.on)) | control_names(spec.then) | control_names(spec._else)
+    elif isinstance(spec, (TopSpec, SeqSpec)):
+        return set().union(*map(control_names, spec.sub))
+    else:
+        return set()
+
+
+# names of inputs are not replaced. Neither are names used by maps and conds, so that they are executed as they would be without constant propagation, in particular, errors of a dynamic map or cond are reported differently from a static one
+# :return: spec and the number of tasks removed
+def propagate_constants(inputs: Set[str], spec: AbsSpec) -> Tuple[AbsSpec, int]:
+    folded, _, removed = fold_constants(inputs | control_names(spec), {}, spec)
+    return no_op if folded is None else folded, removed
 
         
-def combine_sequential_tasks(dg: Graph, ret_ids: Set[str], spec: AbsSpec) -> AbsSpec:
-    return spec
+# python tasks on tx.parallex.data and lets take less time than scheduling a task
+def is_cheap(spec: AbsSpec) -> bool:
+    if isinstance(spec, FusedSpec):
+        return all(map(is_cheap, spec.sub))
+    else:
+        return isinstance(spec, LetSpec) or (isinstance(spec, PythonSpec) and spec.mod == DATA_MODULE)
+
+
+def fused_tasks(spec: AbsSpec) -> List[AbsSpec]:
+    return spec.sub if isinstance(spec, FusedSpec) else [spec]
+
+
+# fuse a task into the only task in the same top that uses the names it binds. The fused task waits for the inputs of both tasks, so a task is fused only if the task that uses it has no other inputs from the same top, in which case no parallelism is lost, or if the task is cheap
+# :return: the number of tasks fused into another task
+def fuse_top(spec: TopSpec) -> int:
+    subs = sort_tasks(free_names(spec), spec.sub)
+    producers = {name: i for i, sub in enumerate(subs) for name in bound_names(sub)}
+    deps = [{producers[name] for name in free_names(sub) if name in producers} for sub in subs]
+    consumers : List[Set[int]] = [set() for _ in subs]
+    for j, dep in enumerate(deps):
+        for i in dep:
+            consumers[i].add(j)
+
+    fused = 0
+    for i, sub in enumerate(subs):
+        if len(consumers[i]) != 1 or not isinstance(sub, (PythonSpec, LetSpec, FusedSpec)):
+            continue
+        j = next(iter(consumers[i]))
+        if not isinstance(subs[j], (PythonSpec, LetSpec, RetSpec, FusedSpec)) or (len(deps[j]) > 1 and not is_cheap(sub)):
+            continue
+        subs[j] = FusedSpec(node_id=None, sub=fused_tasks(sub) + fused_tasks(subs[j]))
+        subs[i] = None
+        fused += 1
+        deps[j] = (deps[j] | deps[i]) - {i}
+        for k in deps[i]:
+            consumers[k] = (consumers[k] - {i}) | {j}
+
+    if fused > 0:
+        spec.sub = [sub for sub in subs if sub is not None]
+    return fused
+
+
+# :return: spec and the number of tasks fused into another task
+def combine_sequential_tasks(spec: AbsSpec) -> Tuple[AbsSpec, int]:
+    if isinstance(spec, MapSpec):
+        spec.sub, fused = combine_sequential_tasks(spec.sub)
+    elif isinstance(spec, CondSpec):
+        spec.then, fused_then = combine_sequential_tasks(spec.then)
+        spec._else, fused_else = combine_sequential_tasks(spec._else)
+        fused = fused_then + fused_else
+    elif isinstance(spec, TopSpec):
+        fused = 0
+        for sub in spec.sub:
+            fused += combine_sequential_tasks(sub)[1]
+        forget_names(spec)
+        fused += fuse_top(spec)
+    else:
+        fused = 0
+    return spec, fused
 
 
+def spec_weight(spec: AbsSpec) -> float:
+    if isinstance(spec, PythonSpec):
+        return spec.weight
+    elif isinstance(spec, SeqSpec):
+        return sum(map(spec_weight, spec.sub))
+    else:
+        return 0
+
+
+# the priority of the tasks generated from spec, tasks with higher priorities are run first
+def spec_priority(spec: AbsSpec) -> float:
+    return spec.__dict__.get(PRIORITY, 0)
+
+
+# set the priority of every spec in the dependency graph to the weight of the longest path from it to a ret, so that tasks on the critical path are run before tasks that other tasks do not wait for
+def assign_priorities(dg: Graph, spec: AbsSpec) -> None:
+    succs : Dict[str, List[str]] = {}
+    preds : Dict[str, int] = {}
+    for from_node, to_node, _ in dg.edges():
+        succs.setdefault(from_node, []).append(to_node)
+        preds[to_node] = preds.get(to_node, 0) + 1
+    specs : Dict[str, AbsSpec] = {}
+    def collect(spec: AbsSpec) -> None:
+        specs[spec.node_id] = spec
+        if isinstance(spec, MapSpec):
+            collect(spec.sub)
+        elif isinstance(spec, CondSpec):
+            collect(spec.then)
+            collect(spec._else)
+        elif isinstance(spec, TopSpec):
+            for sub in spec.sub:
+                collect(sub)
+    collect(spec)
+
+    # topological order
+    order = [node for node in dict.fromkeys(chain(specs.keys(), succs.keys())) if preds.get(node, 0) == 0]
+    i = 0
+    while i < len(order):
+        for succ in succs.get(order[i], []):
+            preds[succ] -= 1
+            if preds[succ] == 0:
+                order.append(succ)
+        i += 1
+
+    priorities : Dict[str, float] = {}
+    for node in reversed(order):
+        node_spec = specs.get(node)
+        priorities[node] = (0 if node_spec is None else spec_weight(node_spec)) + max((priorities[succ] for succ in succs.get(node, []) if succ in priorities), default=0)
+        if node_spec is not None:
+            node_spec.__dict__[PRIORITY] = priorities[node]
+
+
+# spec is not modified
 def preproc_tasks(inputs: Set[str], spec: AbsSpec) -> AbsSpec :
 
-    spec_original = deepcopy(spec)
+    spec = deepcopy(spec)
     dg, ret_ids = dependency_graph(inputs, spec)
     # logger.debug(f"remote_unreachable_tasks: dg.edges() = {dg.edges()} ret_ids = {ret_ids}")
     spec_simplified = remove_unreachable_tasks(dg, ret_ids, spec)
-    spec_simplified = propagate_constants(dg, ret_ids, spec)
-    spec_combined = combine_sequential_tasks(dg, ret_ids, spec_simplified)
+    spec_simplified, removed = propagate_constants(inputs, spec_simplified)
+    logger.info(format_message("preproc_tasks", "propagate_constants", {"removed": removed}))
+    spec_combined, fused = combine_sequential_tasks(spec_simplified)
+    logger.info(format_message("preproc_tasks", "combine_sequential_tasks", {"fused": fused}))
+    dg, _ = dependency_graph(inputs, spec_combined)
+    assign_priorities(dg, spec_combined)
     # logger.debug(f"remove_unreachable_tasks: \n***\n{spec}\n -> \n{spec_simplified}\n&&&")
     return spec_combined
 
 
-    
+# change this when preproc_tasks changes, so that specs compiled by a previous version are not loaded from disk
+SPEC_CACHE_VERSION = 6
+SPEC_CACHE_SECRET = ".secret"
+SPEC_CACHE_SECRET_SIZE = 32
+
+
+# raises an exception if path is not owned by the current user or if its mode has any bits of mask
+def check_private(path: str, mask: int = stat.S_IWGRP | stat.S_IWOTH) -> None:
+    st = os.stat(path)
+    if st.st_uid != os.getuid():
+        raise RuntimeError(f"{path} is not owned by the current user")
+    if st.st_mode & mask:
+        raise RuntimeError(f"{path} has mode {oct(stat.S_IMODE(st.st_mode))}")
+
+
+def canonical(x: Any) -> Any:
+    if is_dataclass(x) and not isinstance(x, type):
+        return (type(x).__name__, tuple((f.name, canonical(getattr(x, f.name))) for f in fields(x) if f.name != "node_id"))
+    elif isinstance(x, dict):
+        return ("dict", tuple(sorted((repr(k), canonical(v)) for k, v in x.items())))
+    elif isinstance(x, (list, tuple)):
+        return (type(x).__name__, tuple(map(canonical, x)))
+    elif isinstance(x, (set, frozenset)):
+        return ("set", tuple(sorted(map(repr, x))))
+    else:
+        return x
+
+
+# :return: a hash of spec and the names of inputs, which is all that preproc_tasks depends on
+def spec_key(inputs: Set[str], spec: AbsSpec) -> str:
+    return hashlib.sha256(pickle.dumps((SPEC_CACHE_VERSION, sorted(inputs), canonical(spec)), protocol=4)).hexdigest()
+
+
+class SpecCache:
+    """
+    Caches specs compiled by preproc_tasks, keyed by spec_key. Cached specs are shared and must not be modified.
+    Specs stored on disk are pickled, so each file starts with an HMAC of the key and the pickle under a secret key that is created in the directory and only readable by its owner. A file whose HMAC does not match is not unpickled. The directory is not used if it is not owned by the current user or if other users can write to it.
+    :attr max_size: the maximum number of specs kept in memory, the least recently used spec is evicted first
+    :attr path: if not None, a directory where compiled specs are also stored, one file per spec
+    :attr secret: the secret key of the directory
+    """
+    def __init__(self, path: Optional[str] = None, max_size: int = 256):
+        self.path = path
+        self.max_size = max_size
+        self.specs : OrderedDict[str, AbsSpec] = OrderedDict()
+        self.secret : Optional[bytes] = None
+        if path is not None:
+            try:
+                os.makedirs(path, mode=0o700, exist_ok=True)
+                check_private(path)
+                self.secret = self._secret()
+            except Exception as e:
+                logger.warning(format_message("SpecCache.__init__", "cannot use spec cache directory", {"path": path, "error": str(e)}))
+                self.path = None
+
+    def _secret(self) -> bytes:
+        secret_file = os.path.join(self.path, SPEC_CACHE_SECRET)
+        try:
+            fd = os.open(secret_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            check_private(secret_file, 0o077)
+            with open(secret_file, "rb") as f:
+                secret = f.read()
+            if len(secret) != SPEC_CACHE_SECRET_SIZE:
+                raise RuntimeError(f"invalid secret {secret_file}")
+            return secret
+        secret = os.urandom(SPEC_CACHE_SECRET_SIZE)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secret)
+        return secret
+
+    def preproc_tasks(self, inputs: Set[str], spec: AbsSpec) -> AbsSpec:
+        try:
+            key = spec_key(inputs, spec)
+        except Exception as e:
+            logger.info(format_message("SpecCache.preproc_tasks", "cannot hash spec, not cached", {"error": str(e)}))
+            return preproc_tasks(inputs, spec)
+
+        compiled = self.specs.get(key)
+        if compiled is not None:
+            self.specs.move_to_end(key)
+            return compiled
+
+        compiled = self._load(key)
+        if compiled is None:
+            compiled = preproc_tasks(inputs, spec)
+            self._store(key, compiled)
+        self.specs[key] = compiled
+        if len(self.specs) > self.max_size:
+            self.specs.popitem(last=False)
+        return compiled
+
+    def clear(self) -> None:
+        self.specs.clear()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.pickle")
+
+    def _digest(self, key: str, data: bytes) -> bytes:
+        return hmac.new(self.secret, key.encode() + data, hashlib.sha256).digest()
+
+    def _load(self, key: str) -> Optional[AbsSpec]:
+        if self.path is None or not os.path.isfile(self._file(key)):
+            return None
+        try:
+            with open(self._file(key), "rb") as f:
+                digest = f.read(hashlib.sha256().digest_size)
+                data = f.read()
+            if not hmac.compare_digest(digest, self._digest(key, data)):
+                raise RuntimeError("HMAC does not match")
+            return pickle.loads(data)
+        except Exception as e:
+            logger.info(format_message("SpecCache._load", "cannot load compiled spec", {"key": key, "error": str(e)}))
+            return None
+
+    def _store(self, key: str, spec: AbsSpec) -> None:
+        if self.path is None:
+            return
+        tmp = None
+        try:
+            data = pickle.dumps(spec, protocol=5)
+            fd, tmp = mkstemp(dir=self.path, prefix=f".{key}.")
+            with os.fdopen(fd, "wb") as f:
+                f.write(self._digest(key, data))
+                f.write(data)
+            # other processes may be storing the same spec
+            os.replace(tmp, self._file(key))
+        except Exception as e:
+            logger.info(format_message("SpecCache._store", "cannot store compiled spec", {"key": key, "error": str(e)}))
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+
+# the cache used by enqueue, compiled specs are also stored in the directory PARALLEX_SPEC_CACHE if it is set
+spec_cache = SpecCache(os.environ.get("PARALLEX_SPEC_CACHE"))
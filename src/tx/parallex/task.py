@@ -1,21 +1,28 @@
 from importlib import import_module
-from itertools import chain
+from itertools import chain, islice
 import logging
 import traceback
+import asyncio
+import inspect
+import threading
 from functools import partial
 import builtins
 from tx.functional.either import Left, Right, Either
 from tx.functional.maybe import Just, Nothing
 from .dependentqueue import DependentQueue, ResultType, ReturnType
 from .utils import mappend
-from .spec import AbsSpec, LetSpec, MapSpec, CondSpec, PythonSpec, SeqSpec, RetSpec, TopSpec, AbsValue, NameValue, DataValue, ret_prefix_to_str, free_names, bound_names, sort_tasks, preproc_tasks
+from .io import RecordWriter, RecordBuffer
+from .spec import AbsSpec, LetSpec, MapSpec, CondSpec, PythonSpec, SeqSpec, FusedSpec, RetSpec, TopSpec, AbsValue, NameValue, DataValue, ret_prefix_to_str, free_names, bound_names, sort_tasks, spec_priority, spec_cache
 from tx.readable_log import format_message, getLogger
-from typing import List, Any, Dict, Tuple, Set, Callable, TypeVar, ClassVar, Union, TextIO
-from dataclasses import dataclass
+from typing import List, Any, Dict, Tuple, Set, Callable, TypeVar, ClassVar, Union, Optional, Iterable, Iterator, Sequence, Coroutine
+from dataclasses import dataclass, field
 from abc import ABC, abstractmethod
-import jsonpickle
 import json
 import pickle
+try:
+    import numpy
+except ModuleNotFoundError as e:
+    numpy = None
 
 logger = getLogger(__name__, logging.INFO)
 
@@ -36,16 +43,97 @@ class IdentifiedTask(AbsTask):
     task_id: str
     
 
-def write_output(output, obj):
-    objjsonified = jsonpickle.encode(obj)
-    logger.debug(format_message("write_output", "jsonified object to", {"obj jsonified as": objjsonified}))
-    output.write(objjsonified + "\n")
+# resolved functions of this process, keyed by module and function name
+functions : Dict[Tuple[str, str], Callable] = {}
+
+
+def resolve_function(mod: str, func: str) -> Callable:
+    key = (mod, func)
+    f = functions.get(key)
+    if f is None:
+        f = functions[key] = getattr(import_module(mod) if mod != "" else builtins, func)
+    return f
+
+
+# modules may have been reloaded
+def clear_function_cache() -> None:
+    functions.clear()
+
+
+VECTORIZED = "parallex_vectorized"
+
+
+def vectorized(func: Callable) -> Callable:
+    """
+    Marks a function as vectorized. When the rows of a map are evaluated in chunks, the function is called once per chunk with numpy arrays of the values of its arguments for all rows, and returns an array of the results for all rows.
+    """
+    setattr(func, VECTORIZED, True)
+    return func
+
+
+class AsyncContext(threading.local):
+    """
+    :attr loop: in a thread of an asynchronous worker, the event loop of the worker
+    """
+    loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async_context = AsyncContext()
+
+
+def init_async_thread(loop: asyncio.AbstractEventLoop) -> None:
+    async_context.loop = loop
+
+
+# run a coroutine called by a task to completion, in a thread of an asynchronous worker it is run on the event loop of the worker so that it runs concurrently with coroutines of other tasks
+def run_coroutine(coro: Coroutine) -> Any:
+    loop = async_context.loop
+    if loop is None:
+        return asyncio.run(coro)
+    else:
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+# run a task in a thread of the default executor of the event loop, records are written to output in the thread of the event loop
+async def run_in_thread(run: Callable[[Dict[str, Any], Dict[str, Any], DependentQueue, RecordWriter], ResultType], results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: RecordWriter) -> ResultType:
+    buffer = RecordBuffer()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, run, results, subnode_results, queue, buffer)
+    finally:
+        output.write_records(buffer.records)
+
+
+def is_coroutine_function(mod: str, func: str) -> bool:
+    try:
+        return inspect.iscoroutinefunction(resolve_function(mod, func))
+    except Exception:
+        # the error is reported when the function is called
+        return False
+
+
+# :return: whether evaluating spec calls a coroutine function
+def calls_coroutine(spec: AbsSpec) -> bool:
+    if isinstance(spec, PythonSpec):
+        return is_coroutine_function(spec.mod, spec.func)
+    elif isinstance(spec, MapSpec):
+        return calls_coroutine(spec.sub)
+    elif isinstance(spec, CondSpec):
+        return calls_coroutine(spec.then) or calls_coroutine(spec._else)
+    elif isinstance(spec, (TopSpec, SeqSpec)):
+        return any(map(calls_coroutine, spec.sub))
+    else:
+        return False
+
+
+def write_output(output: RecordWriter, obj):
+    logger.debug(format_message("write_output", "write object", {"obj": obj}))
+    output.write_record(obj)
 
 @dataclass
 class BaseTask(IdentifiedTask):
     log_error: ClassVar[bool] = False
     
-    def run(self, results: ReturnType, subnode_results: ReturnType, queue: DependentQueue, output: TextIO) -> ResultType:
+    def run(self, results: ReturnType, subnode_results: ReturnType, queue: DependentQueue, output: RecordWriter) -> ResultType:
         logger.debug(format_message("BaseTask.run", "start", {"results": results}))
         try:
             return mbind(self.baseRun, results, subnode_results, queue, output, log_error=self.log_error)
@@ -58,9 +146,29 @@ class BaseTask(IdentifiedTask):
             
 
     @abstractmethod
-    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: TextIO) -> ResultType:
+    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: RecordWriter) -> ResultType:
         pass
 
+    # whether the task should be run with arun by an asynchronous worker
+    def is_async(self) -> bool:
+        return False
+
+    async def arun(self, results: ReturnType, subnode_results: ReturnType, queue: DependentQueue, output: RecordWriter) -> ResultType:
+        logger.debug(format_message("BaseTask.arun", "start", {"results": results}))
+        try:
+            resultj = mbind(self.abaseRun, results, subnode_results, queue, output, log_error=self.log_error)
+            # mbind returns a coroutine unless an input is an error
+            return await resultj if inspect.iscoroutine(resultj) else resultj
+        except Exception as e:
+            err = (str(e), traceback.format_exc())
+            logger.error(str(err))
+            write_output(output, {":error:": Right(err)})
+            queue.close()
+            raise
+
+    async def abaseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: RecordWriter) -> ResultType:
+        return await run_in_thread(self.baseRun, results, subnode_results, queue, output)
+
 
 @dataclass
 class Task(BaseTask):
@@ -71,17 +179,46 @@ class Task(BaseTask):
     kwargs_spec: Dict[str, str]
     args: Dict[int, Any]
     kwargs: Dict[str, Any]
+    # positions of positional arguments in call order
+    arg_order: List[int] = field(init=False)
+
+    def __post_init__(self):
+        self.arg_order = sorted(chain(self.args.keys(), self.args_spec.keys()))
+
+    def arguments(self, results: Dict[str, Any]) -> Tuple[List[Any], Dict[str, Any]]:
+        args = []
+        for i in self.arg_order:
+            if i in self.args:
+                args.append(self.args[i])
+            elif (name := self.args_spec[i]) in results:
+                args.append(results[name])
+        return args, substitute_dict(results, self.kwargs_spec)
+
+    def is_async(self) -> bool:
+        return is_coroutine_function(self.mod, self.func)
 
-    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: TextIO) -> ResultType:
+    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: RecordWriter) -> ResultType:
         try:
             logger.debug(format_message("Task.baseRun", "start", {"results": results}))
-            mod = import_module(self.mod) if self.mod != "" else builtins
-            func = getattr(mod, self.func)
-            args = substitute_dict(results, self.args_spec)
-            kwargs = substitute_dict(results, self.kwargs_spec)
-            self_arg_items = self.args.items()
-            arg_items = args.items()
-            result = func(*[v for _, v in sorted(chain(self_arg_items, arg_items), key=lambda x: x[0])], **self.kwargs, **kwargs)
+            func = resolve_function(self.mod, self.func)
+            args, kwargs = self.arguments(results)
+            result = func(*args, **self.kwargs, **kwargs)
+            if inspect.iscoroutine(result):
+                result = run_coroutine(result)
+            if not isinstance(result, Either):
+                result = Right(result)
+        except Exception as e:
+            err = (str(e), traceback.format_exc())
+            logger.error(str(err))
+            result = Left(err)
+        return Right({self.name: result})
+
+    async def abaseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: RecordWriter) -> ResultType:
+        try:
+            logger.debug(format_message("Task.abaseRun", "start", {"results": results}))
+            func = resolve_function(self.mod, self.func)
+            args, kwargs = self.arguments(results)
+            result = await func(*args, **self.kwargs, **kwargs)
             if not isinstance(result, Either):
                 result = Right(result)
         except Exception as e:
@@ -108,14 +245,15 @@ class DynamicMap(BaseTask):
     data: Dict[str, Any]
     ret_prefix: List[Any]
     level: int
+    chunk_size: int
     log_error: ClassVar[bool] = True
 
-    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: TextIO) -> ResultType:
+    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: RecordWriter) -> ResultType:
         hold_id = queue.put(Hold(), is_hold=True)
         logger.debug("DynamicMap.baseRun: put hold task on queue %s", hold_id)
         logger.debug(format_message("DynamicMap.baseRun", "enqueue call", {"results": results, "results[self.coll_name]": results[self.coll_name]}))
         enqueue(
-            MapSpec(node_id=None, var=self.var, coll=DataValue(data=results[self.coll_name]), sub=self.spec),
+            MapSpec(node_id=None, var=self.var, coll=DataValue(data=results[self.coll_name]), sub=self.spec, chunk_size=self.chunk_size),
             {**self.data, **either_data(subnode_results)},
             queue, 
             env={},
@@ -129,6 +267,42 @@ class DynamicMap(BaseTask):
         return Right({})
 
 
+@dataclass
+class MapRange(BaseTask):
+    """
+    Generates the tasks of a contiguous range of rows of a static map, so that a large map is expanded by workers in parallel with the execution of rows that have been expanded. Its inputs may be errors, which are passed to the rows as with Fused, so that each row has its own result as if the rows were generated by the coordinator.
+    :attr start: the index of the first row
+    """
+    var: str
+    spec: AbsSpec
+    data: Dict[str, Any]
+    rows: List[Any]
+    start: int
+    ret_prefix: List[Any]
+    level: int
+    chunk_size: int
+    log_error: ClassVar[bool] = True
+
+    # subnode results are passed to baseRun as they are
+    def run(self, results: ReturnType, subnode_results: ReturnType, queue: DependentQueue, output: RecordWriter) -> ResultType:
+        error = next((value for value in subnode_results.values() if isinstance(value, Left)), None)
+        if self.level == 0 and error is not None:
+            # Seq and MapChunk tasks that take an error as input each log it instead of evaluating their rows
+            for _ in enumerate_chunks(self.rows, self.start, self.chunk_size):
+                write_output(output, {":error:": Right(error.value)})
+            return Right({})
+        return super().run(results, {name: Right(value) for name, value in subnode_results.items()}, queue, output)
+
+    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: RecordWriter) -> ResultType:
+        hold_id = queue.put(Hold(), is_hold=True)
+        logger.debug("MapRange.baseRun: put hold task on queue %s", hold_id)
+        generate_map_rows(queue, self.spec, self.var, self.rows, self.start, {**self.data, **subnode_results}, {}, self.ret_prefix, {hold_id}, self.level, self.chunk_size)
+        queue.flush()
+        queue.complete(hold_id, Right({}))
+        logger.debug("MapRange.baseRun: remove hold task from queue %s", hold_id)
+        return Right({})
+
+
 @dataclass
 class DynamicGuard(BaseTask):
     cond_name: str
@@ -139,7 +313,7 @@ class DynamicGuard(BaseTask):
     level: int
     log_error: ClassVar[bool] = True
     
-    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: TextIO) -> ResultType:
+    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: RecordWriter) -> ResultType:
         hold_id = queue.put(Hold(), is_hold=True)
         logger.debug("DynamicCond.baseRun: put hold task on queue %s", hold_id)
         enqueue(
@@ -162,7 +336,7 @@ class DynamicLet(BaseTask):
     name: str
     obj_name: str
     
-    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: TextIO) -> ResultType:
+    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: RecordWriter) -> ResultType:
         return Right({self.name: results[self.obj_name]})
 
 
@@ -171,7 +345,7 @@ class Let(BaseTask):
     name: str
     obj: Either[Any, Any]
 
-    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: TextIO) -> ResultType:
+    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: RecordWriter) -> ResultType:
         return Right({self.name: self.obj})
 
     
@@ -180,7 +354,7 @@ class DynamicRet(IdentifiedTask):
     obj_name: str
     ret_prefix: List[Any]
     
-    def run(self, results: ReturnType, subnode_results: ReturnType, queue: DependentQueue, output: TextIO) -> ResultType:
+    def run(self, results: ReturnType, subnode_results: ReturnType, queue: DependentQueue, output: RecordWriter) -> ResultType:
         write_output(output, {ret_prefix_to_str(self.ret_prefix): results[self.obj_name]})
         return Right({})
 
@@ -190,7 +364,7 @@ class Ret(IdentifiedTask):
     obj: Either[Any, Any]
     ret_prefix: List[Any]
 
-    def run(self, results: ReturnType, subnode_results: ReturnType, queue: DependentQueue, output: TextIO) -> ResultType:
+    def run(self, results: ReturnType, subnode_results: ReturnType, queue: DependentQueue, output: RecordWriter) -> ResultType:
         write_output(output, {ret_prefix_to_str(self.ret_prefix): self.obj})
         return Right({})
 
@@ -203,9 +377,62 @@ class Seq(BaseTask):
     task_id: str
     log_error: ClassVar[bool] = True
 
-    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: TextIO) -> ResultType:
+    def is_async(self) -> bool:
+        return calls_coroutine(self.spec)
+
+    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: RecordWriter) -> ResultType:
         data = {**self.data, **{name: Right(value) for name, value in results.items()}}
-        return evaluate(self.spec, data, self.ret_prefix, output)
+        return evaluate(self.spec, data, self.ret_prefix, output, {})
+
+
+@dataclass
+class Fused(IdentifiedTask):
+    """
+    Evaluates a FusedSpec. Its inputs may be errors, which are passed to its tasks.
+    """
+    spec: AbsSpec
+    data: Dict[str, Any]
+    ret_prefix: List[Any]
+
+    def run(self, results: ReturnType, subnode_results: ReturnType, queue: DependentQueue, output: RecordWriter) -> ResultType:
+        return evaluate(self.spec, {**self.data, **results}, self.ret_prefix, output, {})
+
+    def is_async(self) -> bool:
+        return calls_coroutine(self.spec)
+
+    async def arun(self, results: ReturnType, subnode_results: ReturnType, queue: DependentQueue, output: RecordWriter) -> ResultType:
+        return await run_in_thread(self.run, results, subnode_results, queue, output)
+
+
+@dataclass
+class MapChunk(BaseTask):
+    """
+    Evaluates the subspec of a map for a contiguous chunk of rows, and writes their outputs in one batch.
+    :attr start: the index of the first row
+    """
+    var: str
+    spec: AbsSpec
+    data: Dict[str, Any]
+    rows: List[Any]
+    start: int
+    ret_prefix: List[Any]
+    log_error: ClassVar[bool] = True
+
+    def is_async(self) -> bool:
+        return calls_coroutine(self.spec)
+
+    def baseRun(self, results: Dict[str, Any], subnode_results: Dict[str, Any], queue: DependentQueue, output: RecordWriter) -> ResultType:
+        data = {**self.data, **{name: Right(value) for name, value in results.items()}}
+        calls : Dict[int, PythonCall] = {}
+        buffer = RecordBuffer()
+        if has_vectorized_call(self.spec, calls):
+            evaluate_chunk(self.spec, data, {self.var: Column.from_rows(self.rows)}, len(self.rows), self.start, self.ret_prefix, buffer, calls)
+        else:
+            for i, row in enumerate(self.rows, self.start):
+                # as with a Seq per row, the result of a row is not used
+                evaluate(self.spec, {**data, self.var: Right(row)}, self.ret_prefix + [i], buffer, calls)
+        output.write_records(buffer.records)
+        return Right({})
 
     
 @dataclass
@@ -229,12 +456,54 @@ def evaluate_value(data: ReturnType, arg: AbsValue) -> Either[Any, Any]:
         return Left(f"unsupported value {arg}")
 
 
-def evaluate(spec: AbsSpec, data: ReturnType, ret_prefix: List[Any], output: TextIO) -> ResultType:
+class PythonCall:
+    """
+    The function of a PythonSpec and the order of its arguments, resolved once and reused every time the spec is evaluated.
+    :attr values: the values of params
+    :attr positional: indices into values of positional arguments in call order
+    :attr keyword: keywords and indices into values of keyword arguments
+    :attr vectorized: whether the function is applied to arrays of values of rows of a map
+    """
+    def __init__(self, spec: PythonSpec):
+        self.func = resolve_function(spec.mod, spec.func)
+        keys = list(spec.params.keys())
+        self.values = list(spec.params.values())
+        self.positional = [i for _, i in sorted((k, i) for i, k in enumerate(keys) if isinstance(k, int))]
+        self.keyword = [(k, i) for i, k in enumerate(keys) if isinstance(k, str)]
+        self.vectorized = spec.vectorized or getattr(self.func, VECTORIZED, False)
+
+    # :param values: evaluated values of params
+    def apply(self, values: List[Either[Any, Any]]) -> Either[Any, Any]:
+        for x in values:
+            if isinstance(x, Left):
+                return x
+        try:
+            result = self.call([x.value for x in values])
+            if not isinstance(result, Either):
+                result = Right(result)
+        except Exception as e:
+            result = Left((str(e), traceback.format_exc()))
+        return result
+
+    def call(self, values: List[Any]) -> Any:
+        result = self.func(*[values[i] for i in self.positional], **{k: values[i] for k, i in self.keyword})
+        return run_coroutine(result) if inspect.iscoroutine(result) else result
+
+
+def python_call(spec: PythonSpec, calls: Optional[Dict[int, PythonCall]]) -> PythonCall:
+    call = calls.get(id(spec)) if calls is not None else None
+    if call is None:
+        call = PythonCall(spec)
+        if calls is not None:
+            calls[id(spec)] = call
+    return call
+
+
+# :param calls: resolved PythonCalls, keyed by the id of the PythonSpec. The caller keeps the spec alive while calls is in use
+def evaluate(spec: AbsSpec, data: ReturnType, ret_prefix: List[Any], output: RecordWriter, calls: Optional[Dict[int, PythonCall]] = None) -> ResultType:
     logger.debug(format_message("evaluate", "executing sequentially", {"spec": spec, "data": data, "ret_prefix": ret_prefix}))
     if isinstance(spec, LetSpec):
-        name = spec.name
-        obj = evaluate_value(data, spec.obj)
-        return obj.bind(lambda _: {name: obj})
+        return Right({spec.name: evaluate_value(data, spec.obj)})
     elif isinstance(spec, MapSpec):
         coll_value = spec.coll
         var = spec.var
@@ -246,7 +515,7 @@ def evaluate(spec: AbsSpec, data: ReturnType, ret_prefix: List[Any], output: Tex
         coll = coll.value
         for i, row in enumerate(coll):
             data2 = {**data, var:Right(row)}
-            sub_result = evaluate(subspec, data2, ret_prefix=ret_prefix + [i], output=output)
+            sub_result = evaluate(subspec, data2, ret_prefix=ret_prefix + [i], output=output, calls=calls)
             if isinstance(sub_result, Left):
                 return sub_result
         return Right({}) # ignore all sub_results
@@ -260,14 +529,14 @@ def evaluate(spec: AbsSpec, data: ReturnType, ret_prefix: List[Any], output: Tex
             return Right({})
         cond = cond.value
         if cond:
-            return evaluate(then_spec, data, ret_prefix=ret_prefix, output=output)
+            return evaluate(then_spec, data, ret_prefix=ret_prefix, output=output, calls=calls)
         else:
-            return evaluate(else_spec, data, ret_prefix=ret_prefix, output=output)
+            return evaluate(else_spec, data, ret_prefix=ret_prefix, output=output, calls=calls)
     elif isinstance(spec, TopSpec):
         subs = spec.sub
         subs_sorted = sort_tasks(set(data.keys()), subs)
         for sub in subs_sorted:
-            sub_result = evaluate(sub, data, ret_prefix=ret_prefix, output=output)
+            sub_result = evaluate(sub, data, ret_prefix=ret_prefix, output=output, calls=calls)
             if isinstance(sub_result, Left):
                 return sub_result
             data = {**data, **sub_result.value}
@@ -277,7 +546,7 @@ def evaluate(spec: AbsSpec, data: ReturnType, ret_prefix: List[Any], output: Tex
         subs_sorted = sort_tasks(set(data.keys()), subs)
         result : ResultType = {}
         for sub in subs_sorted:
-            sub_result = evaluate(sub, data, ret_prefix=ret_prefix, output=output)
+            sub_result = evaluate(sub, data, ret_prefix=ret_prefix, output=output, calls=calls)
             if isinstance(sub_result, Left):
                 return sub_result
             data = {**data, **sub_result.value}
@@ -285,22 +554,9 @@ def evaluate(spec: AbsSpec, data: ReturnType, ret_prefix: List[Any], output: Tex
         return Right(result)
     elif isinstance(spec, PythonSpec):
         try:
-            mod = import_module(spec.mod) if spec.mod != "" else builtins
-            func = getattr(mod, spec.func)
-            name = spec.name
+            call = python_call(spec, calls)
             logger.debug(format_message("evaluate", "PythonSpec", {"data": data}))
-            args0 = {k: evaluate_value(data, v) for k, v in spec.params.items()}
-            errors = [x for x in args0.values() if isinstance(x, Left)]
-            if len(errors) > 0:
-                return Right({name: errors[0]})
-            args2 = {k: v.value for k, v in args0.items()}
-            args, kwargs = split_args(args2)
-            logger.debug(format_message("evaluate", "PythonSpec before", {"spec.name": spec.name, "spec.mod": spec.mod, "func": lambda: func, "spec.func" : spec.func, "spec.params": spec.params, "args": args, "kwargs": kwargs}))
-            
-            result = func(*map(lambda x: x[1], sorted(args.items(), key=lambda x: x[0])), **kwargs)
-            logger.debug(format_message("evaluate", "PythonSpec after", {"spec.name": spec.name, "spec.mod": spec.mod, "func": lambda: func, "spec.func" : spec.func, "spec.params": spec.params, "args": args, "kwargs": kwargs, "result": result}))
-            if not isinstance(result, Either):
-                result = Right(result)
+            result = call.apply([evaluate_value(data, v) for v in call.values])
         except Exception as e:
             result = Left((str(e), traceback.format_exc()))
         logger.debug(format_message("evaluate", "PythonSpec", {"result": result}))
@@ -312,9 +568,115 @@ def evaluate(spec: AbsSpec, data: ReturnType, ret_prefix: List[Any], output: Tex
         return Right({})
     else:
         raise RuntimeError(f'unsupported spec type {spec}')
+
+
+class Column:
+    """
+    The values of a name for all rows of a chunk.
+    :attr values: the value of each row
+    :attr array: the values as a numpy array, if they are all Right
+    """
+    def __init__(self, values: List[Either[Any, Any]], array: Any = None):
+        self.values = values
+        self.array = array
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Any]) -> "Column":
+        return cls([Right(row) for row in rows], rows if is_array(rows) else None)
+
+    # :return: the values as a numpy array, or None if any of them is Left
+    def to_array(self) -> Any:
+        if self.array is None and all(isinstance(x, Right) for x in self.values):
+            self.array = numpy.asarray([x.value for x in self.values])
+        return self.array
+
+
+# :return: True if spec is made of python, let, and ret specs only, in which case it can be evaluated for a chunk of rows one spec at a time
+def columnar(spec: AbsSpec) -> bool:
+    if isinstance(spec, (TopSpec, SeqSpec)):
+        return all(columnar(sub) for sub in spec.sub)
+    else:
+        return isinstance(spec, (PythonSpec, LetSpec, RetSpec))
+
+
+def has_vectorized_call(spec: AbsSpec, calls: Dict[int, PythonCall]) -> bool:
+    if numpy is None or not columnar(spec):
+        return False
+    elif isinstance(spec, (TopSpec, SeqSpec)):
+        return any(has_vectorized_call(sub, calls) for sub in spec.sub)
+    elif isinstance(spec, PythonSpec):
+        try:
+            return python_call(spec, calls).vectorized
+        except Exception:
+            # the error is reported when the spec is evaluated
+            return False
+    else:
+        return False
+
+
+# :return: a column if arg refers to a column, otherwise the value shared by all rows
+def evaluate_column(data: ReturnType, columns: Dict[str, Column], arg: AbsValue) -> Union[Column, Either[Any, Any]]:
+    if isinstance(arg, NameValue) and arg.name in columns:
+        return columns[arg.name]
+    else:
+        return evaluate_value(data, arg)
+
+
+def row_value(value: Union[Column, Either[Any, Any]], i: int) -> Either[Any, Any]:
+    return value.values[i] if isinstance(value, Column) else value
+
+
+# vectorized functions are called once for all rows, other functions and rows whose arguments include a Left fall back to one call per row
+def call_chunk(call: PythonCall, args: List[Union[Column, Either[Any, Any]]], n: int) -> Column:
+    if call.vectorized:
+        values = []
+        for arg in args:
+            value = arg.to_array() if isinstance(arg, Column) else (arg.value if isinstance(arg, Right) else None)
+            if value is None:
+                break
+            values.append(value)
+        else:
+            try:
+                result = call.call(values)
+                if len(result) == n:
+                    return Column([Right(x) for x in (result.tolist() if isinstance(result, numpy.ndarray) else result)], result if isinstance(result, numpy.ndarray) else None)
+                logger.info(format_message("call_chunk", "vectorized function returned a wrong number of results, calling it per row", {"expected": n, "actual": len(result)}))
+            except Exception as e:
+                logger.info(format_message("call_chunk", "vectorized function failed, calling it per row", {"error": str(e)}))
+    return Column([call.apply([row_value(arg, i) for arg in args]) for i in range(n)])
+
+
+# evaluates spec for n rows, names that differ between rows are in columns, names that are shared by all rows are in data
+# :param start: the index of the first row
+# :return: columns of names bound by spec
+def evaluate_chunk(spec: AbsSpec, data: ReturnType, columns: Dict[str, Column], n: int, start: int, ret_prefix: List[Any], output: RecordWriter, calls: Dict[int, PythonCall]) -> Dict[str, Column]:
+    if isinstance(spec, (TopSpec, SeqSpec)):
+        result : Dict[str, Column] = {}
+        for sub in sort_tasks(set(data.keys()) | set(columns.keys()), spec.sub):
+            sub_result = evaluate_chunk(sub, data, columns, n, start, ret_prefix, output, calls)
+            columns = {**columns, **sub_result}
+            result.update(sub_result)
+        return result if isinstance(spec, SeqSpec) else {}
+    elif isinstance(spec, LetSpec):
+        obj = evaluate_column(data, columns, spec.obj)
+        return {spec.name: obj if isinstance(obj, Column) else Column([obj] * n)}
+    elif isinstance(spec, PythonSpec):
+        try:
+            call = python_call(spec, calls)
+            result = call_chunk(call, [evaluate_column(data, columns, v) for v in call.values], n)
+        except Exception as e:
+            result = Column([Left((str(e), traceback.format_exc()))] * n)
+        return {spec.name: result}
+    elif isinstance(spec, RetSpec):
+        obj = evaluate_column(data, columns, spec.obj)
+        for i in range(n):
+            write_output(output, {ret_prefix_to_str(ret_prefix + [start + i]): row_value(obj, i)})
+        return {}
+    else:
+        raise RuntimeError(f'unsupported spec type {spec}')
     
     
-def mbind(job_run : Callable[[Dict[str, Any], Dict[str, Any], DependentQueue, TextIO], ResultType], params: ReturnType, subnode_results: ReturnType, queue: DependentQueue, output: TextIO, log_error: bool) -> ResultType:
+def mbind(job_run : Callable[[Dict[str, Any], Dict[str, Any], DependentQueue, RecordWriter], ResultType], params: ReturnType, subnode_results: ReturnType, queue: DependentQueue, output: RecordWriter, log_error: bool) -> ResultType:
     resultv = {}
     subnode_resultv = {}
     for k, v in params.items():
@@ -368,6 +730,62 @@ def inverse_dict(env: Dict[S, T]) -> Dict[T, Set[S]]:
     return dep
 
     
+# maps with more rows than this are expanded by MapRange tasks
+MAP_RANGE_SIZE = 256
+
+
+def is_array(rows: Any) -> bool:
+    return numpy is not None and isinstance(rows, numpy.ndarray)
+
+
+# numpy arrays are sliced so that chunks are arrays
+# :return: a generator of the index of the first row and the rows of each chunk
+def enumerate_chunks(rows: Iterable[Any], start: int, chunk_size: int) -> Iterator[Tuple[int, Sequence[Any]]]:
+    if is_array(rows):
+        for i in range(0, len(rows), chunk_size):
+            yield start + i, rows[i:i + chunk_size]
+    else:
+        rows_iter = iter(rows)
+        i = start
+        while len(chunk := list(islice(rows_iter, chunk_size))) > 0:
+            yield i, chunk
+            i += len(chunk)
+
+
+# :param data: data of the map, only free names of subspec are used
+# :param start: the index of the first row
+# :param chunk_size: if level is 0, the number of rows evaluated by one task
+def generate_map_rows(queue: DependentQueue, subspec: AbsSpec, var: str, rows: Iterable[Any], start: int, data: ReturnType, env: Dict[str, str], ret_prefix: List[Any], hold: Set[str], level: int, chunk_size: int = 1) -> None:
+    hold_dep : Dict[str, Set[str]] = {name: set() for name in hold}
+    subnode_ret_prefix = ret_prefix + ["@map"]
+    free_names_sub_with_possibly_var = free_names(subspec)
+    var_in_sub = var in free_names_sub_with_possibly_var
+    free_names_sub = free_names_sub_with_possibly_var - {var}
+    subnode_env = get_submap(env, free_names_sub)
+    subnode_data = get_submap(data, free_names_sub)
+    if level == 0 and chunk_size > 1:
+        for i, chunk in enumerate_chunks(rows, start, chunk_size):
+            task = MapChunk(ret_prefix_to_str(subnode_ret_prefix + [f"@chunk{i}"], False), var, subspec, subnode_data, chunk, i, subnode_ret_prefix)
+            logger.info(format_message("generate_tasks", "generating MapChunk task", {
+                "id": task.task_id,
+                "rows": len(chunk)
+            }))
+            enqueue_task(queue, task, {**inverse_dict(subnode_env), **hold_dep}, {}, set(), spec_priority(subspec))
+        return
+    for i, row in enumerate(rows, start):
+        subnode_data_with_possibly_var = {**subnode_data, **({var: Right(row)} if var_in_sub else {})}
+        subnode_ret_prefix_i = subnode_ret_prefix + [i]
+        if level > 0:
+            generate_tasks(queue, subspec, data=subnode_data_with_possibly_var, env=env, ret_prefix=subnode_ret_prefix_i, hold=hold, level=level-1)
+        else:
+            task = Seq(ret_prefix_to_str(subnode_ret_prefix_i, False), subspec, subnode_data_with_possibly_var, subnode_ret_prefix_i)
+            logger.info(format_message("generate_tasks", "generating Seq task", {
+                "id": ret_prefix_to_str(subnode_ret_prefix_i, False),
+                "data": lambda: dict_size(subnode_data)
+            }))
+            enqueue_task(queue, task, {**inverse_dict(subnode_env), **hold_dep}, {}, set(), spec_priority(subspec))
+
+
 def generate_tasks(queue: DependentQueue, spec: AbsSpec, data: ReturnType, env: Dict[str, str], ret_prefix: List[Any], hold: Set[str], level: int) -> None:
     logger.debug(format_message("generate_tasks", "start", {"spec": spec, "env": env}))
 
@@ -378,16 +796,14 @@ def generate_tasks(queue: DependentQueue, spec: AbsSpec, data: ReturnType, env:
         var = spec.var
         subspec = spec.sub
         subnode_ret_prefix = ret_prefix + ["@map"]
-        free_names_sub_with_possibly_var = free_names(subspec)
-        var_in_sub = var in free_names_sub_with_possibly_var
-        free_names_sub = free_names_sub_with_possibly_var - {var}
+        free_names_sub = free_names(subspec) - {var}
         subnode_env = get_submap(env, free_names_sub)
         subnode_data = get_submap(data, free_names_sub)
         if isinstance(coll_value, NameValue) and (coll_name := coll_value.name) not in data:
             coll_source = env[coll_name]
-            task: IdentifiedTask = DynamicMap(ret_prefix_to_str(subnode_ret_prefix, False), var, coll_name, subspec, subnode_data, ret_prefix, level)
+            task: IdentifiedTask = DynamicMap(ret_prefix_to_str(subnode_ret_prefix, False), var, coll_name, subspec, subnode_data, ret_prefix, level, spec.chunk_size)
             dep = {coll_source: {coll_name}}
-            enqueue_task(queue, task, {**dep, **hold_dep}, inverse_dict(subnode_env), set())
+            enqueue_task(queue, task, {**dep, **hold_dep}, inverse_dict(subnode_env), set(), spec_priority(subspec))
         else:
             coll = evaluate_value(data, coll_value)
 
@@ -396,18 +812,16 @@ def generate_tasks(queue: DependentQueue, spec: AbsSpec, data: ReturnType, env:
 
             logger.debug(format_message("generate_tasks", "evaluate_value call ret val", {"data": data, "coll_value": coll_value, "coll": coll}))
             
-            for i, row in enumerate(coll.value):
-                subnode_data_with_possibly_var = {**subnode_data, **({var: Right(row)} if var_in_sub else {})}
-                subnode_ret_prefix_i = subnode_ret_prefix + [i]
-                if level > 0:
-                    generate_tasks(queue, subspec, data=subnode_data_with_possibly_var, env=env, ret_prefix=subnode_ret_prefix_i, hold=hold, level=level-1)
-                else:
-                    task = Seq(ret_prefix_to_str(subnode_ret_prefix_i, False), subspec, subnode_data_with_possibly_var, subnode_ret_prefix_i)
-                    logger.info(format_message("generate_tasks", "generating Seq task", {
-                        "id": ret_prefix_to_str(subnode_ret_prefix_i, False),
-                        "data": lambda: dict_size(subnode_data)
-                    }))
-                    enqueue_task(queue, task, {**inverse_dict(subnode_env), **hold_dep}, {}, set())
+            rows = coll.value
+            # a range is a multiple of chunks
+            range_size = max(1, MAP_RANGE_SIZE // spec.chunk_size) * spec.chunk_size
+            if (isinstance(rows, Sequence) or is_array(rows)) and len(rows) > range_size:
+                # rows are expanded by MapRange tasks, which get free names of the subspec as data
+                for start in range(0, len(rows), range_size):
+                    task = MapRange(ret_prefix_to_str(subnode_ret_prefix + [f"@range{start}"], False), var, subspec, subnode_data, rows[start:start + range_size], start, ret_prefix, level, spec.chunk_size)
+                    enqueue_task(queue, task, hold_dep, inverse_dict(subnode_env), set(), spec_priority(subspec))
+            else:
+                generate_map_rows(queue, subspec, var, rows, 0, subnode_data, env, ret_prefix, hold, level, spec.chunk_size)
 
     elif isinstance(spec, CondSpec):
         cond_value = spec.on
@@ -421,7 +835,7 @@ def generate_tasks(queue: DependentQueue, spec: AbsSpec, data: ReturnType, env:
             subnode_data = get_submap(data, free_names_sub)
             task = DynamicGuard(ret_prefix_to_str(subnode_ret_prefix, False), cond_name, then_spec, else_spec, subnode_data, ret_prefix, level)
             dep = {cond_source: {cond_name}}
-            enqueue_task(queue, task, {**dep, **hold_dep}, inverse_dict(subnode_env), set())
+            enqueue_task(queue, task, {**dep, **hold_dep}, inverse_dict(subnode_env), set(), spec_priority(spec))
         else:
             cond = evaluate_value(data, cond_value)
 
@@ -450,12 +864,15 @@ def generate_tasks(queue: DependentQueue, spec: AbsSpec, data: ReturnType, env:
         env_sub = get_submap(env, free_names_sub)
         data_sub = get_submap(data, free_names_sub)
         ret_prefix_sub = ret_prefix + ["@seq"]
-        task = Seq(ret_prefix_to_str(ret_prefix, False), spec, data_sub, ret_prefix=ret_prefix_sub)
+        if isinstance(spec, FusedSpec):
+            task = Fused(ret_prefix_to_str(ret_prefix, False), spec, data_sub, ret_prefix_sub)
+        else:
+            task = Seq(ret_prefix_to_str(ret_prefix, False), spec, data_sub, ret_prefix=ret_prefix_sub)
         logger.info(format_message("generate_tasks", "generating Seq task", {
             "id": ret_prefix_to_str(ret_prefix, False),
             "data": lambda: dict_size(data_sub)
         }))
-        enqueue_task(queue, task, {**inverse_dict(env_sub), **hold_dep}, {}, bound_names_sub)
+        enqueue_task(queue, task, {**inverse_dict(env_sub), **hold_dep}, {}, bound_names_sub, spec_priority(spec))
     elif isinstance(spec, LetSpec):
         name = spec.name
         obj_value = spec.obj
@@ -463,11 +880,11 @@ def generate_tasks(queue: DependentQueue, spec: AbsSpec, data: ReturnType, env:
             obj_source = env[obj_name]
             task = DynamicLet(env[name], name, obj_name)
             dep = {obj_source: {obj_name}}
-            enqueue_task(queue, task, {**dep, **hold_dep}, {}, set())
+            enqueue_task(queue, task, {**dep, **hold_dep}, {}, {name}, spec_priority(spec))
         else:
             obj = evaluate_value(data, obj_value)
             task = Let(env[name], name, obj)
-            enqueue_task(queue, task, {}, {}, {name})
+            enqueue_task(queue, task, {}, {}, {name}, spec_priority(spec))
     elif isinstance(spec, PythonSpec):
         name = spec.name
         mod = spec.mod
@@ -486,7 +903,7 @@ def generate_tasks(queue: DependentQueue, spec: AbsSpec, data: ReturnType, env:
         free_names_sub = free_names(spec)
         env_sub = get_submap(env, free_names_sub)
         task = Task(env[name], name, mod, func, args_spec, kwargs_spec, args, kwargs)
-        enqueue_task(queue, task, {**inverse_dict(env_sub), **hold_dep}, {}, {name})
+        enqueue_task(queue, task, {**inverse_dict(env_sub), **hold_dep}, {}, {name}, spec_priority(spec))
         logger.debug(format_message("generate_tasks", "enqueue task", {"task": lambda: vars(task), "env[name]": lambda: env[name]})) 
     elif isinstance(spec, RetSpec):
         obj_value = spec.obj
@@ -495,25 +912,27 @@ def generate_tasks(queue: DependentQueue, spec: AbsSpec, data: ReturnType, env:
             obj_source = env[obj_name]
             task = DynamicRet(ret_prefix_to_str(subnode_ret_prefix, False), obj_name, subnode_ret_prefix)
             dep = {obj_source:{obj_name}}
-            enqueue_task(queue, task, {**dep, **hold_dep}, {}, set())
+            enqueue_task(queue, task, {**dep, **hold_dep}, {}, set(), spec_priority(spec))
         else:
             obj = evaluate_value(data, obj_value)
             task = Ret(ret_prefix_to_str(subnode_ret_prefix, False), obj, subnode_ret_prefix)
-            enqueue_task(queue, task, hold_dep, {}, set())
+            enqueue_task(queue, task, hold_dep, {}, set(), spec_priority(spec))
     else:
         raise RuntimeError(f'unsupported spec type {spec}')
 
 
-def enqueue_task(job_queue: DependentQueue, job: IdentifiedTask, depends_on: Dict[str, Set[str]], subnode_depends_on: Dict[str, Set[str]], names: Set[str]) -> None:
+# :param priority: ready tasks with higher priorities are run first
+def enqueue_task(job_queue: DependentQueue, job: IdentifiedTask, depends_on: Dict[str, Set[str]], subnode_depends_on: Dict[str, Set[str]], names: Set[str], priority: float = 0) -> None:
     
     logger.debug(format_message("enqueue_task", "start", {"input": job, "depends_on": depends_on, "subnode_depends_on": subnode_depends_on}))
     job_id = job.task_id
-    logger.debug(format_message("enqueue_task", job_id, {"depends_on": depends_on, "subnode_depends_on": subnode_depends_on}))
-    job_queue.put(job, job_id=job_id, depends_on=depends_on, subnode_depends_on=subnode_depends_on, names=names)
+    logger.debug(format_message("enqueue_task", job_id, {"depends_on": depends_on, "subnode_depends_on": subnode_depends_on, "priority": priority}))
+    job_queue.put(job, job_id=job_id, depends_on=depends_on, subnode_depends_on=subnode_depends_on, names=names, priority=priority)
 
     
 def enqueue(spec: AbsSpec, data: ReturnType, job_queue: DependentQueue, env: Dict[str, str]={}, ret_prefix: List[Any]=[], execute_original: bool=False, hold: Set[str]=set(), level:int=0) -> None:
-    generate_tasks(job_queue, spec if execute_original else preproc_tasks(set(data.keys()), spec), data=data, env=env, ret_prefix=ret_prefix, hold=hold, level=level)
+    generate_tasks(job_queue, spec if execute_original else spec_cache.preproc_tasks(set(data.keys()), spec), data=data, env=env, ret_prefix=ret_prefix, hold=hold, level=level)
+    job_queue.flush()
 
     
 
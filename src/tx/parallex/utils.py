@@ -15,8 +15,6 @@ def inverse_function(func):
 
 
 def mappend(a, b):
-    ac = str(a)
-    bc = str(b)
     if isinstance(a, Right) and isinstance(b, Right):
         ret = Right(mappend(a.value, b.value))
     elif isinstance(a, Left):
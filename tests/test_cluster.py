@@ -0,0 +1,100 @@
+import os
+import socket
+from multiprocessing import Process
+import pytest
+from tx.functional.either import Right
+from tx.parallex import start_python, start_python_iter, DistributedBackend, work_as_daemon
+from tx.parallex.cluster import Coordinator
+
+AUTHKEY = b"tx-parallex-test"
+
+
+def add(a, b):
+    return a + b
+
+
+# the daemon that runs this task first exits without finishing it
+def crash_once(a, path):
+    if not os.path.exists(path):
+        open(path, "w").close()
+        os._exit(1)
+    return a
+
+
+def free_address():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()
+
+
+@pytest.fixture
+def daemons():
+    address = free_address()
+    processes = [Process(target=work_as_daemon, args=(address, AUTHKEY), kwargs={"heartbeat_interval": 0.2, "retry_interval": 0.2}) for _ in range(2)]
+    for p in processes:
+        p.start()
+    try:
+        yield address, processes
+    finally:
+        for p in processes:
+            p.terminate()
+            p.join()
+
+
+def test_coordinator_expire():
+    coordinator = Coordinator()
+    slot_id = coordinator.offer(b"payload")
+    assert coordinator.take("d1", 0) == (slot_id, b"payload")
+    coordinator.heartbeat(slot_id, "d1", "w1")
+    assert coordinator.take("d2", 0) is None
+    assert coordinator.expire(-1) == ["w1"]
+    # the slot is offered again, the lost daemon can no longer finish it
+    assert coordinator.take("d2", 0) == (slot_id, b"payload")
+    coordinator.finish(slot_id, "d1")
+    assert not coordinator.wait(slot_id, 0)
+    coordinator.finish(slot_id, "d2")
+    assert coordinator.wait(slot_id, 0)
+
+
+def test_distributed_start(daemons):
+    address, _ = daemons
+
+    py = """
+from tests.test_cluster import add
+for i in inputs:
+    b = add(i, 1)
+    c = add(b, b)
+    return c
+"""
+
+    data = {
+        "inputs": list(range(10))
+    }
+
+    # daemons serve one run after another
+    for _ in range(2):
+        ret = start_python(3, py, data, [], True, None, 0, None, executor=DistributedBackend(address, AUTHKEY))
+        assert ret == {f"{i}": Right(2 * (i + 1)) for i in range(10)}
+
+    records = start_python_iter(2, py, data, [], True, 0, None, executor=DistributedBackend(address, AUTHKEY))
+    assert sorted(v.value for _, v in records) == [2 * (i + 1) for i in range(10)]
+
+
+def test_distributed_worker_loss(daemons, tmp_path):
+    address, processes = daemons
+
+    py = f"""
+from tests.test_cluster import add, crash_once
+for i in inputs:
+    b = crash_once(i, "{tmp_path}/crashed")
+    c = add(b, 1)
+    return c
+"""
+
+    data = {
+        "inputs": list(range(4))
+    }
+
+    ret = start_python(2, py, data, [], True, None, 0, None, executor=DistributedBackend(address, AUTHKEY, heartbeat_timeout=1))
+    assert ret == {f"{i}": Right(i + 1) for i in range(4)}
+    assert sum(p.is_alive() for p in processes) == 1
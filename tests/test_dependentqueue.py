@@ -7,6 +7,8 @@ import pytest
 from tx.functional.either import Left, Right
 from tx.functional.maybe import Just
 from tx.parallex.dependentqueue import DependentQueue, Node
+from tx.parallex.scheduler import Scheduler, SchedulerManager
+from tx.parallex.objectstore import SharedMemoryStore
 from tx.readable_log import getLogger
 from .test_utils import object_store, manager
 
@@ -112,6 +114,115 @@ def test_eoq_2(manager, object_store):
         n, r, sr, f = dq.get(block=True)
         assert n == 2
 
+def test_scheduler_dep(object_store):
+    with SchedulerManager() as manager:
+        dq = DependentQueue(manager, None, object_store, manager.Scheduler(None))
+        dq.init_thread()
+
+        id3 = dq.put(3, names={"a"})
+        id2 = dq.put(2, depends_on={id3: {"a"}}, names={"b"})
+        id1 = dq.put(1, depends_on={id3: {"a"}, id2: {"b"}})
+        
+        n, r, sr, f1 = dq.get(block=True)
+        assert n == 3
+        assert r == {}
+        dq.complete(f1, Right({"a": 6}))
+        n, r, sr, f2 = dq.get(block=True)
+        assert n == 2
+        assert r == {"a": 6}
+        dq.complete(f2, Right({"b": 5}))
+        n, r, sr, f = dq.get(block=True)
+        assert n == 1
+        assert r == {"b": 5, "a": 6}
+        dq.complete(f, Right({"c": 4}))
+        n, r, sr, f = dq.get(block=True)
+        assert n is None
+
+def test_scheduler_dep_error(manager, object_store):
+        dq = DependentQueue(manager, None, object_store, Scheduler(None))
+        dq.init_thread()
+
+        id3 = dq.put(3, names={"a"})
+        id2 = dq.put(2, depends_on={id3: {"a"}}, names={"b"})
+        id1 = dq.put(1, depends_on={id3: {"a"}, id2: {"b"}})
+        
+        n, r, sr, f1 = dq.get(block=True)
+        assert n == 3
+        dq.complete(f1, Left("a"))
+        n, r, sr, f2 = dq.get(block=True)
+        assert n == 2
+        assert r == {"a": Left("a")}
+
+def test_scheduler_ref_count(manager, object_store):
+        scheduler = Scheduler(None)
+        dq = DependentQueue(manager, None, object_store, scheduler)
+        dq.init_thread()
+
+        id3 = dq.put(3, names={"a"})
+        id2 = dq.put(2, depends_on={id3: {"a"}})
+        id1 = dq.put(1, depends_on={id3: {"a"}})
+        
+        n, r, sr, f1 = dq.get(block=True)
+        dq.complete(f1, Right({"a": 6}))
+        assert scheduler.ref_counts == {f"{id3}/a": 2}
+        n, r, sr, f2 = dq.get(block=True)
+        dq.complete(f2, Right({}))
+        assert scheduler.ref_counts == {f"{id3}/a": 1}
+        n, r, sr, f = dq.get(block=True)
+        assert r == {"a": 6}
+        dq.complete(f, Right({}))
+        assert scheduler.ref_counts == {}
+        with pytest.raises(Exception):
+            object_store.get(f"{id3}/a")
+
+def test_scheduler_eoq(object_store):
+    with SchedulerManager() as manager:
+        dq = DependentQueue(manager, 2, object_store, manager.Scheduler(2))
+        dq.init_thread()
+
+        def dq_get(v):
+            v.value, _, _, _ = dq.get()
+
+        id3 = dq.put(2)
+        n, _, _, f1 = dq.get(block=True)
+
+        v = manager.Value(c_int, 1)
+        p = Process(target=dq_get, args=(v,))
+        p.start()
+        time.sleep(1)
+        
+        dq.complete(f1, Just({"a":6}))
+        p.join()
+        assert v.value == 2
+
+def test_scheduler_empty(manager, object_store):
+        dq = DependentQueue(manager, None, object_store, Scheduler(None))
+        dq.init_thread()
+        dq.put(1, is_hold=True)
+        with pytest.raises(Empty):
+            dq.get(block=False)
+        with pytest.raises(Empty):
+            dq.get(block=True, timeout=0.1)
+
+@pytest.mark.parametrize("use_scheduler", [False, True])
+def test_batch(manager, object_store, use_scheduler):
+        dq = DependentQueue(manager, None, object_store, Scheduler(None) if use_scheduler else None)
+        dq.init_thread()
+
+        id3 = dq.put(3, names={"a"})
+        id2 = dq.put(2, names={"b"})
+        id1 = dq.put(1, depends_on={id3: {"a"}, id2: {"b"}})
+        
+        batch = dq.get_batch(5, block=True)
+        assert sorted(n for n, _, _, _ in batch) == [2, 3]
+        dq.complete_batch([(f, Right({"a": 6, "b": 5})) for _, _, _, f in batch])
+        [(n, r, sr, f)] = dq.get_batch(5, block=True)
+        assert n == 1
+        assert r == {"b": 5, "a": 6}
+        dq.complete_batch([(f, Right({}))])
+        [(n, r, sr, f)] = dq.get_batch(5, block=True)
+        assert n is None
+
 # def test_eoq_3():
 #     
 #         dq = DependentQueue(True)
@@ -125,3 +236,161 @@ def test_eoq_2(manager, object_store):
 
 
     
+
+
+def test_scheduler_cancel(manager, object_store):
+        scheduler = Scheduler(None, "run:")
+        dq = DependentQueue(manager, None, object_store, scheduler, "run:")
+        dq.init_thread()
+        id1 = dq.put(1, names={"a"})
+        id3 = dq.put(3, names={"b"})
+        # 2 depends on more than one node, so that the result of 1 is stored
+        dq.put(2, depends_on={id1: {"a"}, id3: {"b"}})
+        _, _, _, f1 = dq.get(block=False)
+        scheduler.cancel()
+        dq.complete(f1, Right({"a": 1}))
+        n, _, _, _ = dq.get(block=False)
+        assert n is None
+        oids = scheduler.clear()
+        assert oids == [f"run:{id1}/a"]
+        for oid in oids:
+            object_store.delete(oid)
+
+
+def test_scheduler_local(manager, object_store):
+        scheduler = Scheduler(None)
+        dq = DependentQueue(manager, None, object_store, scheduler)
+        dq.init_thread()
+        other = DependentQueue(manager, None, object_store, scheduler)
+        other.init_thread()
+
+        id1 = dq.put(1, names={"a"})
+        id2 = dq.put(2, depends_on={id1: {"a"}}, names={"b"})
+        id3 = dq.put(3, depends_on={id1: {"a"}}, names={"c"})
+        id4 = dq.put(4, depends_on={id2: {"b"}, id3: {"c"}})
+        dq.flush()
+
+        # every node that depends on 1 depends on nothing else
+        n, r, sr, f1 = dq.get(block=False)
+        assert n == 1
+        dq.complete(f1, Right({"a": 6}))
+        with pytest.raises(Exception):
+            object_store.get(f"{id1}/a")
+        # nodes that depend on 1 are pinned to the worker that ran 1
+        with pytest.raises(Empty):
+            other.get(block=False)
+        assert sorted([dq.get(block=False)[0], dq.get(block=False)[0]]) == [2, 3]
+        dq.complete(id2, Right({"b": 5}))
+        dq.complete(id3, Right({"c": 4}))
+        assert object_store.get(f"{id2}/b") == 5
+        # 4 depends on 2 and 3 which were run by the same worker, another worker can steal it
+        n, r, sr, f4 = other.get(block=False)
+        assert n == 4
+        assert r == {"b": 5, "c": 4}
+
+
+def test_scheduler_local_holds_inputs(manager):
+        np = pytest.importorskip("numpy")
+        object_store = SharedMemoryStore(manager, 1 << 20, arena_size=1 << 16)
+        object_store.init()
+        try:
+            scheduler = Scheduler(None)
+            dq = DependentQueue(manager, None, object_store, scheduler)
+            dq.init_thread()
+
+            id0 = dq.put(0, names={"a"})
+            idm = dq.put("m", names={"m"})
+            id1 = dq.put(1, depends_on={id0: {"a"}, idm: {"m"}}, names={"b"})
+            id2 = dq.put(2, depends_on={id1: {"b"}}, names={"c"})
+            dq.put(3, depends_on={id2: {"c"}})
+            dq.flush()
+
+            a = np.arange(1000)
+            for _ in range(2):
+                n, r, sr, f = dq.get(block=False)
+                dq.complete(f, Right({"a": a} if n == 0 else {"m": 1}))
+            # 1 and 2 return views of a, which is read in place from the store
+            n, r, sr, f1 = dq.get(block=False)
+            assert n == 1
+            dq.complete(f1, Right({"b": r["a"]}))
+            n, r, sr, f2 = dq.get(block=False)
+            assert n == 2
+            dq.complete(f2, Right({"c": r["b"][:]}))
+            # a is held while local results may reference it, its block is not reused
+            for i in range(16):
+                object_store.put(f"x{i}", bytearray(b"\xff" * 8000))
+            n, r, sr, f3 = dq.get(block=False)
+            assert n == 3
+            assert (r["c"] == a).all()
+            dq.complete(f3, Right({}))
+            assert scheduler.ref_counts == {}
+            with pytest.raises(Exception):
+                object_store.get(f"{id0}/a")
+        finally:
+            object_store.shutdown()
+
+
+def test_scheduler_priority(manager, object_store):
+        dq = DependentQueue(manager, None, object_store, Scheduler(None))
+        dq.init_thread()
+        dq.put(1)
+        dq.put(2, priority=2)
+        dq.put(3, priority=1)
+        dq.put(4, priority=2)
+        dq.flush()
+        # higher priorities first, the same priority in the order the nodes became ready
+        assert [dq.get(block=False)[0] for _ in range(4)] == [2, 4, 3, 1]
+
+
+def test_scheduler_requeue(manager, object_store):
+        scheduler = Scheduler(None, keep_local=False)
+        dq = DependentQueue(manager, None, object_store, scheduler)
+        dq.init_thread()
+        other = DependentQueue(manager, None, object_store, scheduler)
+        other.init_thread()
+
+        id1 = dq.put(1, names={"a"})
+        dq.put(2, depends_on={id1: {"a"}})
+        dq.flush()
+
+        n, r, sr, f1 = dq.get(block=False)
+        assert n == 1
+        scheduler.requeue([dq.worker])
+        # the node of the lost worker is run by another worker
+        n, r, sr, f = other.get(block=False)
+        assert n == 1
+        other.complete(f, Right({"a": 6}))
+        n, r, sr, f = other.get(block=False)
+        assert n == 2
+        assert r == {"a": 6}
+        with pytest.raises(RuntimeError):
+            dq.complete(f1, Right({"a": 6}))
+
+
+def test_scheduler_pressure(manager, object_store):
+        scheduler = Scheduler(None, keep_local=False)
+        dq = DependentQueue(manager, None, object_store, scheduler)
+        dq.init_thread()
+
+        id1 = dq.put(1, names={"a"})
+        dq.put(2, depends_on={id1: {"a"}})
+        dq.put(3, names={"b"}, priority=1)
+        dq.flush()
+        n, r, sr, f3 = dq.get(block=False)
+        assert n == 3
+        dq.complete(f3, Right({"b": 5}))
+        n, r, sr, f1 = dq.get(block=False)
+        assert n == 1
+        dq.complete(f1, Right({"a": 6}))
+        dq.put(4, names={"c"}, priority=1)
+        dq.flush()
+
+        # when the store is nearly full, nodes that free values come first
+        [node] = scheduler.get_ready_nodes(1, False, None, "w1", 0.95)
+        assert node.o == 2
+        # nodes that add values are held back while other nodes are running
+        with pytest.raises(Empty):
+            scheduler.get_ready_nodes(1, False, None, "w2", 0.95)
+        scheduler.complete_nodes([node.node_id], [f"{id1}/a"], "w1")
+        [node] = scheduler.get_ready_nodes(1, False, None, "w2", 0.95)
+        assert node.o == 4
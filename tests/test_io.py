@@ -0,0 +1,22 @@
+from tx.functional.either import Left, Right
+from tx.parallex.io import ResultBuilder
+from tx.parallex.utils import mappend
+
+
+def test_result_builder():
+    records = [{"0": Right(1)}, {"1": Right([1])}, {"1": Right([2])}, {":error:": Right("a")}, {"2": Left("b")}, {"2": Right(3)}]
+    builder = ResultBuilder()
+    for record in records:
+        builder.add(record)
+    assert builder.build() == {"0": Right(1), "1": Right([1, 2]), ":error:": Right("a"), "2": Left("b")}
+
+
+def test_result_builder_mappend():
+    records = [{"0": Right({"a": 1})}, {"0": Right({"b": 2})}, {"1": Right(1)}, {"1": Right(2)}]
+    builder = ResultBuilder()
+    expected = {}
+    for record in records:
+        builder.add(record)
+    for record in [{"0": Right({"a": 1})}, {"0": Right({"b": 2})}, {"1": Right(1)}, {"1": Right(2)}]:
+        expected = mappend(expected, record)
+    assert builder.build() == expected
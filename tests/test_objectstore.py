@@ -0,0 +1,276 @@
+import os
+import threading
+from multiprocessing import Manager, Process
+import pytest
+from tx.functional.either import Left, Right
+from tx.parallex.objectstore import SharedRefCounts, SharedMemoryStore, NetworkStore, LocalStore, SpillStore
+from tx.parallex.scheduler import PRESSURE_THRESHOLD
+from .test_utils import object_store, manager
+
+
+@pytest.fixture
+def ref_counts(manager):
+    ref_counts = SharedRefCounts(manager, capacity=4, stripes=2)
+    ref_counts.init()
+    try:
+        yield ref_counts
+    finally:
+        ref_counts.shutdown()
+
+
+def test_ref_counts_update(ref_counts):
+    ref_counts.add("a")
+    ref_counts.add("b")
+    assert ref_counts.update({"a": 2, "b": 1}) == []
+    assert ref_counts.update({"a": -1, "b": -1}) == ["b"]
+    assert ref_counts.update({"a": -1}) == ["a"]
+    assert len(ref_counts.slots) == 0
+
+
+def test_ref_counts_reuse_slot(ref_counts):
+    for i in range(8):
+        ref_counts.add(f"a{i}")
+        ref_counts.update({f"a{i}": 1})
+        assert ref_counts.update({f"a{i}": -1}) == [f"a{i}"]
+
+
+def increment(ref_counts, oids, n):
+    for _ in range(n):
+        ref_counts.update({oid: 1 for oid in oids})
+
+
+def add_and_increment(ref_counts, oids):
+    for oid in oids:
+        ref_counts.add(oid)
+    increment(ref_counts, oids, 1)
+
+
+def test_ref_counts_grow(ref_counts):
+    oids = [f"a{i}" for i in range(10)]
+    # segments are added by another process
+    p = Process(target=add_and_increment, args=(ref_counts, oids))
+    p.start()
+    p.join()
+    assert len(ref_counts.segment_names) == 3
+    assert ref_counts.update({oid: 1 for oid in oids}) == []
+    assert sorted(ref_counts.update({oid: -2 for oid in oids})) == oids
+    for i in range(12):
+        ref_counts.add(f"b{i}")
+    assert len(ref_counts.segment_names) == 3
+
+
+def test_ref_counts_forget(ref_counts):
+    ref_counts.add("a")
+    ref_counts.forget("a")
+    assert ref_counts.local_slots == {}
+    assert ref_counts.update({"a": 1}) == []
+
+
+def test_ref_counts_processes(ref_counts):
+    oids = ["a", "b", "c"]
+    for oid in oids:
+        ref_counts.add(oid)
+    ps = [Process(target=increment, args=(ref_counts, oids, 100)) for _ in range(4)]
+    for p in ps:
+        p.start()
+    for p in ps:
+        p.join()
+    assert ref_counts.update({oid: -399 for oid in oids}) == []
+    assert sorted(ref_counts.update({oid: -1 for oid in oids})) == oids
+
+
+def test_store_delete_at_zero(object_store):
+    object_store.init_thread()
+    object_store.put("a", 1)
+    object_store.update_refs({"a": 2})
+    assert object_store.get("a") == 1
+    object_store.decrement_ref("a")
+    assert object_store.get("a") == 1
+    object_store.decrement_ref("a")
+    with pytest.raises(Exception):
+        object_store.get("a")
+
+
+@pytest.fixture
+def shared_memory_store(manager):
+    store = SharedMemoryStore(manager, 1 << 20, arena_size=1 << 16)
+    store.init()
+    try:
+        yield store
+    finally:
+        store.shutdown()
+
+
+def put_objects(store, objs):
+    store.init_thread()
+    for oid, o in objs.items():
+        store.put(oid, o)
+
+
+def test_shared_memory_store_across_processes(shared_memory_store):
+    objs = {"a": Right(1), "b": Left("error"), "c": {"x": [1, 2, b"abc"]}}
+    p = Process(target=put_objects, args=(shared_memory_store, objs))
+    p.start()
+    p.join()
+    for oid, o in objs.items():
+        assert shared_memory_store.get(oid) == o
+
+
+def test_shared_memory_store_zero_copy(shared_memory_store):
+    np = pytest.importorskip("numpy")
+    a = np.arange(1000, dtype="float64")
+    shared_memory_store.put("a", Right(a))
+    b = shared_memory_store.get("a").value
+    assert (a == b).all()
+    assert not b.flags.writeable
+    name, offset, _, buffer_sizes = shared_memory_store.index["a"]
+    assert buffer_sizes == (a.nbytes,)
+
+
+def test_shared_memory_store_reuse(shared_memory_store):
+    for i in range(100):
+        shared_memory_store.put(f"a{i}", bytearray(1 << 12))
+        shared_memory_store.update_refs({f"a{i}": 1})
+        shared_memory_store.decrement_ref(f"a{i}")
+    assert len(shared_memory_store.arenas) == 1
+    assert shared_memory_store.allocated.value == 1 << 16
+
+
+def test_shared_memory_store_release_arenas(manager):
+    store = SharedMemoryStore(manager, 1 << 17, arena_size=1 << 16, full_timeout=0)
+    store.init()
+    try:
+        for i in range(6):
+            store.put(f"a{i}", bytearray(1 << 14))
+        assert len(store.arenas) == 2
+        assert store.allocated.value == 1 << 17
+        for i in range(6):
+            store.delete(f"a{i}")
+        # another arena would exceed mem_size, the empty arenas are released
+        store.put("b", bytearray(100000))
+        [arena] = store.arenas
+        assert store.allocated.value == arena.size
+        assert list(store.arena_names) == [arena.name]
+        assert store.get("b") == bytearray(100000)
+    finally:
+        store.shutdown()
+
+
+def test_shared_memory_store_large_object(shared_memory_store):
+    shared_memory_store.put("a", bytearray(1 << 17))
+    assert shared_memory_store.get("a") == bytearray(1 << 17)
+    [arena] = shared_memory_store.arenas
+    assert arena.size > 1 << 17
+
+
+def test_shared_memory_store_full(shared_memory_store):
+    with pytest.raises(RuntimeError):
+        shared_memory_store.put("a", bytearray(1 << 21))
+
+
+def test_shared_memory_store_many_processes(manager):
+    # more processes than arenas of arena_size fit in mem_size
+    store = SharedMemoryStore(manager, 10 * 1024 * 1024, full_timeout=1)
+    store.init()
+    try:
+        ps = [Process(target=put_objects, args=(store, {f"a{i}": i})) for i in range(8)]
+        for p in ps:
+            p.start()
+        for p in ps:
+            p.join()
+        assert [p.exitcode for p in ps] == [0] * 8
+        assert [store.get(f"a{i}") for i in range(8)] == list(range(8))
+    finally:
+        store.shutdown()
+
+
+def test_shared_memory_store_backpressure(manager):
+    store = SharedMemoryStore(manager, 1 << 16, arena_size=1 << 16, full_timeout=10)
+    store.init()
+    try:
+        store.put("a", bytearray(1 << 15))
+        assert store.pressure() > 0.5
+        # b waits until a is deleted
+        timer = threading.Timer(0.2, store.delete, args=("a",))
+        timer.start()
+        store.put("b", bytearray(1 << 15))
+        timer.join()
+        assert store.get("b") == bytearray(1 << 15)
+        store.delete("b")
+        assert store.pressure() == 0
+    finally:
+        store.shutdown()
+
+
+def test_shared_memory_store_pressure(manager):
+    store = SharedMemoryStore(manager, 1 << 16, full_timeout=0)
+    store.init()
+    try:
+        pressures = []
+        with pytest.raises(RuntimeError):
+            for i in range(100):
+                pressures.append(store.pressure())
+                store.put(f"a{i}", bytearray(1 << 10))
+        # the scheduler throttles before a put fails
+        assert pressures[-1] > PRESSURE_THRESHOLD
+    finally:
+        store.shutdown()
+
+
+def test_network_store_cache():
+    store = LocalStore()
+    a = NetworkStore(store, cache_size=100)
+    b = NetworkStore(store, cache_size=100)
+    a.put("x", "x" * 60)
+    b.put("y", "y" * 60)
+    # y is evicted from the cache of b once it reads x
+    assert b.get("x") == "x" * 60
+    assert list(b.cache.keys()) == ["x"]
+    store.delete("x")
+    # a reads x from its cache
+    assert a.get("x") == "x" * 60
+    assert b.get("x") == "x" * 60
+
+
+@pytest.fixture
+def spill_store(manager, tmp_path):
+    store = SpillStore(manager, 1024, spill_dir=str(tmp_path), spill_size=4096, arena_size=1024, full_timeout=0.1)
+    store.init()
+    try:
+        yield store
+    finally:
+        store.shutdown()
+
+
+def in_file(store, oid):
+    return store.index[oid][0]
+
+
+def test_spill_store_moves_least_recently_used(spill_store):
+    for oid in ["a", "b", "c"]:
+        spill_store.put(oid, oid * 200)
+    assert spill_store.get("a") == "a" * 200
+    # d does not fit in memory, b is moved since a has been read since
+    spill_store.put("d", "d" * 200)
+    assert [in_file(spill_store, oid) for oid in ["a", "b", "c", "d"]] == [False, True, False, False]
+    for oid in ["a", "b", "c", "d"]:
+        assert spill_store.get(oid) == oid * 200
+    spill_store.delete("b")
+    assert spill_store.spilled.value == 0
+    assert os.listdir(spill_store.spill_dir) == []
+
+
+def test_spill_store_large_object(spill_store):
+    spill_store.put("a", bytearray(b"a" * 2000))
+    assert in_file(spill_store, "a")
+    # out-of-band buffers are read in place from the file
+    assert spill_store.get("a") == bytearray(b"a" * 2000)
+    spill_store.update_refs({"a": 1})
+    spill_store.update_refs({"a": -1})
+    assert os.listdir(spill_store.spill_dir) == []
+
+
+def test_spill_store_full(spill_store):
+    spill_store.put("a", bytearray(b"a" * 3000))
+    with pytest.raises(RuntimeError):
+        spill_store.put("b", bytearray(b"b" * 3000))
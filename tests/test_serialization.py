@@ -0,0 +1,41 @@
+import pytest
+from tx.functional.either import Left, Right
+from tx.parallex.serialization import get_serializer, PickleSerializer
+from tx.parallex.io import FileRecordWriter, read_records, read_from_disk
+
+
+@pytest.fixture(params=["pickle", "json", "msgpack"])
+def serializer(request):
+    if request.param == "msgpack":
+        pytest.importorskip("msgpack")
+    return get_serializer(request.param)
+
+
+def test_round_trip(serializer):
+    for o in [1, "a", {"x": [1, 2.5, None]}, {"0.1": Right(1)}, {":error:": Right("error")}, Left("error")]:
+        assert serializer.loads(serializer.dumps(o)) == o
+
+
+def test_out_of_band():
+    np = pytest.importorskip("numpy")
+    serializer = PickleSerializer()
+    a = np.arange(100, dtype="float64")
+    buffers = []
+    data = serializer.dumps(a, buffers)
+    assert [buf.nbytes for buf in buffers] == [a.nbytes]
+    assert (serializer.loads(data, buffers) == a).all()
+
+
+def test_unsupported_serializer():
+    with pytest.raises(RuntimeError):
+        get_serializer("xml")
+
+
+def test_records(tmp_path, serializer):
+    path = tmp_path / "out"
+    with open(path, "wb") as output:
+        writer = FileRecordWriter(output, serializer)
+        writer.write_record({"0": Right(1)})
+        writer.write_record({"1": Right(2)})
+    assert list(read_records(path, serializer)) == [{"0": Right(1)}, {"1": Right(2)}]
+    assert read_from_disk(path, serializer) == {"0": Right(1), "1": Right(2)}
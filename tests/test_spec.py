@@ -0,0 +1,334 @@
+import os
+import pytest
+from tx.parallex.spec import dict_to_spec, preproc_tasks, spec_key, SpecCache, dependency_graph, live_nodes, sort_tasks, free_names, bound_names, propagate_constants, combine_sequential_tasks, assign_priorities, spec_priority, PythonSpec, RetSpec, FusedSpec, DataValue, NameValue
+import tx.parallex.spec
+
+
+spec_dict = {
+    "type": "top",
+    "sub": [{
+        "type": "python",
+        "name": "a",
+        "mod": "tests.test_task",
+        "func": "f",
+        "params": {"x": {"name": "inputs"}}
+    }, {
+        "type": "python",
+        "name": "b",
+        "mod": "tests.test_task",
+        "func": "f",
+        "params": {"x": {"data": 1}}
+    }, {
+        "type": "ret",
+        "obj": {"name": "a"}
+    }]
+}
+
+
+def test_preproc_tasks_does_not_modify_spec():
+    spec = dict_to_spec(spec_dict)
+    compiled = preproc_tasks({"inputs"}, spec)
+    assert spec == dict_to_spec(spec_dict)
+    assert [bound_names(sub) for sub in compiled.sub] == [{"a"}]
+
+
+def test_spec_key():
+    key = spec_key({"inputs"}, dict_to_spec(spec_dict))
+    assert key == spec_key({"inputs"}, dict_to_spec(spec_dict))
+    assert key != spec_key({"inputs", "other"}, dict_to_spec(spec_dict))
+    assert key != spec_key({"inputs"}, dict_to_spec({**spec_dict, "sub": spec_dict["sub"][1:]}))
+
+
+def count_preproc_tasks(monkeypatch):
+    calls = []
+    preproc = tx.parallex.spec.preproc_tasks
+    def preproc_count(inputs, spec):
+        calls.append(inputs)
+        return preproc(inputs, spec)
+    monkeypatch.setattr(tx.parallex.spec, "preproc_tasks", preproc_count)
+    return calls
+
+
+def test_spec_cache(monkeypatch):
+    calls = count_preproc_tasks(monkeypatch)
+    cache = SpecCache()
+    compiled = cache.preproc_tasks({"inputs"}, dict_to_spec(spec_dict))
+    assert cache.preproc_tasks({"inputs"}, dict_to_spec(spec_dict)) is compiled
+    assert compiled == preproc_tasks({"inputs"}, dict_to_spec(spec_dict))
+    assert len(calls) == 1
+
+
+def test_spec_cache_evict(monkeypatch):
+    calls = count_preproc_tasks(monkeypatch)
+    cache = SpecCache(max_size=1)
+    cache.preproc_tasks({"inputs"}, dict_to_spec(spec_dict))
+    cache.preproc_tasks({"inputs", "other"}, dict_to_spec(spec_dict))
+    cache.preproc_tasks({"inputs"}, dict_to_spec(spec_dict))
+    assert len(calls) == 3
+
+
+def test_spec_cache_disk(monkeypatch, tmp_path):
+    calls = count_preproc_tasks(monkeypatch)
+    compiled = SpecCache(str(tmp_path)).preproc_tasks({"inputs"}, dict_to_spec(spec_dict))
+    assert sorted(os.listdir(tmp_path)) == [".secret", f"{spec_key({'inputs'}, dict_to_spec(spec_dict))}.pickle"]
+    assert SpecCache(str(tmp_path)).preproc_tasks({"inputs"}, dict_to_spec(spec_dict)) == compiled
+    assert len(calls) == 1
+
+
+def test_spec_cache_disk_tampered(monkeypatch, tmp_path):
+    calls = count_preproc_tasks(monkeypatch)
+    SpecCache(str(tmp_path)).preproc_tasks({"inputs"}, dict_to_spec(spec_dict))
+    path = tmp_path / f"{spec_key({'inputs'}, dict_to_spec(spec_dict))}.pickle"
+    data = path.read_bytes()
+    path.write_bytes(data[:-1] + bytes([data[-1] ^ 1]))
+    # the file is not unpickled since its HMAC does not match
+    SpecCache(str(tmp_path)).preproc_tasks({"inputs"}, dict_to_spec(spec_dict))
+    assert len(calls) == 2
+
+
+def test_spec_cache_disk_writable_by_others(tmp_path):
+    os.chmod(tmp_path, 0o777)
+    cache = SpecCache(str(tmp_path))
+    assert cache.path is None
+    cache.preproc_tasks({"inputs"}, dict_to_spec(spec_dict))
+    assert os.listdir(tmp_path) == []
+
+
+def test_live_nodes():
+    spec = dict_to_spec(spec_dict)
+    dg, ret_ids = dependency_graph({"inputs"}, spec)
+    live = live_nodes(dg, ret_ids)
+    assert live - {"@input"} == {node for node in dg.nodes() if node != "@input" and any(node == a or dg.is_connected(node, a) for a in ret_ids)}
+    assert [sub.name for sub in spec.sub if sub.node_id in live and isinstance(sub, PythonSpec)] == ["a"]
+
+
+def test_remove_unreachable_tasks_map():
+    spec = dict_to_spec({
+        "type": "top",
+        "sub": [{
+            "type": "map",
+            "coll": {"name": "inputs"},
+            "var": "x",
+            "sub": {
+                "type": "python",
+                "name": "y",
+                "mod": "tests.test_task",
+                "func": "f",
+                "params": {"x": {"name": "x"}}
+            }
+        }, {
+            "type": "map",
+            "coll": {"name": "inputs"},
+            "var": "x",
+            "sub": {
+                "type": "ret",
+                "obj": {"name": "x"}
+            }
+        }]
+    })
+    compiled = preproc_tasks({"inputs"}, spec)
+    assert len(compiled.sub) == 1
+    assert isinstance(compiled.sub[0].sub, RetSpec)
+
+
+def python_spec(name, *params):
+    return dict_to_spec({"type": "python", "name": name, "mod": "tests.test_task", "func": "f", "params": {i: {"name": p} for i, p in enumerate(params)}})
+
+
+def test_sort_tasks():
+    subs = [python_spec("c", "a", "b"), python_spec("b", "a"), python_spec("a", "x"), python_spec("d", "x")]
+    assert [sub.name for sub in sort_tasks({"x"}, subs)] == ["a", "b", "c", "d"]
+
+
+def test_sort_tasks_cycle():
+    subs = [python_spec("a", "b"), python_spec("b", "a"), python_spec("c", "x")]
+    with pytest.raises(RuntimeError, match="cycle"):
+        sort_tasks(set(), subs)
+
+
+def test_free_names_memoized():
+    spec = dict_to_spec({"type": "top", "sub": []})
+    spec.sub = [python_spec("a", "x")]
+    assert free_names(spec) == {"x"}
+    assert bound_names(spec) == set()
+    spec.sub = [python_spec("a", "y")]
+    assert free_names(spec) == {"y"}
+
+
+def test_propagate_constants():
+    spec = dict_to_spec({
+        "type": "top",
+        "sub": [{
+            "type": "let",
+            "name": "a",
+            "obj": {"data": 1}
+        }, {
+            "type": "python",
+            "name": "b",
+            "mod": "tx.parallex.data",
+            "func": "_add",
+            "params": {0: {"name": "a"}, 1: {"data": 2}}
+        }, {
+            "type": "python",
+            "name": "c",
+            "mod": "tests.test_task",
+            "func": "f",
+            "params": {"x": {"name": "b"}}
+        }, {
+            "type": "ret",
+            "obj": {"name": "c"}
+        }, {
+            "type": "ret",
+            "obj": {"name": "b"}
+        }]
+    })
+    compiled, removed = propagate_constants(set(), spec)
+    assert removed == 2
+    assert [type(sub) for sub in compiled.sub] == [PythonSpec, RetSpec, RetSpec]
+    assert compiled.sub[0].params == {"x": DataValue(data=3)}
+    assert compiled.sub[2].obj == DataValue(data=3)
+    assert free_names(compiled) == set()
+
+
+def test_propagate_constants_seq_and_inputs():
+    spec = dict_to_spec({
+        "type": "top",
+        "sub": [{
+            "type": "seq",
+            "sub": [{
+                "type": "let",
+                "name": "a",
+                "obj": {"data": 1}
+            }, {
+                "type": "let",
+                "name": "inputs",
+                "obj": {"data": 2}
+            }]
+        }, {
+            "type": "python",
+            "name": "b",
+            "mod": "tx.parallex.data",
+            "func": "_div",
+            "params": {0: {"name": "a"}, 1: {"data": 0}}
+        }, {
+            "type": "ret",
+            "obj": {"name": "a"}
+        }]
+    })
+    compiled, removed = propagate_constants({"inputs"}, spec)
+    assert removed == 1
+    assert [sub.name for sub in compiled.sub[0].sub] == ["inputs"]
+    # errors are reported when the task is executed
+    assert compiled.sub[1].params == {0: DataValue(data=1), 1: DataValue(data=0)}
+    assert compiled.sub[2].obj == DataValue(data=1)
+
+
+def data_spec(name, func, *params):
+    return {"type": "python", "name": name, "mod": "tx.parallex.data", "func": func, "params": {i: {"data": p} for i, p in enumerate(params)}}
+
+
+def test_propagate_constants_immutable_scalars():
+    spec = dict_to_spec({
+        "type": "top",
+        "sub": [
+            data_spec("a", "_add", "x", "y"),
+            data_spec("b", "_tuple", 1, 2),
+            data_spec("c", "_list", 1, 2),
+            data_spec("d", "_pow", 10, 100000),
+            data_spec("e", "_mult", "x", 100000),
+            data_spec("f", "_subscript", [[1], [2]], 0)
+        ] + [{"type": "ret", "obj": {"name": name}} for name in "abcdef"]
+    })
+    compiled, removed = propagate_constants(set(), spec)
+    # mutable values and large values are computed when the spec is executed
+    assert removed == 2
+    assert [sub.name for sub in compiled.sub if isinstance(sub, PythonSpec)] == ["c", "d", "e", "f"]
+    assert [sub.obj for sub in compiled.sub if isinstance(sub, RetSpec)][:2] == [DataValue(data="xy"), DataValue(data=(1, 2))]
+
+
+def test_propagate_constants_map_coll():
+    spec = dict_to_spec({
+        "type": "top",
+        "sub": [{
+            "type": "let",
+            "name": "a",
+            "obj": {"data": [1, 2]}
+        }, {
+            "type": "let",
+            "name": "b",
+            "obj": {"data": 1}
+        }, {
+            "type": "map",
+            "coll": {"name": "a"},
+            "var": "b",
+            "sub": {
+                "type": "ret",
+                "obj": {"name": "b"}
+            }
+        }]
+    })
+    compiled, removed = propagate_constants(set(), spec)
+    assert removed == 1
+    assert compiled.sub[0].name == "a"
+    assert compiled.sub[1].coll == NameValue(name="a")
+    assert compiled.sub[1].sub.obj == NameValue(name="b")
+
+
+def python_call_spec(name, mod, func, *params):
+    return {"type": "python", "name": name, "mod": mod, "func": func, "params": {i: {"name": p} for i, p in enumerate(params)}}
+
+
+def test_combine_sequential_tasks():
+    spec = dict_to_spec({
+        "type": "top",
+        "sub": [
+            {"type": "ret", "obj": {"name": "c"}},
+            python_call_spec("c", "tests.test_task", "f", "b"),
+            python_call_spec("b", "tests.test_task", "f", "a"),
+            python_call_spec("a", "tests.test_task", "f", "x")
+        ]
+    })
+    compiled, fused = combine_sequential_tasks(spec)
+    assert fused == 3
+    [sub] = compiled.sub
+    assert isinstance(sub, FusedSpec)
+    assert [type(x) for x in sub.sub] == [PythonSpec, PythonSpec, PythonSpec, RetSpec]
+    assert free_names(compiled) == {"x"}
+
+
+def test_combine_sequential_tasks_parallel():
+    spec = dict_to_spec({
+        "type": "top",
+        "sub": [
+            python_call_spec("a", "tests.test_task", "f", "x"),
+            python_call_spec("b", "tests.test_task", "f", "x"),
+            python_call_spec("c", "tx.parallex.data", "_add", "x", "x"),
+            python_call_spec("d", "tests.test_task", "add", "a", "b"),
+            python_call_spec("e", "tests.test_task", "add", "d", "c"),
+            {"type": "ret", "obj": {"name": "e"}},
+            {"type": "ret", "obj": {"name": "a"}}
+        ]
+    })
+    compiled, fused = combine_sequential_tasks(spec)
+    # a has two consumers, b is expensive and d has another input, c is cheap, then d is the only input of e
+    assert fused == 3
+    assert [[x.name for x in sub.sub if not isinstance(x, RetSpec)] if isinstance(sub, FusedSpec) else sub.name for sub in compiled.sub if not isinstance(sub, RetSpec)] == ["a", "b", ["d", "c", "e"]]
+    [fused_spec] = [sub for sub in compiled.sub if isinstance(sub, FusedSpec)]
+    assert isinstance(fused_spec.sub[-1], RetSpec)
+
+
+def test_assign_priorities():
+    spec = dict_to_spec({
+        "type": "top",
+        "sub": [
+            python_call_spec("a", "tests.test_task", "f", "x"),
+            {**python_call_spec("b", "tests.test_task", "f", "a"), "weight": 5},
+            python_call_spec("c", "tests.test_task", "f", "x"),
+            {"type": "ret", "obj": {"name": "b"}},
+            {"type": "ret", "obj": {"name": "c"}}
+        ]
+    })
+    dg, _ = dependency_graph({"x"}, spec)
+    assign_priorities(dg, spec)
+    assert {sub.name: spec_priority(sub) for sub in spec.sub if isinstance(sub, PythonSpec)} == {"a": 6, "b": 5, "c": 1}
+    assert all(spec_priority(sub) == 0 for sub in spec.sub if isinstance(sub, RetSpec))
@@ -1,4 +1,6 @@
 import sys
+import time
+import asyncio
 from multiprocessing import Manager
 from queue import Empty
 import pathlib
@@ -8,10 +10,13 @@ from tempfile import mkstemp
 import shelve
 import os
 import pytest
-from tx.parallex import start, start_python
-from tx.parallex.task import enqueue, EndOfQueue
-from tx.parallex.io import read_from_disk
+from tx.parallex import start, start_python, start_iter, start_python_iter, Session
+from tx.parallex.task import enqueue, EndOfQueue, evaluate, either_data, clear_function_cache, vectorized, MapChunk
+import tx.parallex.task
+import tx.parallex.backend
+from tx.parallex.io import read_from_disk, RecordWriter
 from tx.parallex.dependentqueue import DependentQueue
+from tx.parallex.objectstore import SharedMemoryStore
 from tx.parallex.spec import dict_to_spec
 from tx.parallex.data import Starred
 from tx.functional.maybe import Just
@@ -374,6 +379,285 @@ def test_level_start_1():
         assert ret == {f"{i}": Right(i+2) for i in [0,1,2]}
 
 
+@pytest.mark.parametrize("level", [0, 1])
+def test_level_start_without_scheduler(level):
+
+        spec = {
+                "type":"map",
+                "coll": {
+                    "name": "inputs"
+                },
+                "var":"y",
+                "sub": {
+                    "type":"top",
+                    "sub": [{
+                        "type": "python",
+                        "name": "a",
+                        "mod": "tests.test_task",
+                        "func": "f",
+                        "params": {
+                            "x": {
+                                "name": "y"
+                            }
+                        }
+                    }, {
+                        "type": "ret",
+                        "obj": {
+                            "name": "a"
+                        }
+                    }]
+                }
+        }
+        data = {
+            "inputs": [1, 2, 3]
+        }
+        
+        ret = start(3, spec, data, [], True, None, level, None, scheduler=False)
+        assert ret == {f"{i}": Right(i+2) for i in [0,1,2]}
+
+
+@pytest.mark.parametrize("batch_size", [4, None])
+def test_batch_size_start(batch_size):
+
+    py = """
+from tx.functional.utils import identity
+from tests.test_task import f
+a = identity(inputs)
+for i in a:
+    b = f(i)
+    return b
+"""
+
+    data = {
+        "inputs": list(range(20))
+    }
+        
+    ret = start_python(3, py, data, [], True, None, 1, None, batch_size=batch_size)
+    assert ret == {f"{i}": Right(i+1) for i in range(20)}
+
+
+@pytest.mark.parametrize("serializer", ["pickle", "json"])
+def test_serializer_start(serializer):
+
+    py = """
+from tx.functional.utils import identity
+from tests.test_task import f
+a = identity(inputs)
+for i in a:
+    b = f(i)
+    return b
+"""
+
+    data = {
+        "inputs": list(range(20))
+    }
+
+    ret = start_python(3, py, data, [], True, None, 1, None, serializer=serializer)
+    assert ret == {f"{i}": Right(i+1) for i in range(20)}
+
+
+@pytest.mark.parametrize("level", [0, 1])
+def test_start_iter(level):
+
+    py = """
+from tx.functional.utils import identity
+from tests.test_task import f
+a = identity(inputs)
+for i in a:
+    b = f(i)
+    return b
+"""
+
+    data = {
+        "inputs": list(range(20))
+    }
+
+    ret = list(start_python_iter(3, py, data, [], True, level, None, buffer_size=2))
+    assert sorted(ret) == sorted((f"{i}", Right(i+1)) for i in range(20))
+
+
+def test_start_iter_close():
+
+    spec = {
+        "type": "map",
+        "coll": {"data": list(range(1000))},
+        "var": "x",
+        "sub": {
+            "type": "ret",
+            "obj": {"name": "x"}
+        }
+    }
+
+    it = start_iter(2, spec, {}, [], True, 1, None, buffer_size=1)
+    ret_prefix, value = next(it)
+    assert value == Right(int(ret_prefix))
+    it.close()
+
+
+def test_session():
+
+    py = """
+from tx.functional.utils import identity
+from tests.test_task import f
+a = identity(inputs)
+for i in a:
+    b = f(i)
+    return b
+"""
+
+    with Session(3) as session:
+        for n in range(1, 5):
+            ret = session.start_python(py, {"inputs": list(range(n))}, level=1)
+            assert ret == {f"{i}": Right(i+1) for i in range(n)}
+        assert len(session.object_store.index) == 0
+
+
+def test_session_iter():
+
+    py = """
+from tx.functional.utils import identity
+from tests.test_task import f
+a = identity(inputs)
+for i in a:
+    b = f(i)
+    return b
+"""
+
+    with Session(2, buffer_size=1) as session:
+        it = session.start_python_iter(py, {"inputs": list(range(1000))})
+        ret_prefix, value = next(it)
+        assert value == Right(int(ret_prefix) + 1)
+        it.close()
+        ret = sorted(session.start_python_iter(py, {"inputs": list(range(20))}))
+        assert ret == sorted((f"{i}", Right(i+1)) for i in range(20))
+        assert len(session.object_store.index) == 0
+
+
+@pytest.mark.parametrize("level,scheduler", [(0, True), (1, True), (0, False)])
+def test_map_range_start(level, scheduler):
+
+    py = """
+from tests.test_task import f, add
+a = f(1)
+for i in inputs:
+    b = add(a, i)
+    return b
+"""
+
+    data = {
+        "inputs": list(range(600))
+    }
+
+    ret = start_python(3, py, data, [], True, None, level, None, scheduler=scheduler)
+    assert ret == {f"{i}": Right(i+2) for i in range(600)}
+
+
+@pytest.mark.parametrize("n", [10, 600])
+def test_map_range_error_input(n):
+
+    py = """
+from tests.test_task import add
+a = tx.functional.utils.non_existent(1)
+for i in inputs:
+    b = add(a, i)
+    return b
+"""
+
+    data = {
+        "inputs": list(range(n))
+    }
+
+    # rows expanded by MapRange tasks have their own results, as rows generated by the coordinator
+    ret = start_python(3, py, data, [], True, None, 1, None)
+    assert sorted(ret.keys()) == sorted(f"{i}" for i in range(n))
+    assert all(isinstance(v, Left) for v in ret.values())
+    ret = start_python(3, py, data, [], True, None, 0, None)
+    assert list(ret.keys()) == [":error:"]
+
+
+def test_dynamic_map_range_start():
+
+    py = """
+from tx.functional.utils import identity
+from tests.test_task import f
+a = identity(inputs)
+for i in a:
+    b = f(i)
+    return b
+"""
+
+    data = {
+        "inputs": list(range(600))
+    }
+
+    ret = start_python(3, py, data, [], True, None, 1, None)
+    assert ret == {f"{i}": Right(i+1) for i in range(600)}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 100, 1000])
+@pytest.mark.parametrize("n", [10, 600])
+def test_chunk_size_start(chunk_size, n):
+
+    py = """
+from tests.test_task import f, add
+a = f(1)
+for i in inputs:
+    b = add(a, i)
+    return b
+"""
+
+    data = {
+        "inputs": list(range(n))
+    }
+
+    ret = start_python(3, py, data, [], True, None, 0, None, chunk_size=chunk_size)
+    assert ret == {f"{i}": Right(i+2) for i in range(n)}
+
+
+def test_chunk_size_spec():
+
+    spec = {
+        "type": "map",
+        "coll": {"data": list(range(10))},
+        "var": "x",
+        "chunk_size": 4,
+        "sub": {
+            "type": "cond",
+            "on": {"name": "x"},
+            "then": {
+                "type": "ret",
+                "obj": {"name": "x"}
+            },
+            "else": {
+                "type": "ret",
+                "obj": {"data": "zero"}
+            }
+        }
+    }
+
+    ret = start(3, spec, {}, [], True, None, 0, None)
+    assert ret == {"0": Right("zero"), **{f"{i}": Right(i) for i in range(1, 10)}}
+
+
+def test_chunk_size_dynamic_iter():
+
+    py = """
+from tx.functional.utils import identity
+from tests.test_task import f
+a = identity(inputs)
+for i in a:
+    b = f(i)
+    return b
+"""
+
+    data = {
+        "inputs": list(range(20))
+    }
+
+    ret = list(start_python_iter(3, py, data, [], True, 0, None, chunk_size=7))
+    assert sorted(ret) == sorted((f"{i}", Right(i+1)) for i in range(20))
+
+
 def test_dynamic_level_start_0():
 
     py = """
@@ -1056,6 +1340,32 @@ for j in tx.functional.utils.identity([1]):
         assert ret == {"0": Right(3)}
 
 
+@pytest.mark.parametrize("level", [0, 1])
+def test_fused_error(level):
+        py = """
+a = tx.functional.utils.non_existent(x)
+b = tests.test_task.f(a)
+c = b
+return c"""
+
+        ret = start_python(3, py, {"x": 1}, [], True, None, level, None)
+        assert list(ret.keys()) == [""]
+        assert isinstance(ret[""], Left)
+        assert "non_existent" in ret[""].value[0]
+
+
+@pytest.mark.parametrize("level", [0, 1])
+def test_fused_let_map(level):
+        py = """
+for i in inputs:
+    a = i
+    b = tests.test_task.f(a)
+    return b"""
+
+        ret = start_python(3, py, {"inputs": [1, 2]}, [], True, None, level, None)
+        assert ret == {"0": Right(2), "1": Right(3)}
+
+
 def test_for_error():
         py = """
 d = [2,3]
@@ -1218,6 +1528,267 @@ def add(a,b):
     return a+b
 
 
+def sub(a, b):
+    return a - b
+
+
+class ListRecordWriter(RecordWriter):
+    def __init__(self):
+        self.records = []
+
+    def write_record(self, obj):
+        self.records.append(obj)
+
+
+def test_evaluate_resolves_function_once(monkeypatch):
+    clear_function_cache()
+    imported = []
+    import_module = tx.parallex.task.import_module
+    def import_module_count(mod):
+        imported.append(mod)
+        return import_module(mod)
+    monkeypatch.setattr(tx.parallex.task, "import_module", import_module_count)
+
+    spec = dict_to_spec({
+        "type": "map",
+        "coll": {"data": list(range(10))},
+        "var": "x",
+        "sub": {
+            "type": "seq",
+            "sub": [{
+                "type": "python",
+                "name": "y",
+                "mod": "tests.test_task",
+                "func": "sub",
+                "params": {1: {"name": "x"}, 0: {"data": 100}}
+            }, {
+                "type": "ret",
+                "obj": {"name": "y"}
+            }]
+        }
+    })
+    output = ListRecordWriter()
+    evaluate(spec, either_data({}), [], output, {})
+    assert output.records == [{f"{i}": Right(100 - i)} for i in range(10)]
+    assert imported == ["tests.test_task"]
+
+
+vadd_calls = []
+
+
+@vectorized
+def vadd(a, b):
+    vadd_calls.append(len(a) if hasattr(a, "__len__") else None)
+    return a + b
+
+
+def vfail(a):
+    if not isinstance(a, int):
+        raise RuntimeError("not vectorized")
+    return -a
+
+
+def map_chunk_spec(func, vectorized=False):
+    return dict_to_spec({
+        "type": "seq",
+        "sub": [{
+            "type": "python",
+            "name": "y",
+            "mod": "tests.test_task",
+            "func": func,
+            "params": {0: {"name": "x"}, 1: {"data": 100}} if func == "vadd" else {0: {"name": "x"}},
+            "vectorized": vectorized
+        }, {
+            "type": "ret",
+            "obj": {"name": "y"}
+        }]
+    })
+
+
+def test_map_chunk_vectorized():
+    pytest.importorskip("numpy")
+    vadd_calls.clear()
+    output = ListRecordWriter()
+    MapChunk("chunk", "x", map_chunk_spec("vadd"), {}, list(range(10)), 5, []).baseRun({}, {}, None, output)
+    assert vadd_calls == [10]
+    assert output.records == [{f"{i}": Right(i + 95)} for i in range(5, 15)]
+
+
+def test_map_chunk_vectorized_flag_falls_back_per_row():
+    output = ListRecordWriter()
+    MapChunk("chunk", "x", map_chunk_spec("vfail", True), {}, list(range(3)), 0, []).baseRun({}, {}, None, output)
+    assert output.records == [{f"{i}": Right(-i)} for i in range(3)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4])
+def test_vectorized_start(chunk_size):
+
+    py = """
+from tests.test_task import vadd
+for i in inputs:
+    b = vadd(i, 1)
+    return b
+"""
+
+    data = {
+        "inputs": list(range(10))
+    }
+
+    ret = start_python(3, py, data, [], True, None, 0, None, chunk_size=chunk_size)
+    assert ret == {f"{i}": Right(i+1) for i in range(10)}
+
+
+async def asleep(x):
+    await asyncio.sleep(0.2)
+    if x < 0:
+        raise RuntimeError("negative")
+    return x + 1
+
+
+@pytest.mark.parametrize("concurrency,level", [(1, 0), (20, 0), (20, 1)])
+def test_async_start(concurrency, level):
+
+    py = """
+from tests.test_task import asleep
+for i in inputs:
+    b = asleep(i)
+    return b
+"""
+
+    data = {
+        "inputs": list(range(-1, 19))
+    }
+
+    start_time = time.time()
+    ret = start_python(1, py, data, [], True, None, level, None, concurrency=concurrency)
+    duration = time.time() - start_time
+    assert ret["0"].value[0] == "negative"
+    assert {k: v for k, v in ret.items() if k != "0"} == {f"{i}": Right(i) for i in range(1, 20)}
+    if concurrency > 1:
+        assert duration < 20 * 0.2
+
+
+@pytest.mark.parametrize("level", [0, 1])
+def test_threads_start(level):
+
+    py = """
+from tests.test_task import add
+for i in inputs:
+    b = add(i, 1)
+    c = add(b, b)
+    return c
+"""
+
+    data = {
+        "inputs": list(range(10))
+    }
+
+    ret = start_python(3, py, data, [], True, None, level, None, executor="threads")
+    assert ret == {f"{i}": Right(2 * (i + 1)) for i in range(10)}
+
+
+def test_threads_start_iter_stop_early():
+
+    py = """
+from tests.test_task import add
+for i in inputs:
+    b = add(i, 1)
+    return b
+"""
+
+    data = {
+        "inputs": list(range(100))
+    }
+
+    records = start_python_iter(3, py, data, [], True, 0, None, buffer_size=1, executor="threads")
+    assert next(records)[1].value in range(1, 101)
+    records.close()
+
+
+@pytest.mark.parametrize("executor", ["processes", "threads", "subinterpreters"])
+def test_executor_start(executor):
+    if executor == "subinterpreters" and tx.parallex.backend.interpreters is None:
+        with pytest.raises(RuntimeError):
+            start(1, {"type": "top", "sub": []}, {}, [], True, None, 0, None, executor=executor)
+        return
+
+    py = """
+from tests.test_task import add
+for i in inputs:
+    b = add(i, 1)
+    return b
+"""
+
+    data = {
+        "inputs": list(range(10))
+    }
+
+    ret = start_python(2, py, data, [], True, None, 0, None, executor=executor)
+    assert ret == {f"{i}": Right(i + 1) for i in range(10)}
+    assert sorted(v.value for _, v in start_python_iter(2, py, data, [], True, 0, None, executor=executor)) == list(range(1, 11))
+
+
+def test_threads_no_scheduler():
+    with pytest.raises(ValueError):
+        start(1, {"type": "top", "sub": []}, {}, [], True, None, 0, None, scheduler=False, executor="threads")
+
+
+@pytest.mark.skipif(sys.version_info < (3, 14), reason="subinterpreters require Python 3.14")
+def test_subinterpreter_backend():
+    assert tx.parallex.backend.interpreters is not None
+    backend = tx.parallex.backend.get_backend("subinterpreters")
+    try:
+        assert isinstance(backend, tx.parallex.backend.SubinterpreterBackend)
+        assert backend.output_queue(1) is not None
+    finally:
+        backend.shutdown()
+
+
+def test_store_size():
+    assert tx.parallex.backend.auto_store_size() >= tx.parallex.backend.DEFAULT_STORE_SIZE
+
+    py = """
+from tests.test_task import add
+for i in inputs:
+    b = add(i, 1)
+    c = add(b, b)
+    d = add(b, c)
+    return d
+"""
+
+    data = {
+        "inputs": list(range(10))
+    }
+
+    ret = start_python(3, py, data, [], True, None, 0, None, store_size=1 << 16)
+    assert ret == {f"{i}": Right(3 * (i + 1)) for i in range(10)}
+
+    py = """
+from tests.test_task import add
+a = add(1, 1)
+b = add(2, 2)
+for i in inputs:
+    c = add(a, b)
+    d = add(c, i)
+    return d
+"""
+
+    # a small store shared by more workers than arenas of the default size fit in it
+    with Manager() as manager:
+        store = SharedMemoryStore(manager, 1 << 16, full_timeout=1)
+        store.init()
+        try:
+            ret = start_python(4, py, data, [], True, None, 0, store)
+            assert ret == {f"{i}": Right(6 + i) for i in range(10)}
+        finally:
+            store.shutdown()
+
+
+def test_unsupported_executor():
+    with pytest.raises(RuntimeError):
+        start(1, {"type": "top", "sub": []}, {}, [], True, None, 0, None, executor="fibers")
+
+
 def test_map_data_start():
     
         py = """
@@ -2,7 +2,7 @@ import logging
 from multiprocessing import Manager
 import pytest
 from tx.readable_log import getLogger, format_message
-from tx.parallex.objectstore import PlasmaStore, SimpleStore
+from tx.parallex.objectstore import PlasmaStore, SimpleStore, SharedMemoryStore, LocalStore, NetworkStore, SpillStore
 
 logger = getLogger(__name__, logging.INFO)
 
@@ -11,13 +11,13 @@ def manager():
     with Manager() as manager:
         yield manager
         
-@pytest.fixture(params=[lambda manager: PlasmaStore(manager, 100000), SimpleStore])
+@pytest.fixture(params=[lambda manager: PlasmaStore(manager, 100000), SimpleStore, lambda manager: SharedMemoryStore(manager, 10000000), lambda manager: SpillStore(manager, 10000000), lambda manager: LocalStore(), lambda manager: NetworkStore(LocalStore())])
 def object_store(manager, request):
     p = request.param(manager)
+    p.init()
     try:
-        p.init()
         yield p
-    except:
+    finally:
         p.shutdown()
 
 